@@ -5,6 +5,6 @@ class AccountConfig(AppConfig):
     name = 'account'
     
     def ready(self):
-        import account.signal
+        import account.signals
     
     
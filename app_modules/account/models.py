@@ -6,7 +6,8 @@ from django.db import models
 from django.utils import timezone
 
 from lib.constants import USER_TYPE, UserConstants, PROFESSION_TYPE
-from lib.helpers import rename_file_name, converter_to_webp
+from lib.helpers import rename_file_name
+from lib.media import MediaFieldsMixin
 from lib.models import BaseModel
 from .managers import UserManager
 
@@ -90,7 +91,7 @@ class CustomerGroup(BaseModel):
         return f"{self.name}"
 
 
-class CustomerFrame(BaseModel):
+class CustomerFrame(MediaFieldsMixin, BaseModel):
     customer = models.ForeignKey(User, on_delete=models.CASCADE, related_name="customer_frame")
     profession_type = models.CharField(max_length=100, choices=PROFESSION_TYPE, null=True, blank=True)
     business_category = models.ForeignKey(
@@ -110,6 +111,10 @@ class CustomerFrame(BaseModel):
         null=True, blank=True
     )
     display_name = models.CharField(max_length=20, null=True, blank=True)
+
+    media_fields = ('frame_img',)
+    media_profiles = {'frame_img': 'frame'}
+    overlay_fields = ('frame_img',)
     
     class Meta:
         indexes = [
@@ -123,11 +128,6 @@ class CustomerFrame(BaseModel):
     def __str__(self) -> str:
         return f"{self.customer.whatsapp_number} and {self.group}"
 
-    def save(self, *args, **kwargs):
-        if self.frame_img:
-            converter_to_webp(self.frame_img)
-        super().save(*args, **kwargs)
-
     def is_a_group(self):
         # Check if the group name starts with 'A'
         return self.group.name.startswith('A') if self.group else False
@@ -165,7 +165,7 @@ def order_number():
     return new_order_no
 
 
-class Subscription(BaseModel):
+class Subscription(MediaFieldsMixin, BaseModel):
     order_number = models.CharField(max_length=10, default=order_number, unique=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="subscription_users")
     frame = models.ForeignKey(CustomerFrame, on_delete=models.SET_NULL,
@@ -178,6 +178,8 @@ class Subscription(BaseModel):
     transaction_number = models.CharField(max_length=50, null=True, blank=True)
     file = models.FileField(upload_to=rename_file_name('subscription/'), null=True, blank=True)
     is_active = models.BooleanField(default=True)
+
+    media_fields = ('file',)
     
     class Meta:
         indexes = [
@@ -194,6 +196,4 @@ class Subscription(BaseModel):
     def save(self, *args, **kwargs):
         if not self.order_number:
             self.order_number = order_number()
-        if self.file:
-            converter_to_webp(self.file)
         super().save(*args, **kwargs)
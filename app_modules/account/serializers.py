@@ -3,12 +3,15 @@ from datetime import date
 from rest_framework import serializers
 from rest_framework.serializers import ValidationError
 
-from app_modules.post.models import Post, CustomerPostFrameMapping, CustomerOtherPostFrameMapping, OtherPost
 from .models import (
     User, CustomerFrame, CustomerGroup, PaymentMethod, Plan, Subscription
 )
+from .tasks import FRAME_REMAP
 from django.db.models import F
 
+from lib.dispatch import dispatcher
+from lib.media import MediaMetadataField, MediaStatusField, ResponsiveMediaSerializerMixin
+
 
 class CustomerRegistrationSerializer(serializers.ModelSerializer):
     whatsapp_number = serializers.CharField(allow_null=True, required=False)
@@ -59,15 +62,17 @@ class UserProfileListSerializer(serializers.ModelSerializer):
         ]
 
 
-class CustomerFrameSerializer(serializers.ModelSerializer):
+class CustomerFrameSerializer(ResponsiveMediaSerializerMixin, serializers.ModelSerializer):
     group_name = serializers.SerializerMethodField()
     mobile_number = serializers.SerializerMethodField()
     business_category_name = serializers.SerializerMethodField()
+    frame_img_status = MediaStatusField(source='frame_img')
+    frame_img_metadata = MediaMetadataField(source='frame_img')
 
     class Meta:
         model = CustomerFrame
         fields = (
-            'id', 'customer', 'frame_img', 'group', 'group_name', 'display_name', 'mobile_number', 'business_category',
+            'id', 'customer', 'frame_img', 'frame_img_status', 'frame_img_metadata', 'group', 'group_name', 'display_name', 'mobile_number', 'business_category',
             'profession_type', 'business_category_name', 'updated_on'
         )
 
@@ -109,48 +114,15 @@ class CustomerFrameSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
     def update(self, instance, validated_data):
-        current_date = date.today()
-        old_group_id = instance.group.id if instance.group else None
+        old_group_id = instance.group_id
 
         # Update the instance with validated data
         instance = super().update(instance, validated_data)
 
-        if old_group_id and 'group' in validated_data:
-            new_group_id = validated_data['group'].id if validated_data['group'] else None
-            
-            new_post_ids = Post.objects.filter(
-                group_id=new_group_id,
-                event__event_date__gte=current_date
-            ).values_list('id', flat=True)
-            
-            new_other_post_ids = OtherPost.objects.filter(group_id=new_group_id).values_list('id', flat=True)
-            
-            old_post_ids = Post.objects.filter(
-                group_id=old_group_id,
-                event__event_date__gte=current_date
-            ).values_list('id', flat=True)
-            
-            old_other_post_ids = OtherPost.objects.filter(group_id=old_group_id).values_list('id', flat=True)
-            
-            old_post_mapping = CustomerPostFrameMapping.objects.filter(
-                customer_frame_id=instance.id,
-                post_id__in=old_post_ids
-            )
-            
-            old_other_post_mapping = CustomerOtherPostFrameMapping.objects.filter(
-                customer_frame_id=instance.id,
-                other_post_id__in=old_other_post_ids
-            )
-            
-            for mapping, new_post_id in zip(old_post_mapping, new_post_ids):
-                mapping.post_id = new_post_id
-                mapping.save()
-                
-            for mapping, new_other_post_id in zip(old_other_post_mapping, new_other_post_ids):
-                mapping.other_post_id = new_other_post_id
-                mapping.save()
-                    
-            
+        if 'group' in validated_data and instance.group_id != old_group_id:
+            # Reconciled by a fan-out worker once the change commits, not in the request.
+            dispatcher.add(FRAME_REMAP, (instance.id, old_group_id))
+
         return instance
 
     def get_group_name(self, obj):
@@ -192,19 +164,21 @@ class PlanSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'duration_in_months', 'price')
 
 
-class SubscriptionSerializer(serializers.ModelSerializer):
+class SubscriptionSerializer(ResponsiveMediaSerializerMixin, serializers.ModelSerializer):
     plan_name = serializers.CharField(source="plan.name", read_only=True)
     payment_method_name = serializers.CharField(source="payment_method.name", read_only=True)
     is_expired = serializers.SerializerMethodField()
     days_left = serializers.SerializerMethodField()
     customer_name = serializers.CharField(source="user.first_name", read_only=True)
     display_name = serializers.CharField(source="frame.display_name", read_only=True)
+    file_status = MediaStatusField(source='file')
+    file_metadata = MediaMetadataField(source='file')
 
     class Meta:
         model = Subscription
         fields = [
             'id', 'order_number', 'user', 'customer_name', 'frame', 'plan', 'plan_name', 'payment_method',
-            'start_date', 'end_date', 'transaction_number', 'file', 'is_active', 'is_expired', 'days_left',
+            'start_date', 'end_date', 'transaction_number', 'file', 'file_status', 'file_metadata', 'is_active', 'is_expired', 'days_left',
             'display_name', 'payment_method_name'
         ]
 
@@ -1,30 +1,17 @@
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
-from .tasks import (
-    mapping_customer_frame_with_post,
-    mapping_customer_frame_with_other_posts,
-    map_customer_frame_with_business_posts,
-)
+from app_modules.post.fanout import FRAME_ONBOARDING
+from lib.dispatch import dispatcher
+from .tasks import FRAME_REMAP, queue_frame_onboarding, queue_frame_remaps
 from .models import CustomerFrame
 
-
-@receiver(post_save, sender=CustomerFrame)
-def trigger_mapping_post_task(sender, instance, created, **kwargs):
-    if created:
-        # mapping_customer_frame_with_post.delay(instance.id)
-        mapping_customer_frame_with_post(instance.id)
-
-
-@receiver(post_save, sender=CustomerFrame)
-def trigger_mapping_task(sender, instance, created, **kwargs):
-    if created:
-        # mapping_customer_frame_with_other_posts.delay(instance.id)
-        mapping_customer_frame_with_other_posts(instance.id)
+dispatcher.register(FRAME_ONBOARDING, queue_frame_onboarding)
+dispatcher.register(FRAME_REMAP, queue_frame_remaps)
 
 
-@receiver(post_save, sender=CustomerFrame)
-def trigger_customer_frame_mapping(sender, instance, created, **kwargs):
+@receiver(post_save, sender=CustomerFrame, dispatch_uid='trigger_customer_frame_onboarding')
+def trigger_customer_frame_onboarding(sender, instance, created, **kwargs):
+    """Collect the new CustomerFrame; frames created in one transaction are onboarded by one job."""
     if created:
-        # map_customer_frame_with_business_posts.delay(instance.id)
-        map_customer_frame_with_business_posts(instance.id)
+        dispatcher.add(FRAME_ONBOARDING, instance.id)
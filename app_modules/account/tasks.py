@@ -1,10 +1,19 @@
 from celery import shared_task
+from django.conf import settings
 from django.db import transaction
+from django.utils import timezone
+from app_modules.post.fanout import (
+    FEEDS, FRAME_ONBOARDING, mark_fan_out_pending, mark_fan_out_running, onboard_frame_sql, posts_for_frame,
+    record_chunk_done
+)
 from app_modules.post.models import *
 import datetime
 
 # @shared_task
 def mapping_customer_frame_with_post(customer_frame_id):
+    if settings.POST_FEED_MODE == 'virtual':
+        return f"Feeds are virtual; nothing to map for CustomerFrame with id {customer_frame_id}"
+
     try:
         instance = CustomerFrame.objects.get(id=customer_frame_id)
     except CustomerFrame.DoesNotExist:
@@ -27,6 +36,7 @@ def mapping_customer_frame_with_post(customer_frame_id):
                 mapping, created = CustomerPostFrameMapping.objects.get_or_create(
                     customer_frame=instance,
                     post=post,
+                    event_date=post.event.event_date or UNDATED_EVENT_DATE,
                     defaults={
                         'customer': instance.customer,
                         'is_downloaded': False
@@ -45,6 +55,9 @@ def mapping_customer_frame_with_post(customer_frame_id):
 
 # @shared_task
 def mapping_customer_frame_with_other_posts(customer_frame_id):
+    if settings.POST_FEED_MODE == 'virtual':
+        return f"Feeds are virtual; nothing to map for CustomerFrame with id {customer_frame_id}"
+
     try:
         instance = CustomerFrame.objects.get(id=customer_frame_id)
     except CustomerFrame.DoesNotExist:
@@ -82,6 +95,9 @@ def mapping_customer_frame_with_other_posts(customer_frame_id):
 
 # @shared_task
 def map_customer_frame_with_business_posts(customer_frame_id):
+    if settings.POST_FEED_MODE == 'virtual':
+        return f"Feeds are virtual; nothing to map for CustomerFrame with id {customer_frame_id}"
+
     try:
         instance = CustomerFrame.objects.get(id=customer_frame_id)
     except CustomerFrame.DoesNotExist:
@@ -89,11 +105,9 @@ def map_customer_frame_with_business_posts(customer_frame_id):
 
     customer = instance.customer
     customer_group = instance.group
-    profession_type = instance.profession_type
-    business_category = instance.business_category
 
     business_posts = BusinessPost.objects.filter(
-        business_category=business_category, profession_type=profession_type, group=customer_group
+        group=customer_group, **posts_for_frame('business_post', instance)
     ).select_related('business_category', 'group')
 
     batch_size = 100
@@ -127,4 +141,167 @@ def map_customer_frame_with_business_posts(customer_frame_id):
             with transaction.atomic():
                 BusinessPostFrameMapping.objects.bulk_create(mappings_to_create)
 
-    return f"Mapping completed for CustomerFrame with id {customer_frame_id}"
\ No newline at end of file
+    return f"Mapping completed for CustomerFrame with id {customer_frame_id}"
+
+def _group_feed_posts(feed, group_ids, current_date):
+    """Posts of ``feed`` in one of ``group_ids`` that feeds are kept up to date for (upcoming events only)."""
+    group_ids = [group_id for group_id in group_ids if group_id is not None]
+    if feed == 'post':
+        return Post.objects.filter(group_id__in=group_ids, event__event_date__gte=current_date)
+    return FEEDS[feed].source.objects.filter(group_id__in=group_ids)
+
+
+def _frame_feed_posts(feed, frame, current_date):
+    """Posts of ``feed`` that ``frame`` should be mapped to."""
+    return _group_feed_posts(feed, [frame.group_id], current_date).filter(**posts_for_frame(feed, frame))
+
+
+def _reconcile_frame_feed(feed, frame, old_group_id, current_date):
+    spec = FEEDS[feed]
+    copied = spec.mapping.denormalized_fields
+    # Every post of both groups, eligible for the frame or not, so rows that
+    # fan-out or an earlier rule created outside the frame's scope go too.
+    scope = _group_feed_posts(feed, [old_group_id, frame.group_id], current_date)
+    # Expected posts with the columns their mapping rows copy from them.
+    targets = {
+        post.pop('id'): post
+        for post in _frame_feed_posts(feed, frame, current_date).values('id', **copied)
+    }
+
+    mappings = spec.mapping.objects.filter(
+        customer_frame_id=frame.id, **{f'{spec.post_field}__in': scope.values('id')}
+    ).only('id', spec.post_field, *copied)
+
+    kept_ids, stale = set(), []
+    for mapping in mappings:
+        post_id = getattr(mapping, spec.post_column)
+        if post_id in targets and post_id not in kept_ids:
+            kept_ids.add(post_id)
+        else:
+            stale.append(mapping)
+
+    missing_ids = sorted(set(targets) - kept_ids)
+    # Stale rows are re-pointed to missing posts first so the table keeps
+    # its row ids; only the remainder is deleted or inserted.
+    reused, obsolete = stale[:len(missing_ids)], stale[len(missing_ids):]
+    now = timezone.now()
+    for mapping, post_id in zip(reused, missing_ids):
+        setattr(mapping, spec.post_column, post_id)
+        for column, value in targets[post_id].items():
+            setattr(mapping, column, value)
+        mapping.is_downloaded = False
+        mapping.modified = now
+
+    if reused:
+        spec.mapping.objects.bulk_update(reused, [spec.post_field, 'is_downloaded', 'modified', *copied])
+    if obsolete:
+        spec.mapping.objects.filter(id__in=[mapping.id for mapping in obsolete]).delete()
+    if len(missing_ids) > len(reused):
+        spec.mapping.objects.bulk_create([
+            spec.mapping(
+                customer_id=frame.customer_id,
+                customer_frame_id=frame.id,
+                is_downloaded=False,
+                **{spec.post_column: post_id},
+                **targets[post_id]
+            )
+            for post_id in missing_ids[len(reused):]
+        ], ignore_conflicts=True)
+
+    return {
+        'kept': len(kept_ids),
+        'updated': len(reused),
+        'deleted': len(obsolete),
+        'created': max(len(missing_ids) - len(reused), 0),
+    }
+
+
+def remap_customer_frame_feeds(customer_frame_id, old_group_id):
+    """
+    Reconcile the post, other-post and business-post feeds of a frame that
+    moved from ``old_group_id`` to its current group.
+
+    The exact set difference between the mapped and the expected posts is
+    applied with one bulk update, delete and insert per feed inside a single
+    transaction, so the cost does not grow with the size of the feed.
+    """
+    if settings.POST_FEED_MODE == 'virtual':
+        return f"Feeds are virtual; nothing to remap for CustomerFrame with id {customer_frame_id}"
+
+    try:
+        instance = CustomerFrame.objects.get(id=customer_frame_id)
+    except CustomerFrame.DoesNotExist:
+        return f"CustomerFrame with id {customer_frame_id} does not exist."
+
+    current_date = datetime.date.today()
+    with transaction.atomic():
+        return {
+            feed: _reconcile_frame_feed(feed, instance, old_group_id, current_date)
+            for feed in FEEDS
+        }
+
+
+# Dispatcher key of frames that moved to another group; its ids are
+# (customer frame id, old group id) pairs.
+FRAME_REMAP = 'frame_remap'
+
+
+def queue_frame_remaps(changes):
+    """Hand the reconciliation of ``changes``, ``(frame id, old group id)`` pairs, to the fan-out queue."""
+    remap_customer_frames.delay([list(change) for change in changes])
+
+
+@shared_task
+def remap_customer_frames(changes):
+    return {
+        customer_frame_id: remap_customer_frame_feeds(customer_frame_id, old_group_id)
+        for customer_frame_id, old_group_id in changes
+    }
+
+
+def queue_frame_onboarding(customer_frame_ids):
+    """Record the onboarding of ``customer_frame_ids`` as pending and hand it to the fan-out queue as one job."""
+    customer_frame_ids = sorted(customer_frame_ids)
+    mark_fan_out_pending(FRAME_ONBOARDING, customer_frame_ids)
+    if settings.POST_FEED_MODE == 'virtual':
+        # Virtual feeds are computed at read time; there is nothing to build.
+        mark_fan_out_running(FRAME_ONBOARDING, customer_frame_ids, 0)
+        return
+
+    onboard_customer_frames.delay(customer_frame_ids)
+
+
+@shared_task
+def onboard_customer_frames(customer_frame_ids):
+    return {customer_frame_id: onboard_customer_frame(customer_frame_id) for customer_frame_id in customer_frame_ids}
+
+
+def onboard_customer_frame(customer_frame_id):
+    """
+    Build the post, other-post and business-post feeds of a new frame with one
+    ``INSERT ... SELECT`` per feed.
+    """
+    mark_fan_out_running(FRAME_ONBOARDING, [customer_frame_id], 1)
+
+    if settings.POST_FANOUT_STRATEGY != 'sql':
+        mapping_customer_frame_with_post(customer_frame_id)
+        mapping_customer_frame_with_other_posts(customer_frame_id)
+        map_customer_frame_with_business_posts(customer_frame_id)
+        record_chunk_done(FRAME_ONBOARDING, customer_frame_id, 0)
+        return f"Mapping completed for CustomerFrame with id {customer_frame_id}"
+
+    try:
+        instance = CustomerFrame.objects.get(id=customer_frame_id)
+    except CustomerFrame.DoesNotExist:
+        record_chunk_done(FRAME_ONBOARDING, customer_frame_id, 0)
+        return f"CustomerFrame with id {customer_frame_id} does not exist."
+
+    current_date = datetime.date.today()
+    with transaction.atomic():
+        report = {
+            feed: onboard_frame_sql(feed, instance, _frame_feed_posts(feed, instance, current_date))
+            for feed in FEEDS
+        }
+
+    record_chunk_done(FRAME_ONBOARDING, customer_frame_id, sum(report.values()))
+    return report
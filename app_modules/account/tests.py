@@ -1,3 +1,94 @@
-from django.test import TestCase
+from datetime import date, timedelta
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+
+from account.models import CustomerFrame, CustomerGroup, User
+from account.tasks import remap_customer_frame_feeds
+from app_modules.post.models import (
+    BusinessCategory, BusinessPost, BusinessPostFrameMapping, Category, CustomerOtherPostFrameMapping,
+    CustomerPostFrameMapping, Event, OtherPost, Post,
+)
+
+
+@override_settings(POST_FEED_MODE='materialized')
+class RemapCustomerFrameFeedsTests(TestCase):
+    """A frame that moved from ``old`` to ``new`` gets the feed of ``new``, by set difference."""
+
+    def setUp(self):
+        self.old = CustomerGroup.objects.create(name='old')
+        self.new = CustomerGroup.objects.create(name='new')
+        self.customer = User.objects.create(email='customer@example.com', user_type='customer')
+        self.category = BusinessCategory.objects.create(
+            name='Bakery', profession_type='business', thumbnail='business_category_thumbnail/bakery.svg'
+        )
+        self.other_category = BusinessCategory.objects.create(
+            name='Tailor', profession_type='business', thumbnail='business_category_thumbnail/tailor.svg'
+        )
+        self.frame = CustomerFrame.objects.create(
+            customer=self.customer, group=self.new, business_category=self.category, profession_type='business'
+        )
+        self.event = Event.objects.create(name='Festival', event_date=date.today() + timedelta(days=3))
+
+    def post(self, group, name):
+        return Post.objects.create(event=self.event, group=group, file=f'post/{name}.mp4')
+
+    def business_post(self, group, category, name):
+        return BusinessPost.objects.create(
+            group=group, business_category=category, profession_type='business', file=f'business_post/{name}.mp4'
+        )
+
+    def map(self, model, **post):
+        return model.objects.create(customer=self.customer, customer_frame=self.frame, **post)
+
+    def test_post_feed_counts(self):
+        old_posts = [self.post(self.old, 'old-1'), self.post(self.old, 'old-2')]
+        kept, missing = self.post(self.new, 'new-1'), self.post(self.new, 'new-2')
+        for post in [*old_posts, kept]:
+            self.map(CustomerPostFrameMapping, post=post, event_date=self.event.event_date)
+
+        report = remap_customer_frame_feeds(self.frame.id, self.old.id)
+
+        self.assertEqual(report['post'], {'kept': 1, 'updated': 1, 'deleted': 1, 'created': 0})
+        self.assertEqual(
+            set(CustomerPostFrameMapping.objects.filter(customer_frame=self.frame).values_list('post_id', flat=True)),
+            {kept.id, missing.id},
+        )
+
+    def test_other_post_feed_is_created(self):
+        category = Category.objects.create(name='Greetings')
+        other_post = OtherPost.objects.create(category=category, group=self.new, file='other_post/greeting.mp4')
+
+        report = remap_customer_frame_feeds(self.frame.id, self.old.id)
+
+        self.assertEqual(report['other_post'], {'kept': 0, 'updated': 0, 'deleted': 0, 'created': 1})
+        self.assertTrue(
+            CustomerOtherPostFrameMapping.objects.filter(customer_frame=self.frame, other_post=other_post).exists()
+        )
+
+    def test_business_posts_outside_the_frame_category_are_removed(self):
+        # Mapped by fan-out before the rule was shared: one in the old group, one of another category.
+        stray_old = self.business_post(self.old, self.other_category, 'stray-old')
+        stray_new = self.business_post(self.new, self.other_category, 'stray-new')
+        eligible = self.business_post(self.new, self.category, 'eligible')
+        for post in (stray_old, stray_new):
+            self.map(BusinessPostFrameMapping, post=post)
+
+        report = remap_customer_frame_feeds(self.frame.id, self.old.id)
+
+        self.assertEqual(report['business_post'], {'kept': 0, 'updated': 1, 'deleted': 1, 'created': 0})
+        self.assertEqual(
+            list(BusinessPostFrameMapping.objects.filter(customer_frame=self.frame).values_list('post_id', flat=True)),
+            [eligible.id],
+        )
+
+    def test_second_run_changes_nothing(self):
+        self.post(self.new, 'new-1')
+        remap_customer_frame_feeds(self.frame.id, self.old.id)
+
+        report = remap_customer_frame_feeds(self.frame.id, self.old.id)
+
+        self.assertEqual(report['post'], {'kept': 1, 'updated': 0, 'deleted': 0, 'created': 0})
+
+    @override_settings(POST_FEED_MODE='virtual')
+    def test_virtual_feeds_are_left_alone(self):
+        self.assertIn("virtual", remap_customer_frame_feeds(self.frame.id, self.old.id))
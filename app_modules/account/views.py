@@ -7,6 +7,7 @@ from django.contrib.auth import authenticate
 from django.core.mail import send_mail
 from django.forms import IntegerField
 from django.http import Http404
+from django.urls import reverse
 from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import permissions, viewsets, exceptions, status
@@ -17,6 +18,7 @@ from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken, AccessToken
 from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
 
+from app_modules.post.fanout import FRAME_ONBOARDING, get_fan_out_progress
 from app_modules.post.models import Post, Category
 from app_modules.post.serializers import BusinessCategorySerializer
 from lib.constants import UserConstants
@@ -214,6 +216,29 @@ class CustomerFrameViewSet(viewsets.ModelViewSet):
     filterset_fields = ['group__name', 'profession_type']
     filterset_class = CustomerFrameFilter
 
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+
+        if response.status_code == status.HTTP_201_CREATED:
+            progress = get_fan_out_progress(FRAME_ONBOARDING, response.data['id'])
+
+            modified_data = response.data.copy()
+            if progress and progress['status'] != 'done':
+                modified_data["message"] = "The frame has been created; its feed is being built"
+            else:
+                modified_data["message"] = "The frame has been created successfully"
+            modified_data["feed_job"] = {
+                "id": f"{FRAME_ONBOARDING}:{response.data['id']}",
+                "progress": progress,
+                "status_url": reverse(
+                    'fanout-status', kwargs={'feed': FRAME_ONBOARDING, 'object_id': response.data['id']}
+                ),
+            }
+
+            response.data = modified_data
+
+        return response
+
 
 class UserProfileListApiView(BaseModelViewSet):
     serializer_class = UserProfileListSerializer
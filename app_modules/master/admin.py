@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 from app_modules.master.models import (
-    Banner, BirthdayPost, SplashScreen, Tutorials, About, PrivacyPolicy, TermsAndCondition, Feedback,
+    Banner, BirthdayPost, SplashScreen, Tutorials, About, PrivacyPolicy, TermsAndCondition, Feedback, MediaFile,
 )
 
 admin.site.register(BirthdayPost)
@@ -13,3 +13,9 @@ admin.site.register(PrivacyPolicy)
 admin.site.register(TermsAndCondition)
 admin.site.register(Feedback)
 
+
+@admin.register(MediaFile)
+class MediaFileAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'modified')
+    list_filter = ('status',)
+    search_fields = ('name',)
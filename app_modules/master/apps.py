@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class MasterConfig(AppConfig):
     name = 'app_modules.master'
+
+    def ready(self):
+        from lib.media import connect_media_signals
+
+        connect_media_signals()
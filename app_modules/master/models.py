@@ -1,6 +1,6 @@
 from django.db import models
 
-from lib.helpers import rename_file_name, converter_to_webp
+from lib.helpers import rename_file_name
 from lib.models import BaseModel
 
 
@@ -50,5 +50,40 @@ class Feedback(BaseModel):
     
 
 
+class MediaFile(BaseModel):
+    """Background processing state of an uploaded file, keyed by its current storage name."""
+    PENDING, PROCESSING, DONE, FAILED = 'pending', 'processing', 'done', 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'pending'),
+        (PROCESSING, 'processing'),
+        (DONE, 'done'),
+        (FAILED, 'failed'),
+    ]
+
+    name = models.CharField(max_length=255, unique=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    error = models.TextField(null=True, blank=True)
+    # Width in pixels (as a string) -> storage name of the resized WebP copy.
+    variants = models.JSONField(default=dict, blank=True)
+    # Video resolution ("1080x1920") -> storage name of the RGBA PNG overlay
+    # scaled to fit it, for frame images (see ``MediaFieldsMixin.overlay_fields``).
+    overlays = models.JSONField(default=dict, blank=True)
+    # SHA-256 of the uploaded bytes; set for files stored under their hash,
+    # which are deleted once ``references`` drops to zero.
+    content_hash = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    references = models.PositiveIntegerField(default=0)
+    # Read once when the file is stored (see lib.media.probe_media) so
+    # renders and clients never have to probe it.
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True, help_text="Seconds, for videos")
+    codec = models.CharField(max_length=50, null=True, blank=True)
+    size = models.PositiveBigIntegerField(null=True, blank=True, help_text="Bytes")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status']),
+        ]
 
-
+    def __str__(self) -> str:
+        return f"{self.name} ({self.status})"
@@ -0,0 +1,47 @@
+from celery import shared_task
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from app_modules.master.models import MediaFile
+from lib.media import is_image, process_image, record_media_metadata, rows_holding
+
+
+@shared_task
+def process_media_file(model_label, field_name, name):
+    model = apps.get_model(model_label)
+    if not is_image(name):
+        metadata = record_media_metadata(model._meta.get_field(field_name).storage, name)
+        return f"Recorded the metadata of {name}: {metadata or 'none readable'}."
+
+    webp_name = process_image(model, field_name, name)
+    if webp_name is None:
+        return f"{name} was not processed."
+
+    if webp_name != name:
+        # Clients may still hold the original URL for a moment after the swap.
+        delete_stored_file.apply_async((name, webp_name), countdown=settings.MEDIA_ORIGINAL_RETENTION_SECONDS)
+    return webp_name
+
+
+@shared_task
+def delete_stored_file(name, replacement=None):
+    """
+    Delete the stored file ``name`` once it has been replaced by the file
+    ``replacement``. Rows that still hold ``name``, e.g. committed after the
+    swap, are pointed at ``replacement`` first; without a replacement the
+    file is kept while any row or ``MediaFile`` still holds it.
+    """
+    with transaction.atomic():
+        if replacement:
+            repointed = sum(rows.update(**{field: replacement}) for rows, field in rows_holding(name))
+        else:
+            repointed = 0
+        if any(rows.exists() for rows, field in rows_holding(name)) or MediaFile.objects.filter(name=name).exists():
+            return f"{name} kept: still held."
+
+    default_storage.delete(name)
+    if repointed:
+        return f"{name} deleted, {repointed} rows pointed at {replacement}."
+    return f"{name} deleted."
@@ -1,3 +1,49 @@
+from unittest import mock
+
 from django.test import TestCase
 
-# Create your tests here.
+from app_modules.master.models import MediaFile
+from app_modules.master.tasks import delete_stored_file
+from app_modules.post.models import Category
+
+ORIGINAL = 'category_banners/banner.png'
+WEBP = 'category_banners/banner.webp'
+
+
+@mock.patch('app_modules.master.tasks.default_storage')
+class DeleteStoredFileTests(TestCase):
+    """The delayed delete of an original after its swap to WebP must not orphan rows."""
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Banners')
+
+    def hold(self, name):
+        # Bypass MediaFieldsMixin.save: only the stored name matters here.
+        Category.objects.filter(pk=self.category.pk).update(banner_image=name)
+
+    def banner(self):
+        return Category.objects.values_list('banner_image', flat=True).get(pk=self.category.pk)
+
+    def test_deletes_a_file_no_row_holds(self, storage):
+        self.hold(WEBP)
+        delete_stored_file(ORIGINAL, WEBP)
+        storage.delete.assert_called_once_with(ORIGINAL)
+        self.assertEqual(self.banner(), WEBP)
+
+    def test_points_late_rows_at_the_replacement_before_deleting(self, storage):
+        # A row committed after process_image swapped the others.
+        self.hold(ORIGINAL)
+        delete_stored_file(ORIGINAL, WEBP)
+        self.assertEqual(self.banner(), WEBP)
+        storage.delete.assert_called_once_with(ORIGINAL)
+
+    def test_keeps_a_file_rows_hold_without_a_replacement(self, storage):
+        self.hold(ORIGINAL)
+        delete_stored_file(ORIGINAL)
+        self.assertEqual(self.banner(), ORIGINAL)
+        storage.delete.assert_not_called()
+
+    def test_keeps_a_file_with_a_media_file(self, storage):
+        MediaFile.objects.create(name=ORIGINAL, status=MediaFile.DONE, references=1)
+        delete_stored_file(ORIGINAL, WEBP)
+        storage.delete.assert_not_called()
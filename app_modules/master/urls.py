@@ -16,4 +16,5 @@ router.register(r'feedback', views.FeedbackViewSet, basename='feedback')
 urlpatterns = [
     # Your existing URL patterns
     path('', include(router.urls)),
+    path('media-stats', views.MediaStatsView.as_view(), name='media-stats'),
 ]
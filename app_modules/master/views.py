@@ -1,14 +1,18 @@
+from django.db.models import Count
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.response import Response
 from rest_framework import status, permissions
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
 from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.views import APIView
 
 from app_modules.master import serializers
 from app_modules.master.models import (
-    Banner, BirthdayPost, SplashScreen, Tutorials, About, PrivacyPolicy, TermsAndCondition, Feedback,
+    Banner, BirthdayPost, SplashScreen, Tutorials, About, PrivacyPolicy, TermsAndCondition, Feedback, MediaFile,
 )
+from lib.disk_cache import disk_cache_counters
+from lib.media import media_counters
 from lib.viewsets import BaseModelViewSet
 
 
@@ -76,4 +80,16 @@ class FeedbackViewSet(BaseModelViewSet):
     http_method_names = ['get', 'post']
     
     def perform_create(self, serializer):
-        serializer.save(customer=self.request.user)
\ No newline at end of file
+        serializer.save(customer=self.request.user)
+
+class MediaStatsView(APIView):
+    """Media pipeline counters, the number of files in each processing status and the disk cache counters."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        statuses = dict(MediaFile.objects.order_by().values_list('status').annotate(count=Count('id')))
+        return Response({
+            'counters': media_counters(),
+            'statuses': {status_name: statuses.get(status_name, 0) for status_name, label in MediaFile.STATUS_CHOICES},
+            'disk_caches': disk_cache_counters(),
+        })
@@ -1,8 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class PostConfig(AppConfig):
     name = 'app_modules.post'
     
     def ready(self):
-        import app_modules.post.singal
+        import app_modules.post.signals
+        from app_modules.post.feed import create_feed_views
+
+        post_migrate.connect(create_feed_views, sender=self)
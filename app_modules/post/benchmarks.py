@@ -0,0 +1,105 @@
+"""
+Helpers shared by the fan-out and feed benchmark management commands.
+"""
+import threading
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+from uuid import uuid4
+
+import psutil
+
+from account.models import User, CustomerFrame, CustomerGroup
+from .models import Category, Event, Post, OtherPost, BusinessCategory, BusinessPost
+
+BATCH_SIZE = 5000
+
+
+def build_synthetic_dataset(customers, frames_per_customer=1, groups=1, events=1, posts=1):
+    """
+    Create customers, frames, groups, events and ``posts`` posts, other posts
+    and business posts per group with ``bulk_create``, so no model ``save()``
+    or ``post_save`` fan-out runs. Customers are spread over the groups round
+    robin and every frame carries the same business category.
+    """
+    prefix = f"bench-{uuid4().hex[:8]}"
+
+    group_objs = CustomerGroup.objects.bulk_create(
+        [CustomerGroup(name=f"{prefix}-{i}") for i in range(groups)]
+    )
+    category = Category.objects.bulk_create([Category(name=prefix)])[0]
+    business_category = BusinessCategory.objects.bulk_create([BusinessCategory(
+        name=prefix, profession_type='business', thumbnail='business_category_thumbnail/bench.webp'
+    )])[0]
+
+    customer_objs = User.objects.bulk_create([
+        User(email=f"{prefix}-{i}@example.com", username=f"{prefix}-{i}", user_type='customer', password='!')
+        for i in range(customers)
+    ], batch_size=BATCH_SIZE)
+    frame_objs = CustomerFrame.objects.bulk_create([
+        CustomerFrame(
+            customer=customer,
+            group=group_objs[i % groups],
+            business_category=business_category,
+            profession_type='business',
+        )
+        for i, customer in enumerate(customer_objs)
+        for _ in range(frames_per_customer)
+    ], batch_size=BATCH_SIZE)
+
+    today = date.today()
+    event_objs = Event.objects.bulk_create([
+        Event(name=f"{prefix}-{i}", event_date=today + timedelta(days=i)) for i in range(events)
+    ])
+
+    post_objs = Post.objects.bulk_create([
+        Post(event=event_objs[i % events], group=group, file='post/bench.webp')
+        for group in group_objs for i in range(posts)
+    ], batch_size=BATCH_SIZE)
+    other_post_objs = OtherPost.objects.bulk_create([
+        OtherPost(category=category, group=group, file='other_post/bench.webp')
+        for group in group_objs for _ in range(posts)
+    ], batch_size=BATCH_SIZE)
+    business_post_objs = BusinessPost.objects.bulk_create([
+        BusinessPost(
+            business_category=business_category, profession_type='business', group=group,
+            file='business_post/bench.webp'
+        )
+        for group in group_objs for _ in range(posts)
+    ], batch_size=BATCH_SIZE)
+
+    return SimpleNamespace(
+        groups=group_objs,
+        customers=customer_objs,
+        frames=frame_objs,
+        events=event_objs,
+        posts=post_objs,
+        other_posts=other_post_objs,
+        business_posts=business_post_objs,
+    )
+
+
+class PeakRss:
+    """Samples the resident set size of this process in a background thread."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak = self._process.memory_info().rss
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._process.memory_info().rss)
+            time.sleep(self.interval)
@@ -0,0 +1,239 @@
+"""
+Set-based fan-out of posts into the customer feed mapping tables.
+
+Instead of pulling every (customer, frame) pair of a group into Python and
+pushing model instances through ``bulk_create``, the mapping rows are produced
+inside PostgreSQL with a single ``INSERT ... SELECT`` from ``CustomerFrame``.
+Posts published together are fanned out by the same statements, large
+groups are split into customer-id ranges so the chunks can run in parallel,
+and per-post progress is kept in the cache.
+
+A post belongs in the feed of every frame of its group that also shares the
+``frame_columns`` of its feed: business posts only go to frames of their
+business category and profession. Fan-out, frame onboarding, reconciliation
+and the virtual feed views all take that rule from here.
+
+Every statement is an idempotent upsert against the unique
+(customer_frame, post) constraint of the mapping tables, so a retried job
+needs no pre-read.
+"""
+import logging
+import time
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db import connection
+
+from account.models import CustomerFrame
+from .models import (
+    Post, OtherPost, BusinessPost, CustomerPostFrameMapping, CustomerOtherPostFrameMapping,
+    BusinessPostFrameMapping
+)
+
+logger = logging.getLogger(__name__)
+
+# frame_columns: columns, named alike on the post and the frame, whose values
+# must match, besides the group, for the post to be in the frame's feed.
+FeedSpec = namedtuple('FeedSpec', ['source', 'mapping', 'post_field', 'post_column', 'frame_columns'])
+
+FEEDS = {
+    'post': FeedSpec(Post, CustomerPostFrameMapping, 'post', 'post_id', ()),
+    'other_post': FeedSpec(OtherPost, CustomerOtherPostFrameMapping, 'other_post', 'other_post_id', ()),
+    'business_post': FeedSpec(
+        BusinessPost, BusinessPostFrameMapping, 'post', 'post_id', ('business_category_id', 'profession_type')
+    ),
+}
+
+FAN_OUT_SQL = """
+    WITH inserted AS (
+        INSERT INTO {mapping} (
+            created, modified, customer_id, {post_column}, customer_frame_id, is_downloaded{copied_columns}
+        )
+        SELECT now(), now(), cf.customer_id, p.id, cf.id, false{copied_values}
+        FROM ({posts}) p
+        JOIN {frame} cf ON cf.group_id = p.group_id{frame_match}{customer_range}
+        ON CONFLICT ({conflict_columns}) DO NOTHING
+        RETURNING {post_column}
+    )
+    SELECT {post_column}, count(*) FROM inserted GROUP BY {post_column}
+"""
+
+CUSTOMER_RANGES_SQL = """
+    SELECT min(customer_id), max(customer_id)
+    FROM (
+        SELECT customer_id, (row_number() OVER (ORDER BY customer_id) - 1) / %(chunk_size)s AS bucket
+        FROM (
+            SELECT DISTINCT customer_id FROM {frame}
+            WHERE group_id IN (SELECT group_id FROM {source} WHERE id = ANY(%(post_ids)s))
+        ) customers
+    ) buckets
+    GROUP BY bucket
+    ORDER BY bucket
+"""
+
+ONBOARD_FRAME_SQL = """
+    INSERT INTO {mapping} (
+        created, modified, customer_id, {post_column}, customer_frame_id, is_downloaded{copied_columns}
+    )
+    SELECT now(), now(), %s, p.id, %s, false{copied_values}
+    FROM ({posts}) p
+    ON CONFLICT ({conflict_columns}) DO NOTHING
+"""
+
+PROGRESS_TIMEOUT = 60 * 60 * 24
+
+# Progress name used for frame onboarding jobs next to the per-feed post jobs.
+FRAME_ONBOARDING = 'frame'
+
+
+def frame_match_sql(feed, post='p', frame='cf'):
+    """SQL conditions, each starting with ``AND``, matching the posts of ``feed`` aliased ``post`` to frames."""
+    # NULL matches NULL, as in the ORM filters below.
+    return ''.join(
+        f" AND {post}.{column} IS NOT DISTINCT FROM {frame}.{column}" for column in FEEDS[feed].frame_columns
+    )
+
+
+def posts_for_frame(feed, frame):
+    """Filter kwargs narrowing posts of ``feed`` in the frame's group to those eligible for ``frame``."""
+    return {column: getattr(frame, column) for column in FEEDS[feed].frame_columns}
+
+
+def frames_for_post(feed, post):
+    """Filter kwargs narrowing the frames of the post's group to those ``post`` of ``feed`` is mapped to."""
+    return {column: getattr(post, column) for column in FEEDS[feed].frame_columns}
+
+
+def customer_ranges(feed, post_ids, chunk_size):
+    """
+    Split the customers of the groups the posts in ``post_ids`` belong to into
+    disjoint, inclusive id ranges holding at most ``chunk_size`` customers each.
+    """
+    spec = FEEDS[feed]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            CUSTOMER_RANGES_SQL.format(frame=CustomerFrame._meta.db_table, source=spec.source._meta.db_table),
+            {'chunk_size': chunk_size, 'post_ids': list(post_ids)}
+        )
+        return [tuple(row) for row in cursor.fetchall()]
+
+
+def _mapping_sql(sql, spec, posts, **kwargs):
+    """
+    Fill in ``sql`` for the mapping table of ``spec``, selecting from the
+    ``posts`` queryset together with the post columns the mapping copies.
+    Returns the SQL and the parameters of the posts subquery.
+    """
+    copied = spec.mapping.denormalized_fields
+    posts_sql, posts_params = posts.values('id', 'group_id', *spec.frame_columns, **copied).query.sql_with_params()
+
+    return sql.format(
+        mapping=spec.mapping._meta.db_table,
+        post_column=spec.post_column,
+        copied_columns=''.join(f', {column}' for column in copied),
+        copied_values=''.join(f', p.{column}' for column in copied),
+        conflict_columns=', '.join(['customer_frame_id', spec.post_column, *copied]),
+        posts=posts_sql,
+        **kwargs
+    ), posts_params
+
+
+def fan_out_sql(feed, post_ids, customer_range=None):
+    """
+    Map the posts in ``post_ids`` to the eligible customer frames of their
+    groups with a single statement, optionally limited to an inclusive ``(first, last)``
+    customer-id range. Posts that no longer exist are skipped.
+
+    Returns a report with the inserted rows, in total and per post, and the
+    elapsed time.
+    """
+    spec = FEEDS[feed]
+    post_ids = list(post_ids)
+    range_filter, range_params = '', ()
+    if customer_range:
+        range_filter, range_params = ' WHERE cf.customer_id BETWEEN %s AND %s', tuple(customer_range)
+
+    sql, params = _mapping_sql(
+        FAN_OUT_SQL, spec, spec.source.objects.filter(id__in=post_ids),
+        frame=CustomerFrame._meta.db_table,
+        frame_match=frame_match_sql(feed),
+        customer_range=range_filter,
+    )
+
+    started = time.monotonic()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, (*params, *range_params))
+        rows_by_post = dict(cursor.fetchall())
+    report = {
+        'feed': feed,
+        'post_ids': post_ids,
+        'rows': sum(rows_by_post.values()),
+        'rows_by_post': rows_by_post,
+        'elapsed_ms': round((time.monotonic() - started) * 1000, 2),
+    }
+
+    logger.info(
+        "FANOUT %s %s %s: inserted %s rows in %sms",
+        feed, post_ids, customer_range or 'all', report['rows'], report['elapsed_ms']
+    )
+    return report
+
+
+def onboard_frame_sql(feed, frame, posts):
+    """
+    Map one customer frame to every post of the ``posts`` queryset with a
+    single ``INSERT ... SELECT``; returns the number of inserted rows.
+    """
+    sql, params = _mapping_sql(ONBOARD_FRAME_SQL, FEEDS[feed], posts)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, (frame.customer_id, frame.id, *params))
+        return cursor.rowcount
+
+
+def _progress_key(feed, post_id, part):
+    return f"fanout:{feed}:{post_id}:{part}"
+
+
+def mark_fan_out_pending(feed, post_ids):
+    values = {}
+    for post_id in post_ids:
+        values.update({
+            _progress_key(feed, post_id, 'status'): 'pending',
+            _progress_key(feed, post_id, 'chunks'): 0,
+            _progress_key(feed, post_id, 'chunks_done'): 0,
+            _progress_key(feed, post_id, 'rows'): 0,
+        })
+    cache.set_many(values, timeout=PROGRESS_TIMEOUT)
+
+
+def mark_fan_out_running(feed, post_ids, chunks):
+    values = {}
+    for post_id in post_ids:
+        values.update({
+            _progress_key(feed, post_id, 'status'): 'running' if chunks else 'done',
+            _progress_key(feed, post_id, 'chunks'): chunks,
+        })
+    cache.set_many(values, timeout=PROGRESS_TIMEOUT)
+
+
+def record_chunk_done(feed, post_id, rows):
+    """Add a finished chunk to the post's progress and close it after the last one."""
+    try:
+        cache.incr(_progress_key(feed, post_id, 'rows'), rows)
+        chunks_done = cache.incr(_progress_key(feed, post_id, 'chunks_done'))
+    except ValueError:
+        # Progress expired or was never started; nothing left to report on.
+        return
+
+    if chunks_done >= (cache.get(_progress_key(feed, post_id, 'chunks')) or 0):
+        cache.set(_progress_key(feed, post_id, 'status'), 'done', timeout=PROGRESS_TIMEOUT)
+
+
+def get_fan_out_progress(feed, post_id):
+    parts = ('status', 'chunks', 'chunks_done', 'rows')
+    values = cache.get_many([_progress_key(feed, post_id, part) for part in parts])
+    progress = {part: values.get(_progress_key(feed, post_id, part)) for part in parts}
+    if progress['status'] is None:
+        return None
+    return {'feed': feed, 'post_id': post_id, **progress}
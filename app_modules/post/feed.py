@@ -0,0 +1,86 @@
+"""
+Virtual customer feeds.
+
+The mapping tables hold one row per post x customer frame, which is really a
+function of ``Post.group`` and ``CustomerFrame.group``. With
+``POST_FEED_MODE = "virtual"`` the feed is instead computed at read time by
+database views joining the posts to the frames on group, and the mapping tables
+only keep the sparse per-customer facts such as ``is_downloaded``. The views
+apply the same eligibility rule as the materialized fan-out
+(``fanout.frame_match_sql``), so both modes show customers the same posts.
+"""
+from django.conf import settings
+from django.db import connection
+
+from account.models import CustomerFrame
+from .fanout import FEEDS, frame_match_sql
+from .models import CustomerPostFeed, CustomerOtherPostFeed, BusinessPostFeed
+
+FEED_MODELS = {
+    'post': CustomerPostFeed,
+    'other_post': CustomerOtherPostFeed,
+    'business_post': BusinessPostFeed,
+}
+
+FEED_ID_SHIFT = 32
+
+FEED_VIEW_SQL = """
+    CREATE OR REPLACE VIEW {view} AS
+    SELECT (p.id::bigint << {shift}) | cf.id AS id,
+           cf.customer_id,
+           p.id AS {post_column},
+           cf.id AS customer_frame_id,
+           EXISTS (
+               SELECT 1 FROM {mapping} m
+               WHERE m.{post_column} = p.id AND m.customer_frame_id = cf.id AND m.is_downloaded
+           ) AS is_downloaded
+    FROM {source} p
+    JOIN {frame} cf ON cf.group_id = p.group_id{frame_match}
+"""
+
+
+def feed_is_virtual():
+    return settings.POST_FEED_MODE == 'virtual'
+
+
+def pack_feed_id(post_id, frame_id):
+    return (post_id << FEED_ID_SHIFT) | frame_id
+
+
+def unpack_feed_id(pk):
+    pk = int(pk)
+    return pk >> FEED_ID_SHIFT, pk & ((1 << FEED_ID_SHIFT) - 1)
+
+
+def feed_queryset(feed):
+    """Feed rows of ``feed`` for the configured feed mode."""
+    if feed_is_virtual():
+        return FEED_MODELS[feed].objects.all()
+    return FEEDS[feed].mapping.objects.all()
+
+
+def feed_pk_filter(feed, pk):
+    """Lookup kwargs selecting the feed row ``pk`` in :func:`feed_queryset`."""
+    if not feed_is_virtual():
+        return {'pk': pk}
+    post_id, frame_id = unpack_feed_id(pk)
+    return {FEEDS[feed].post_column: post_id, 'customer_frame_id': frame_id}
+
+
+def create_feed_views(**kwargs):
+    """(Re)create the feed views; connected to ``post_migrate``."""
+    if connection.vendor != 'postgresql':
+        return
+
+    with connection.cursor() as cursor:
+        for feed, model in FEED_MODELS.items():
+            spec = FEEDS[feed]
+            cursor.execute(FEED_VIEW_SQL.format(
+                view=model._meta.db_table,
+                shift=FEED_ID_SHIFT,
+                post_column=spec.post_column,
+                mapping=spec.mapping._meta.db_table,
+                source=spec.source._meta.db_table,
+                frame=CustomerFrame._meta.db_table,
+                frame_match=frame_match_sql(feed),
+            ))
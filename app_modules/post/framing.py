@@ -0,0 +1,82 @@
+"""
+Post images with the customer's frame composited on top, cached on disk.
+
+A composite is identified by the content hashes of the post image and the
+frame, the width it was rendered at and the encoding profile, so it is built
+once no matter how many customers share the frame or how often the feed is
+reloaded. The cache directory is capped at ``FRAMED_IMAGE_CACHE_MAX_BYTES``
+with least-recently-used eviction (see ``lib.disk_cache``).
+Cached files are meant to be served by nginx through ``X-Accel-Redirect``.
+"""
+import hashlib
+import json
+import os
+
+from django.conf import settings
+
+from app_modules.master.models import MediaFile
+from lib.disk_cache import DiskCache
+from lib.media import encoding_profile, file_key, local_path, pick_variant, run_isolated
+
+FRAMED_IMAGE_CACHE = DiskCache(
+    'framed_image', settings.FRAMED_IMAGE_CACHE_ROOT, settings.FRAMED_IMAGE_CACHE_MAX_BYTES, '.webp'
+)
+
+
+def snap_width(width):
+    """Round ``width`` up to one of ``MEDIA_VARIANT_WIDTHS`` so a handful of sizes cover every client."""
+    if width:
+        for variant_width in sorted(settings.MEDIA_VARIANT_WIDTHS):
+            if variant_width >= width:
+                return variant_width
+    return None
+
+
+def cache_key(post_key, frame_key, width, profile):
+    profile_key = json.dumps(profile, sort_keys=True)
+    return hashlib.sha256(f"{post_key}:{frame_key}:{width or 'full'}:{profile_key}".encode()).hexdigest()
+
+
+def compose(storage, post_name, frame_file, output_path, width, profile):
+    """
+    Write ``frame_file`` stretched over the stored image ``post_name``, scaled
+    down to ``width`` when given, as WebP to ``output_path``. The capped child
+    opens both files itself.
+    """
+    with local_path(storage, post_name) as post_path, local_path(frame_file.storage, frame_file.name) as frame_path:
+        run_isolated(
+            'compose', post_path, frame_path, output_path, width, settings.MEDIA_MAX_DIMENSION,
+            settings.MEDIA_MAX_PIXELS, profile,
+        )
+
+
+def framed_image(post_file, frame_file, width=None):
+    """
+    Path, relative to ``FRAMED_IMAGE_CACHE_ROOT``, of the composite of
+    ``post_file`` and ``frame_file`` at ``width`` (snapped to a variant
+    width; ``None`` is full size), building and caching it on a miss.
+    """
+    width = snap_width(width)
+    media_files = {
+        media_file.name: media_file
+        for media_file in MediaFile.objects.filter(name__in=[post_file.name, frame_file.name])
+    }
+    post_media = media_files.get(post_file.name)
+    profile = encoding_profile(settings.FRAMED_IMAGE_ENCODING_PROFILE)
+    digest = cache_key(
+        file_key(post_media, post_file.name), file_key(media_files.get(frame_file.name), frame_file.name), width,
+        profile,
+    )
+    relative_path = FRAMED_IMAGE_CACHE.lookup(digest)
+    if relative_path is not None:
+        return relative_path
+
+    # Start from the stored variant when there is one; it decodes much faster.
+    variant = width and post_media and pick_variant(post_media.variants, width)
+    path = FRAMED_IMAGE_CACHE.temporary_path(digest)
+    try:
+        compose(post_file.storage, variant or post_file.name, frame_file, path, width, profile)
+    except Exception:
+        os.remove(path)
+        raise
+    return FRAMED_IMAGE_CACHE.store_file(digest, path)
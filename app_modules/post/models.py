@@ -1,18 +1,24 @@
+from datetime import date
+
 from account.models import User, CustomerFrame, CustomerGroup
 from django.db import models
-from django.db.models import CharField
+from django.db.models import CharField, Value
+from django.db.models.functions import Coalesce
 
 from lib.constants import FILE_TYPE, PROFESSION_TYPE
-from lib.helpers import rename_file_name, converter_to_webp
+from lib.helpers import rename_file_name
+from lib.media import MediaFieldsMixin
 from lib.models import BaseModel
 
 
-class Category(BaseModel):
+class Category(MediaFieldsMixin, BaseModel):
     name = models.CharField(max_length=100, unique=True)
     sub_category = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True)
     banner_image = models.ImageField(upload_to='category_banners/', null=True, blank=True)
     is_active = models.BooleanField(default=True)
     is_featured = models.BooleanField(default=False)
+
+    media_fields = ('banner_image',)
     
     class Meta:
         indexes = [
@@ -24,17 +30,15 @@ class Category(BaseModel):
     def __str__(self) -> CharField:
         return self.name
 
-    def save(self, *args, **kwargs):
-        if self.banner_image:
-            converter_to_webp(self.banner_image)
-        super().save(*args, **kwargs)
 
 
-class Event(BaseModel):
+class Event(MediaFieldsMixin, BaseModel):
     name = models.CharField(max_length=100)
     event_date = models.DateField(null=True, blank=True)
     event_type = models.CharField(max_length=50, choices=FILE_TYPE, default='image')
     thumbnail = models.FileField(upload_to=rename_file_name('event_thumbnail/'), null=True)
+
+    media_fields = ('thumbnail',)
     
     class Meta:
         indexes = [
@@ -46,13 +50,9 @@ class Event(BaseModel):
     def __str__(self) -> str:
         return self.name
 
-    def save(self, *args, **kwargs):
-        if self.thumbnail:
-            converter_to_webp(self.thumbnail)
-        super().save(*args, **kwargs)
 
 
-class Post(BaseModel):
+class Post(MediaFieldsMixin, BaseModel):
     event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name="post_event")
     file_type = models.CharField(max_length=50, choices=FILE_TYPE, default='image')
     file = models.FileField(upload_to=rename_file_name('post/'))
@@ -62,6 +62,8 @@ class Post(BaseModel):
         related_name="customer_post_group",
         null=True, blank=True
     )
+
+    media_fields = ('file',)
     
     class Meta:
         indexes = [
@@ -73,13 +75,11 @@ class Post(BaseModel):
     def __str__(self) -> str:
         return f"Post {self.id}"
     
-    def save(self, *args, **kwargs):
-        if self.file_type == 'image':
-            converter_to_webp(self.file)
-        super().save(*args, **kwargs)
+    def converts_to_webp(self, field_name):
+        return self.file_type == 'image'
 
 
-class OtherPost(BaseModel):
+class OtherPost(MediaFieldsMixin, BaseModel):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="other_post_categories")
     # name = models.CharField(max_length=100)
     file_type = models.CharField(max_length=50, choices=FILE_TYPE, default='image')
@@ -90,6 +90,8 @@ class OtherPost(BaseModel):
         related_name="customer_other_post_group",
         null=True, blank=True
     )
+
+    media_fields = ('file',)
     
     class Meta:
         indexes = [
@@ -101,16 +103,16 @@ class OtherPost(BaseModel):
     def __str__(self) -> str:
         return self.category.name
 
-    def save(self, *args, **kwargs):
-        if self.file_type == "image":
-            converter_to_webp(self.file)
-        super().save(*args, **kwargs)
+    def converts_to_webp(self, field_name):
+        return self.file_type == "image"
         
    
-class BusinessCategory(BaseModel):
+class BusinessCategory(MediaFieldsMixin, BaseModel):
     profession_type = models.CharField(max_length=20, choices=PROFESSION_TYPE)
     name = models.CharField(max_length=100, unique=True)
     thumbnail = models.FileField(upload_to=rename_file_name('business_category_thumbnail/'))
+
+    media_fields = ('thumbnail',)
     
     class Meta:
         indexes = [
@@ -122,10 +124,6 @@ class BusinessCategory(BaseModel):
         return self.name
     
     
-    def save(self, *args, **kwargs):
-        if self.thumbnail:
-            converter_to_webp(self.thumbnail)
-        super().save(*args, **kwargs)   
 
      
 class BusinessPost(BaseModel):
@@ -157,6 +155,11 @@ class BusinessPost(BaseModel):
         return f"Category is {self.business_category.name} and Profession is {self.profession_type}"
 
 
+# Mapping rows of posts whose event has no date carry this date, so the
+# partition key and the unique constraint never hold NULL.
+UNDATED_EVENT_DATE = date(9999, 12, 31)
+
+
 class CustomerPostFrameMapping(BaseModel):
     customer = models.ForeignKey(
         User,
@@ -180,6 +183,12 @@ class CustomerPostFrameMapping(BaseModel):
         db_index=True
     )
     is_downloaded = models.BooleanField(default=False)
+    # Copied from post.event; the table is range-partitioned by it, see
+    # app_modules.post.partitions.
+    event_date = models.DateField(default=UNDATED_EVENT_DATE)
+
+    # Columns copied from the post when a row is written, as column: expression on the post.
+    denormalized_fields = {'event_date': Coalesce('event__event_date', Value(UNDATED_EVENT_DATE))}
 
     def __str__(self) -> str:
         return f"Mapping {self.id}"
@@ -188,6 +197,12 @@ class CustomerPostFrameMapping(BaseModel):
         indexes = [
             models.Index(fields=['customer', 'post', 'customer_frame']),
         ]
+        constraints = [
+            # A unique constraint on a partitioned table must include the partition key.
+            models.UniqueConstraint(
+                fields=['customer_frame', 'post', 'event_date'], name='unique_customer_post_frame'
+            ),
+        ]
 
 
 class CustomerOtherPostFrameMapping(BaseModel):
@@ -209,6 +224,8 @@ class CustomerOtherPostFrameMapping(BaseModel):
     )
     is_downloaded = models.BooleanField(default=False)
 
+    denormalized_fields = {}
+
     def __str__(self) -> str:
         return self.customer.whatsapp_number
     
@@ -216,6 +233,11 @@ class CustomerOtherPostFrameMapping(BaseModel):
         indexes = [
             models.Index(fields=['customer', 'other_post', 'customer_frame']),
         ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['customer_frame', 'other_post'], name='unique_customer_other_post_frame'
+            ),
+        ]
 
 
 class BusinessPostFrameMapping(BaseModel):
@@ -241,10 +263,92 @@ class BusinessPostFrameMapping(BaseModel):
     )
     is_downloaded = models.BooleanField(default=False)
 
+    denormalized_fields = {}
+
     def __str__(self) -> str:
         return self.customer.whatsapp_number
     
     class Meta:
         indexes = [
             models.Index(fields=['customer', 'post', 'customer_frame']),
-        ]
\ No newline at end of file
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['customer_frame', 'post'], name='unique_business_post_frame'),
+        ]
+
+class FeedRow(models.Model):
+    """
+    Read-only feed row computed by joining a post to the customer's frames on
+    group, used when ``POST_FEED_MODE = "virtual"``. The primary key packs the
+    post id and the frame id (see ``app_modules.post.feed.pack_feed_id``).
+
+    Saving a row records its per-customer facts on the mapping table, which in
+    virtual mode only holds those sparse facts.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    customer = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    customer_frame = models.ForeignKey(
+        CustomerFrame, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+'
+    )
+    is_downloaded = models.BooleanField(default=False)
+
+    state_model = None
+    post_field = 'post'
+
+    class Meta:
+        abstract = True
+
+    def __str__(self) -> str:
+        return f"Feed {self.id}"
+
+    def save(self, *args, **kwargs):
+        post_id = getattr(self, f'{self.post_field}_id')
+        denormalized = self.state_model.denormalized_fields
+        copied = {}
+        if denormalized:
+            post_model = self._meta.get_field(self.post_field).related_model
+            copied = post_model.objects.filter(pk=post_id).values(**denormalized).get()
+
+        self.state_model.objects.bulk_create(
+            [self.state_model(
+                customer_id=self.customer_id,
+                customer_frame_id=self.customer_frame_id,
+                is_downloaded=self.is_downloaded,
+                **{f'{self.post_field}_id': post_id},
+                **copied
+            )],
+            update_conflicts=True,
+            unique_fields=['customer_frame', self.post_field, *denormalized],
+            update_fields=['is_downloaded', 'modified'],
+        )
+
+
+class CustomerPostFeed(FeedRow):
+    post = models.ForeignKey(Post, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+
+    state_model = CustomerPostFrameMapping
+
+    class Meta:
+        managed = False
+        db_table = 'post_customer_post_feed'
+
+
+class CustomerOtherPostFeed(FeedRow):
+    other_post = models.ForeignKey(OtherPost, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+
+    state_model = CustomerOtherPostFrameMapping
+    post_field = 'other_post'
+
+    class Meta:
+        managed = False
+        db_table = 'post_customer_other_post_feed'
+
+
+class BusinessPostFeed(FeedRow):
+    post = models.ForeignKey(BusinessPost, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+
+    state_model = BusinessPostFrameMapping
+
+    class Meta:
+        managed = False
+        db_table = 'post_business_post_feed'
@@ -0,0 +1,251 @@
+"""
+Monthly range partitions of ``CustomerPostFrameMapping`` by event date.
+
+Once ``manage.py partition_post_mappings`` has converted the table, every
+month of events lives in its own partition: partitions are created ahead of
+time and expiring a month of past events is a detach and drop instead of a
+row-by-row delete. Rows of undated events (``UNDATED_EVENT_DATE``) live in a
+partition of their own, so the default partition stays empty and creating a
+partition never has to scan it. Partitions are created by Celery tasks (the
+beat task and the event date sync), never in a request. Rows that reached the
+default partition anyway, e.g. while the table was being converted, are moved
+into the partition created for them. Until the table is converted the helpers
+here do nothing.
+"""
+import logging
+import re
+from datetime import date
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import UNDATED_EVENT_DATE, CustomerPostFrameMapping
+
+logger = logging.getLogger(__name__)
+
+MAPPING_TABLE = CustomerPostFrameMapping._meta.db_table
+DEFAULT_PARTITION = f"{MAPPING_TABLE}_default"
+UNDATED_PARTITION = f"{MAPPING_TABLE}_undated"
+
+PARTITION_NAME = re.compile(r'_p(\d{4})_(\d{2})$')
+
+IS_PARTITIONED_SQL = """
+    SELECT EXISTS (
+        SELECT 1 FROM pg_partitioned_table pt
+        JOIN pg_class c ON c.oid = pt.partrelid
+        WHERE c.oid = to_regclass(%s)
+    )
+"""
+
+DEFAULT_PARTITION_SQL = """
+    SELECT c.relname
+    FROM pg_partitioned_table pt
+    JOIN pg_class c ON c.oid = pt.partdefid
+    WHERE pt.partrelid = to_regclass(%s)
+"""
+
+PARTITIONS_SQL = """
+    SELECT child.relname, i.inhdetachpending
+    FROM pg_inherits i
+    JOIN pg_class child ON child.oid = i.inhrelid
+    WHERE i.inhparent = to_regclass(%s)
+"""
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def add_months(day, months):
+    years, month = divmod(day.month - 1 + months, 12)
+    return date(day.year + years, month + 1, 1)
+
+
+def partition_name(month, table=MAPPING_TABLE):
+    return f"{table}_p{month.year:04d}_{month.month:02d}"
+
+
+def undated_partition_name(table=MAPPING_TABLE):
+    return f"{table}_undated"
+
+
+def is_partitioned(table=MAPPING_TABLE):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(IS_PARTITIONED_SQL, [table])
+        return cursor.fetchone()[0]
+
+
+def monthly_partitions(table=MAPPING_TABLE, detach_pending=False):
+    """
+    ``{first day of month: partition name}`` of the existing monthly
+    partitions; with ``detach_pending``, of those left half detached by an
+    interrupted ``DETACH PARTITION ... CONCURRENTLY`` instead.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(PARTITIONS_SQL, [table])
+        names = [name for name, pending in cursor.fetchall() if pending == detach_pending]
+
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME.search(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def create_partition(name, first_day, end_day=None, table=MAPPING_TABLE):
+    """
+    Create the partition ``name`` of ``table`` for event dates from
+    ``first_day`` up to, not including, ``end_day`` (no upper bound when
+    ``None``). Rows of that range found in the default partition are moved
+    into the new partition, with the default detached meanwhile, instead of
+    making the ``CREATE`` fail.
+    """
+    # The bounds are dates formatted here, not user input; DDL takes no bind parameters.
+    upper = f"'{end_day.isoformat()}'" if end_day else 'MAXVALUE'
+    in_range = f"event_date >= '{first_day.isoformat()}'" + (f" AND event_date < {upper}" if end_day else '')
+    create = f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM ('{first_day.isoformat()}') TO ({upper})"
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(DEFAULT_PARTITION_SQL, [table])
+        row = cursor.fetchone()
+        default = row[0] if row else None
+        stray = False
+        if default:
+            cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {default} WHERE {in_range})")
+            stray = cursor.fetchone()[0]
+
+        if not stray:
+            cursor.execute(create)
+            return
+
+        cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {default}")
+        cursor.execute(create)
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {default} WHERE {in_range} RETURNING *) "
+            f"INSERT INTO {table} SELECT * FROM moved"
+        )
+        moved = cursor.rowcount
+        cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT")
+    logger.warning("PARTITIONS moved %s rows from %s to %s", moved, default, name)
+
+
+def ensure_undated_partition(table=MAPPING_TABLE):
+    """Create the partition of ``UNDATED_EVENT_DATE`` rows unless it exists; returns its name when created."""
+    name = undated_partition_name(table)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+        if cursor.fetchone()[0]:
+            return None
+    create_partition(name, UNDATED_EVENT_DATE, table=table)
+    logger.info("PARTITIONS created %s", name)
+    return name
+
+
+def create_partitions(first_month, last_month, table=MAPPING_TABLE):
+    """
+    Create the missing monthly partitions of ``table`` from the month of
+    ``first_month`` through the month of ``last_month``; returns their names.
+    """
+    existing = monthly_partitions(table)
+    created = []
+    month = month_start(first_month)
+    while month <= last_month:
+        if month not in existing:
+            name = partition_name(month, table)
+            create_partition(name, month, add_months(month, 1), table=table)
+            created.append(name)
+        month = add_months(month, 1)
+
+    if created:
+        logger.info("PARTITIONS created %s", ', '.join(created))
+    return created
+
+
+def ensure_mapping_partitions(day=None, months_ahead=None):
+    """
+    Make sure the mapping table has partitions from the month of ``day``
+    (today by default) through ``POST_MAPPING_PARTITION_MONTHS_AHEAD`` months
+    after it, and the partition of undated rows. Does nothing while the table
+    is not partitioned. Runs DDL on the mapping table: call it from tasks, not
+    from a request.
+    """
+    if not is_partitioned():
+        return []
+
+    if months_ahead is None:
+        months_ahead = settings.POST_MAPPING_PARTITION_MONTHS_AHEAD
+    first_month = month_start(day or date.today())
+    undated = ensure_undated_partition()
+    created = create_partitions(first_month, add_months(first_month, months_ahead))
+    return [undated, *created] if undated else created
+
+
+def drop_mapping_partitions_before(day):
+    """
+    Detach and drop the monthly partitions that only hold event dates before
+    ``day``; returns their names. Does nothing while the table is not
+    partitioned.
+
+    Runs from the maintenance task, never in a request, and outside any
+    transaction: partitions are detached ``CONCURRENTLY``, so feed reads and
+    fan-out inserts keep going. Postgres refuses that while the table has a
+    default partition; then each partition is detached in a transaction of its
+    own that gives up on the lock after ``POST_MAPPING_PARTITION_LOCK_TIMEOUT``
+    instead of queueing every reader behind it.
+    """
+    if not is_partitioned():
+        return []
+    if connection.in_atomic_block:
+        raise RuntimeError("Mapping partitions must be dropped outside a transaction.")
+
+    with connection.cursor() as cursor:
+        cursor.execute(DEFAULT_PARTITION_SQL, [MAPPING_TABLE])
+        concurrently = cursor.fetchone() is None
+
+    dropped = []
+    with connection.cursor() as cursor:
+        # Finish the detaches an earlier run was interrupted in.
+        for month, name in sorted(monthly_partitions(detach_pending=True).items()):
+            cursor.execute(f"ALTER TABLE {MAPPING_TABLE} DETACH PARTITION {name} FINALIZE")
+            cursor.execute(f"DROP TABLE {name}")
+            dropped.append(name)
+
+        for month, name in sorted(monthly_partitions().items()):
+            if add_months(month, 1) > day:
+                break
+            if concurrently:
+                cursor.execute(f"ALTER TABLE {MAPPING_TABLE} DETACH PARTITION {name} CONCURRENTLY")
+            else:
+                with transaction.atomic():
+                    cursor.execute(
+                        "SELECT set_config('lock_timeout', %s, true)",
+                        [f"{settings.POST_MAPPING_PARTITION_LOCK_TIMEOUT}ms"],
+                    )
+                    cursor.execute(f"ALTER TABLE {MAPPING_TABLE} DETACH PARTITION {name}")
+            cursor.execute(f"DROP TABLE {name}")
+            dropped.append(name)
+
+    if dropped:
+        logger.info("PARTITIONS dropped %s", ', '.join(dropped))
+    return dropped
+
+
+def sync_mapping_event_dates(posts):
+    """
+    Copy the current event date of ``posts`` onto their mapping rows, which
+    moves the rows to the partition of the new date. Returns the rows updated.
+    """
+    updated = 0
+    for event_id, event_date in posts.order_by().values_list('event_id', 'event__event_date').distinct():
+        if event_date is None:
+            event_date = UNDATED_EVENT_DATE
+        else:
+            ensure_mapping_partitions(event_date, months_ahead=0)
+        updated += CustomerPostFrameMapping.objects.filter(
+            post__in=posts.filter(event_id=event_id)
+        ).exclude(event_date=event_date).update(event_date=event_date)
+    return updated
+
@@ -0,0 +1,163 @@
+"""
+Asynchronous renders of post videos with the customer's frame burned in.
+
+A render job is identified by its inputs, the content of the post video and
+frame image (``lib.helpers.video_render_key``), so every request for the same
+pair attaches to one job no matter which customer or mapping it came from.
+Submitting creates the job in the cache with ``cache.add`` (only the first of
+concurrent requests wins and queues the task) and returns straight away with
+a ``Retry-After``; the client polls until the job is done and carries the URL
+of the output video. ``wait`` long-polls for at most ``RENDER_JOB_MAX_WAIT``
+seconds, which is only more than a couple of seconds behind an async gunicorn
+worker class.
+
+A finished job stays in the cache for ``RENDER_JOB_TIMEOUT`` seconds, so
+repeated submissions are answered with the earlier result. A failed job, or
+one whose output was evicted from the render cache, is queued again by the
+next submission.
+
+With ``VIDEO_PRERENDER_ON_PUBLISH`` the renders of a new video post are
+submitted for every distinct frame of its group as soon as it is published
+(``prerender``), at a lower priority than renders customers are waiting for
+and ordered by how soon the post's event is, so the morning rush finds them
+in the render cache.
+"""
+import logging
+import os
+import time
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from account.models import CustomerFrame
+from lib.helpers import RENDERED_VIDEO_CACHE, video_render_key
+from .fanout import FEEDS
+
+logger = logging.getLogger(__name__)
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+FINISHED = (DONE, FAILED)
+
+
+def _job_key(job_id):
+    return f"render_job:{job_id}"
+
+
+def get_render_job(job_id):
+    return cache.get(_job_key(job_id))
+
+
+def _save_job(job):
+    cache.set(_job_key(job['id']), job, timeout=settings.RENDER_JOB_TIMEOUT)
+
+
+def submit_render(feed, post, customer_frame, priority=0):
+    """
+    The render job of ``post`` (a post of ``feed``) with ``customer_frame``,
+    queueing it unless the same render is already queued, running or done.
+    ``priority`` goes from 0, the highest, to 9.
+    """
+    from .tasks import render_output_video
+
+    digest, video, frame = video_render_key(post.file, customer_frame.frame_img)
+    job_id = digest[:32]
+    job = get_render_job(job_id)
+    attempt = 1
+    if job is not None:
+        if job['status'] == DONE and os.path.exists(RENDERED_VIDEO_CACHE.full_path(digest)):
+            return job
+        if job['status'] in (PENDING, RUNNING):
+            return job
+        # Failed, or done but evicted from the render cache since. Only one of
+        # the requests that find the job queues it again.
+        if not cache.add(f"{_job_key(job_id)}:retry:{job['attempt']}", True, timeout=settings.RENDER_JOB_TIMEOUT):
+            return job
+        attempt = job['attempt'] + 1
+
+    job = {
+        'id': job_id, 'status': PENDING, 'attempt': attempt, 'output_video': None, 'error': None,
+        'submitted': timezone.now().isoformat(),
+    }
+    if attempt == 1:
+        if not cache.add(_job_key(job_id), job, timeout=settings.RENDER_JOB_TIMEOUT):
+            return get_render_job(job_id) or job
+    else:
+        _save_job(job)
+
+    render_output_video.apply_async((job_id, feed, post.id, customer_frame.id), priority=priority)
+    logger.info("RENDER job %s queued for %s with %s", job_id, post.file.name, customer_frame.frame_img.name)
+    return job
+
+
+def mark_render_running(job_id):
+    job = get_render_job(job_id)
+    if job is not None:
+        _save_job({**job, 'status': RUNNING})
+
+
+def mark_render_finished(job_id, output_video=None, error=None):
+    job = get_render_job(job_id) or {'id': job_id, 'attempt': 1, 'submitted': None}
+    _save_job({
+        **job, 'status': FAILED if error else DONE, 'output_video': output_video, 'error': error,
+        'finished': timezone.now().isoformat(),
+    })
+
+
+def wait_for_render(job_id, wait):
+    """
+    The render job ``job_id``, waiting up to ``wait`` seconds (capped at
+    ``RENDER_JOB_MAX_WAIT``) for it to finish; ``None`` for unknown jobs.
+    """
+    deadline = time.monotonic() + min(max(wait, 0), settings.RENDER_JOB_MAX_WAIT)
+    job = get_render_job(job_id)
+    while job is not None and job['status'] not in FINISHED and time.monotonic() < deadline:
+        time.sleep(settings.RENDER_JOB_POLL_INTERVAL)
+        job = get_render_job(job_id)
+    return job
+
+
+def prerender_priority(post):
+    """
+    Task priority of the pre-render of ``post``: 1 for events dated today,
+    one step lower per day until the event, and the lowest (9) for posts
+    without an event date; ``None`` for past events. 0 is left to the renders
+    customers are waiting for.
+    """
+    event = getattr(post, 'event', None)
+    if event is None or event.event_date is None:
+        return 9
+    days = (event.event_date - date.today()).days
+    return None if days < 0 else min(days + 1, 9)
+
+
+def prerender(feed, post_ids):
+    """
+    Submit the renders of the video posts of ``feed`` in ``post_ids`` with
+    each distinct frame image of their group, the most used frames first and
+    at most ``VIDEO_PRERENDER_MAX_FRAMES`` per post. Returns the number of
+    renders submitted.
+    """
+    posts = FEEDS[feed].source.objects.filter(id__in=post_ids, file_type='video', group__isnull=False)
+    if feed == 'post':
+        posts = posts.select_related('event')
+
+    submitted = 0
+    for post in posts:
+        priority = prerender_priority(post)
+        if priority is None:
+            continue
+        # One customer frame stands in for every frame sharing its image.
+        frames = (
+            CustomerFrame.objects.filter(group_id=post.group_id).exclude(frame_img='').exclude(frame_img=None)
+            .values('frame_img').annotate(customers=Count('id'), frame_id=Min('id'))
+            .order_by('-customers')[:settings.VIDEO_PRERENDER_MAX_FRAMES]
+        )
+        for customer_frame in CustomerFrame.objects.filter(id__in=[frame['frame_id'] for frame in frames]):
+            submit_render(feed, post, customer_frame, priority)
+            submitted += 1
+
+    logger.info("RENDER pre-render of %s %s submitted %s renders", feed, post_ids, submitted)
+    return submitted
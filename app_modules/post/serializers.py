@@ -1,7 +1,11 @@
 from rest_framework import serializers
+from django.db import transaction
 from django.utils import timezone
 
-from account.models import CustomerFrame
+from account.models import CustomerFrame, CustomerGroup
+from lib.constants import FILE_TYPE
+from lib.dispatch import dispatcher
+from lib.media import MediaMetadataField, MediaStatusField, add_references, ResponsiveFileField, ResponsiveMediaSerializerMixin
 from .models import (
     Category, Post, Event, OtherPost, CustomerPostFrameMapping, CustomerOtherPostFrameMapping,
     BusinessPost, BusinessPostFrameMapping, BusinessCategory
@@ -9,25 +13,24 @@ from .models import (
 
 
 class SubcategorySerializer(serializers.ModelSerializer):
-    banner_image = serializers.SerializerMethodField()
+    banner_image = ResponsiveFileField(read_only=True)
 
     class Meta:
         model = Category
         fields = ['id', 'name', 'banner_image']
-
-    def get_banner_image(self, obj):
-        request = self.context.get('request')
-        if obj.banner_image:
-            return request.build_absolute_uri(obj.banner_image.url)
-        return None
         
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(ResponsiveMediaSerializerMixin, serializers.ModelSerializer):
     sub_categories = serializers.SerializerMethodField()
+    banner_image_status = MediaStatusField(source='banner_image')
+    banner_image_metadata = MediaMetadataField(source='banner_image')
 
     class Meta:
         model = Category
-        fields = ['id', 'name', 'sub_category', 'sub_categories', 'banner_image', 'is_active', 'is_featured']
+        fields = [
+            'id', 'name', 'sub_category', 'sub_categories', 'banner_image', 'banner_image_status',
+            'banner_image_metadata', 'is_active', 'is_featured'
+        ]
 
     def get_sub_categories(self, obj):
         if not self.context.get('exclude_main_categories'):
@@ -37,11 +40,14 @@ class CategorySerializer(serializers.ModelSerializer):
         return []
     
 
-class BusinessCategorySerializer(serializers.ModelSerializer):
+class BusinessCategorySerializer(ResponsiveMediaSerializerMixin, serializers.ModelSerializer):
+    thumbnail_status = MediaStatusField(source='thumbnail')
+    thumbnail_metadata = MediaMetadataField(source='thumbnail')
+
     class Meta:
         model = BusinessCategory
         fields = [
-            'id', 'profession_type', 'name', 'thumbnail'
+            'id', 'profession_type', 'name', 'thumbnail', 'thumbnail_status', 'thumbnail_metadata'
         ]
         
     
@@ -51,17 +57,20 @@ class BusinessCategorySerializer(serializers.ModelSerializer):
     #     return value
 
 
-class SubCategorySerializer(serializers.ModelSerializer):
+class SubCategorySerializer(ResponsiveMediaSerializerMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Category
         fields = ['id', 'name', 'banner_image', 'is_active', 'is_featured']
 
    
-class EventSerializer(serializers.ModelSerializer):
+class EventSerializer(ResponsiveMediaSerializerMixin, serializers.ModelSerializer):
+    thumbnail_status = MediaStatusField(source='thumbnail')
+    thumbnail_metadata = MediaMetadataField(source='thumbnail')
+
     class Meta:
         model = Event
-        fields = ['id', 'name', 'event_date', 'event_type', 'thumbnail']
+        fields = ['id', 'name', 'event_date', 'event_type', 'thumbnail', 'thumbnail_status', 'thumbnail_metadata']
         
     def validate_event_date(self, value):
         if value and value < timezone.now().date():
@@ -69,14 +78,16 @@ class EventSerializer(serializers.ModelSerializer):
         return value
         
 
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(ResponsiveMediaSerializerMixin, serializers.ModelSerializer):
     group_name = serializers.SerializerMethodField()
     event_details = serializers.SerializerMethodField()
     customer_details = serializers.SerializerMethodField()
+    file_status = MediaStatusField(source='file')
+    file_metadata = MediaMetadataField(source='file')
 
     class Meta:
         model = Post
-        fields = ['id', 'event', 'file_type', 'file', 'group', 'added_on',
+        fields = ['id', 'event', 'file_type', 'file', 'file_status', 'file_metadata', 'group', 'added_on',
                   'group_name', 'customer_details', 'event_details']
 
     def get_customer_details(self, obj):
@@ -105,20 +116,63 @@ class PostSerializer(serializers.ModelSerializer):
         return event_details
 
     
-class OtherPostSerializer(serializers.ModelSerializer):
+class PostPublishSerializer(serializers.Serializer):
+    """Publishes one uploaded file as a Post for every group in ``groups``."""
+    event = serializers.PrimaryKeyRelatedField(queryset=Event.objects.all())
+    file_type = serializers.ChoiceField(choices=FILE_TYPE, default='image')
+    file = serializers.FileField()
+    groups = serializers.PrimaryKeyRelatedField(queryset=CustomerGroup.objects.all(), many=True, allow_empty=False)
+
+    def validate_groups(self, value):
+        # Keep the order the groups were sent in, without duplicates.
+        return list(dict.fromkeys(value))
+
+    def validate(self, data):
+        existing_groups = CustomerGroup.objects.filter(
+            customer_post_group__event=data['event'], id__in=[group.id for group in data['groups']]
+        ).values_list('name', flat=True)
+        if existing_groups:
+            raise serializers.ValidationError(
+                {"groups": f"A post for this event already exists for group(s): {', '.join(existing_groups)}."}
+            )
+        return data
+
+    def create(self, validated_data):
+        groups = validated_data.pop('groups')
+        with transaction.atomic():
+            # The first save stores the upload and queues its WebP conversion,
+            # which swaps every post holding the stored file; the other posts
+            # point at that same file.
+            first_post = Post.objects.create(group=groups[0], **validated_data)
+            other_posts = Post.objects.bulk_create([
+                Post(event=first_post.event, file_type=first_post.file_type, file=first_post.file.name, group=group)
+                for group in groups[1:]
+            ])
+            # bulk_create skips save(), which counts the references of a row.
+            add_references(first_post.file.name, len(other_posts))
+            # bulk_create sends no post_save; queue these with the first post
+            # so the whole publish is fanned out by one job on commit.
+            for post in other_posts:
+                dispatcher.add('post', post.id)
+        return [first_post, *other_posts]
+
+
+class OtherPostSerializer(ResponsiveMediaSerializerMixin, serializers.ModelSerializer):
     category_name = serializers.CharField(source="category.name", read_only=True)
     group_name = serializers.CharField(source="group.name", read_only=True)
+    file_status = MediaStatusField(source='file')
+    file_metadata = MediaMetadataField(source='file')
     
     class Meta:
         model  = OtherPost
-        fields = ['id', 'category', 'category_name', 'file_type', 'file', 'group', 'group_name']
+        fields = ['id', 'category', 'category_name', 'file_type', 'file', 'file_status', 'file_metadata', 'group', 'group_name']
     
     
-class BusinessPostSerializer(serializers.ModelSerializer):
+class BusinessPostSerializer(ResponsiveMediaSerializerMixin, serializers.ModelSerializer):
     group_name = serializers.CharField(source="group.name", read_only=True)
     customer_details = serializers.SerializerMethodField()
     business_category_name = serializers.CharField(source="business_category.name", read_only=True)
-    thumbnail = serializers.FileField(source="business_category.thumbnail", read_only=True)
+    thumbnail = ResponsiveFileField(source="business_category.thumbnail", read_only=True)
     
     class Meta:
         model = BusinessPost
@@ -135,8 +189,10 @@ class BusinessPostSerializer(serializers.ModelSerializer):
         
 
 class CustomerPostFrameMappingSerializer(serializers.ModelSerializer):
-    post_image = serializers.FileField(source="post.file", read_only=True)
-    frame_image= serializers.FileField(source="customer_frame.frame_img", read_only=True)
+    post_image = ResponsiveFileField(source="post.file", read_only=True)
+    frame_image= ResponsiveFileField(source="customer_frame.frame_img", read_only=True)
+    post_metadata = MediaMetadataField(source="post.file")
+    frame_metadata = MediaMetadataField(source="customer_frame.frame_img")
     customer_number = serializers.SerializerMethodField(read_only=True)
     is_a_group = serializers.SerializerMethodField()
     event_name = serializers.SerializerMethodField()
@@ -146,7 +202,7 @@ class CustomerPostFrameMappingSerializer(serializers.ModelSerializer):
         model = CustomerPostFrameMapping
         fields = [
             'id', 'customer', 'customer_number', 'post', 'customer_frame', 'is_downloaded', 'post_image',
-            'frame_image', 'is_a_group', 'event_name'
+            'frame_image', 'post_metadata', 'frame_metadata', 'is_a_group', 'event_name'
         ]
         
     def get_customer_number(self,obj):
@@ -166,15 +222,17 @@ class CustomerPostFrameMappingSerializer(serializers.ModelSerializer):
     
     
 class CustomerOtherPostFrameMappingSerializer(serializers.ModelSerializer):
-    post_image = serializers.FileField(source="other_post.file", read_only=True)
-    frame_image= serializers.FileField(source="customer_frame.frame_img", read_only=True)
+    post_image = ResponsiveFileField(source="other_post.file", read_only=True)
+    frame_image= ResponsiveFileField(source="customer_frame.frame_img", read_only=True)
+    post_metadata = MediaMetadataField(source="other_post.file")
+    frame_metadata = MediaMetadataField(source="customer_frame.frame_img")
     is_a_group = serializers.SerializerMethodField()
     
     class Meta:
         model = CustomerOtherPostFrameMapping
         fields = [
             'id', 'customer', 'other_post', 'customer_frame', 'is_downloaded', 'post_image', 'frame_image',
-            'is_a_group'
+            'post_metadata', 'frame_metadata', 'is_a_group'
         ]
         
     
@@ -186,8 +244,10 @@ class CustomerOtherPostFrameMappingSerializer(serializers.ModelSerializer):
                
         
 class BusinessPostFrameMappingSerializer(serializers.ModelSerializer):
-    post_image = serializers.FileField(source="post.file", read_only=True)
-    frame_image= serializers.FileField(source="customer_frame.frame_img", read_only=True)
+    post_image = ResponsiveFileField(source="post.file", read_only=True)
+    frame_image= ResponsiveFileField(source="customer_frame.frame_img", read_only=True)
+    post_metadata = MediaMetadataField(source="post.file")
+    frame_metadata = MediaMetadataField(source="customer_frame.frame_img")
     customer_number = serializers.SerializerMethodField(read_only=True)
     is_a_group = serializers.SerializerMethodField()
 
@@ -195,7 +255,7 @@ class BusinessPostFrameMappingSerializer(serializers.ModelSerializer):
         model = BusinessPostFrameMapping
         fields = [
             'id', 'customer', 'customer_number', 'post', 'customer_frame', 'is_downloaded', 'post_image',
-            'frame_image', 'is_a_group'
+            'frame_image', 'post_metadata', 'frame_metadata', 'is_a_group'
         ]
         
     def get_customer_number(self,obj):
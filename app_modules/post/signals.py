@@ -1,30 +1,52 @@
+from functools import partial
+
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
-from app_modules.post.tasks import (
-    map_post_with_customer_frames,
-    map_other_post_with_customer_frames,
-    map_business_post_with_customer_frames,
-)
-from .models import Post, OtherPost, BusinessPost
+from app_modules.post.tasks import queue_fan_out, sync_event_mapping_dates, sync_post_mapping_dates
+from lib.dispatch import dispatcher
+from .models import Event, Post, OtherPost, BusinessPost
+
+for feed in ('post', 'other_post', 'business_post'):
+    dispatcher.register(feed, partial(queue_fan_out, feed))
+dispatcher.register('event_mapping_dates', sync_event_mapping_dates.delay)
+dispatcher.register('post_mapping_dates', sync_post_mapping_dates.delay)
 
 
-@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Post, dispatch_uid='trigger_post_mapping')
 def trigger_post_mapping(sender, instance, created, **kwargs):
-    """Trigger post mapping when a new Post is created."""
+    """Collect the new Post; posts created in one transaction are mapped by one job."""
     if created:
-        map_post_with_customer_frames(instance.id)
+        dispatcher.add('post', instance.id)
 
 
-@receiver(post_save, sender=OtherPost)
+@receiver(post_save, sender=OtherPost, dispatch_uid='trigger_other_post_mapping')
 def trigger_other_post_mapping(sender, instance, created, **kwargs):
-    """Trigger other post mapping when a new OtherPost is created."""
+    """Collect the new OtherPost; other posts created in one transaction are mapped by one job."""
     if created:
-        map_other_post_with_customer_frames(instance.id)
+        dispatcher.add('other_post', instance.id)
 
 
-@receiver(post_save, sender=BusinessPost)
+@receiver(post_save, sender=BusinessPost, dispatch_uid='trigger_business_post_mapping')
 def trigger_business_post_mapping(sender, instance, created, **kwargs):
-    """Trigger business post mapping when a new BusinessPost is created."""
+    """Collect the new BusinessPost; business posts created in one transaction are mapped by one job."""
     if created:
-        map_business_post_with_customer_frames(instance.id)
+        dispatcher.add('business_post', instance.id)
+
+
+@receiver(post_save, sender=Event, dispatch_uid='sync_event_mapping_partitions')
+def sync_event_mapping_partitions(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Have the date sync task create the mapping partition of a new Event's
+    month and follow date changes; partition DDL never runs in the request.
+    Events saved in one transaction are synced by one job.
+    """
+    if (created and instance.event_date) or (update_fields and 'event_date' in update_fields):
+        dispatcher.add('event_mapping_dates', instance.id)
+
+
+@receiver(post_save, sender=Post, dispatch_uid='sync_post_mapping_partitions')
+def sync_post_mapping_partitions(sender, instance, created, update_fields=None, **kwargs):
+    """Move the mapping rows of a Post that was attached to another Event; one job per transaction."""
+    if not created and update_fields and 'event' in update_fields:
+        dispatcher.add('post_mapping_dates', instance.id)
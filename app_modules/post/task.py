@@ -1,47 +1,97 @@
-import ffmpeg
-import urllib.request
+import logging
 import os
-from celery import shared_task
+import shutil
+import tempfile
 import time
+from urllib.parse import urlparse
+
+import ffmpeg
+import requests
+from PIL import Image
+from celery import shared_task
+from django.conf import settings
+
+from lib.helpers import frame_overlay_filter
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class DownloadTooLarge(ValueError):
+    pass
+
+
+def download(url, path, max_bytes):
+    """
+    Stream ``url`` to ``path`` without holding it in memory, giving up as
+    soon as it is over ``max_bytes``. Only http(s) URLs are fetched.
+    """
+    if urlparse(url).scheme not in ('http', 'https'):
+        raise ValueError(f"Refusing to download {url!r}: only http and https URLs are allowed")
 
+    with requests.get(url, stream=True, timeout=settings.PROCESS_VIDEO_DOWNLOAD_TIMEOUT) as response:
+        response.raise_for_status()
+        if int(response.headers.get('Content-Length') or 0) > max_bytes:
+            raise DownloadTooLarge(f"{url} is {response.headers['Content-Length']} bytes, over {max_bytes}")
 
-@shared_task(bind=True)
-def process_video(user_id, video_url, frame_image_url, output_video):
-    # Generate the output video filename
-    output_video = f"{user_id}_{int(time.time())}_output.mp4"
-    print("Video URL (Before urlretrieve):", video_url)
-    print("Frame Image URL (Before urlretrieve):", frame_image_url)
-    
-    # Download the video file
-    urllib.request.urlretrieve(video_url, "input.mp4")
+        received = 0
+        with open(path, 'wb') as output:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                received += len(chunk)
+                if received > max_bytes:
+                    raise DownloadTooLarge(f"{url} is over {max_bytes} bytes")
+                output.write(chunk)
+    return received
 
-    # Download the frame image
-    urllib.request.urlretrieve(frame_image_url, "frame.png")
 
-    # Get the video dimensions
-    video_info = ffmpeg.probe("input.mp4")
-    video_width = int(video_info['streams'][0]['width'])
-    video_height = int(video_info['streams'][0]['height'])
+@shared_task(bind=True, max_retries=3)
+def process_video(self, user_id, video_url, frame_image_url, output_video=None):
+    """
+    Download a video and a frame image, draw the frame over the video in one
+    ffmpeg pass and store the result under ``MEDIA_ROOT/processed-video``, as
+    ``output_video`` when given, which must be a plain file name. Every job
+    works in its own temporary directory, so any number of them can run side
+    by side.
+    """
+    if output_video and (
+        output_video in ('.', '..') or os.path.basename(output_video) != output_video or '\\' in output_video
+    ):
+        raise ValueError(f"Refusing to write {output_video!r}: output_video must be a plain file name")
+    output_video = output_video or f"{user_id}_{int(time.time())}_output.mp4"
+    output_directory = os.path.join(settings.MEDIA_ROOT, 'processed-video')
 
-    # Get the frame image dimensions
-    frame_info = ffmpeg.probe("frame.png")
-    frame_width = int(frame_info['streams'][0]['width'])
-    frame_height = int(frame_info['streams'][0]['height'])
+    with tempfile.TemporaryDirectory(prefix=f"process_video_{self.request.id}_") as workspace:
+        video_path = os.path.join(workspace, 'input.mp4')
+        frame_path = os.path.join(workspace, 'frame.png')
+        rendered_path = os.path.join(workspace, 'output.mp4')
+        try:
+            download(video_url, video_path, settings.PROCESS_VIDEO_MAX_VIDEO_BYTES)
+            download(frame_image_url, frame_path, settings.PROCESS_VIDEO_MAX_FRAME_BYTES)
+        except requests.RequestException as exc:
+            raise self.retry(exc=exc, countdown=30)
 
-    # Calculate the scale factor based on the video dimensions
-    scale_factor = min(video_width / frame_width, video_height / frame_height)
+        # Get the video dimensions
+        video_stream = next(
+            stream for stream in ffmpeg.probe(video_path)['streams'] if stream.get('codec_type') == 'video'
+        )
+        video_size = (int(video_stream['width']), int(video_stream['height']))
 
-    # Calculate the frame position
-    frame_x = int((video_width - frame_width * scale_factor) / 2)
-    frame_y = int((video_height - frame_height * scale_factor) / 2)
+        # Get the frame image dimensions from its header
+        with Image.open(frame_path) as frame:
+            frame_size = frame.size
 
-    # Add frame to the video using ffmpeg
-    ffmpeg.input("input.mp4").output("temp.mp4", vf="movie={},scale={}*iw:{}*ih,format=rgba [watermark]; [in][watermark] overlay={}:{} [out]".format("frame.png", scale_factor, scale_factor, frame_x, frame_y), **{'c:a': 'copy'}).run()
+        # Add the frame to the video and write the final file in a single pass
+        ffmpeg.input(video_path).output(
+            rendered_path, vf=frame_overlay_filter(frame_path, video_size, frame_size),
+            movflags='+faststart', threads=settings.PROCESS_VIDEO_FFMPEG_THREADS, **{'c:a': 'copy'}
+        ).overwrite_output().run(quiet=True)
 
-    # Rename the output file to the desired name
-    ffmpeg.input("temp.mp4").output(output_video).run()
+        # Copied next to the final name first so it never shows up half written
+        os.makedirs(output_directory, exist_ok=True)
+        output_path = os.path.join(output_directory, output_video)
+        shutil.move(rendered_path, f"{output_path}.tmp")
+        os.replace(f"{output_path}.tmp", output_path)
 
-    # Delete temporary files
-    os.remove("input.mp4")
-    os.remove("temp.mp4")
-    os.remove("frame.png")
\ No newline at end of file
+    logger.info("PROCESS_VIDEO %s for user %s done", output_video, user_id)
+    return f"Processed video for user {user_id}: {os.path.join(settings.MEDIA_URL, 'processed-video', output_video)}"
@@ -1,8 +1,28 @@
-from celery import shared_task
+from datetime import date
+
+from celery import group, shared_task
+from django.conf import settings
+
+from account.models import CustomerFrame
+from lib.helpers import generate_video_with_frame
+
+from .fanout import (
+    FEEDS, customer_ranges, fan_out_sql, frames_for_post, mark_fan_out_pending, mark_fan_out_running,
+    record_chunk_done
+)
 from .models import *
+from .partitions import drop_mapping_partitions_before, ensure_mapping_partitions, sync_mapping_event_dates
+from .rendering import mark_render_finished, mark_render_running, prerender
+# Registered with the other post tasks; Celery only discovers modules named tasks.
+from .task import process_video  # noqa: F401
 
 @shared_task
 def map_post_with_customer_frames(post_id):
+    if settings.POST_FANOUT_STRATEGY == 'sql':
+        if not Post.objects.filter(id=post_id).exists():
+            return f"Post with id {post_id} does not exist."
+        return fan_out_sql('post', [post_id])
+
     try:
         instance = Post.objects.select_related('event', 'group').get(id=post_id)
     except Post.DoesNotExist:
@@ -15,17 +35,24 @@ def map_post_with_customer_frames(post_id):
             customer_id=customer_id,
             post=instance,
             customer_frame_id=frame_id,
+            event_date=instance.event.event_date or UNDATED_EVENT_DATE,
         )
         for customer_id, frame_id in customer_frames
     ]
 
     CustomerPostFrameMapping.objects.bulk_create(
         customer_frame_mappings, 
-        batch_size=200
+        batch_size=200,
+        ignore_conflicts=True
     )
 
 @shared_task
 def map_other_post_with_customer_frames(other_post_id):
+    if settings.POST_FANOUT_STRATEGY == 'sql':
+        if not OtherPost.objects.filter(id=other_post_id).exists():
+            return f"OtherPost with id {other_post_id} does not exist."
+        return fan_out_sql('other_post', [other_post_id])
+
     try:
         instance = OtherPost.objects.get(id=other_post_id)
     except OtherPost.DoesNotExist:
@@ -55,33 +82,33 @@ def map_other_post_with_customer_frames(other_post_id):
 
     CustomerOtherPostFrameMapping.objects.bulk_create(
         all_mappings, 
-        batch_size=350
+        batch_size=350,
+        ignore_conflicts=True
     )
 
 @shared_task
 def map_business_post_with_customer_frames(business_post_id):
+    if settings.POST_FANOUT_STRATEGY == 'sql':
+        if not BusinessPost.objects.filter(id=business_post_id).exists():
+            return f"BusinessPost with id {business_post_id} does not exist."
+        return fan_out_sql('business_post', [business_post_id])
+
     try:
         instance = BusinessPost.objects.get(id=business_post_id)
     except BusinessPost.DoesNotExist:
         return f"BusinessPost with id {business_post_id} does not exist."
 
     customer_group = instance.group
+    customer_frames = customer_group.customer_frame_group.filter(**frames_for_post('business_post', instance))
 
-    customer_ids = list(customer_group.customer_frame_group.values_list(
+    customer_ids = list(customer_frames.values_list(
         'customer_id', 
         flat=True
     ).distinct())
 
-    existing_mappings = set(
-        BusinessPostFrameMapping.objects.filter(
-            post=instance,
-            customer_id__in=customer_ids
-        ).values_list('customer_id', 'customer_frame_id')
-    )
-
     mappings_to_create = []
     for customer_id in customer_ids:
-        customer_frame_ids = customer_group.customer_frame_group.filter(
+        customer_frame_ids = customer_frames.filter(
             customer_id=customer_id
         ).values_list('id', flat=True)
 
@@ -92,10 +119,123 @@ def map_business_post_with_customer_frames(business_post_id):
                 customer_frame_id=frame_id
             )
             for frame_id in customer_frame_ids
-            if (customer_id, frame_id) not in existing_mappings
         ])
 
     BusinessPostFrameMapping.objects.bulk_create(
         mappings_to_create, 
-        batch_size=350
+        batch_size=350,
+        ignore_conflicts=True
     )
+
+
+MAPPING_TASKS = {
+    'post': map_post_with_customer_frames,
+    'other_post': map_other_post_with_customer_frames,
+    'business_post': map_business_post_with_customer_frames,
+}
+
+
+def queue_fan_out(feed, post_ids):
+    """
+    Record the fan-out of ``post_ids`` as pending and hand it to the fan-out
+    queue as one job, queueing the pre-render of their videos when enabled.
+    """
+    post_ids = sorted(post_ids)
+    if settings.VIDEO_PRERENDER_ON_PUBLISH:
+        prerender_post_videos.delay(feed, post_ids)
+
+    mark_fan_out_pending(feed, post_ids)
+    if settings.POST_FEED_MODE == 'virtual':
+        # Virtual feeds are computed at read time; there is nothing to write.
+        mark_fan_out_running(feed, post_ids, 0)
+        return
+
+    fan_out_posts.delay(feed, post_ids)
+
+
+@shared_task
+def fan_out_posts(feed, post_ids):
+    if settings.POST_FANOUT_STRATEGY != 'sql':
+        mark_fan_out_running(feed, post_ids, 1)
+        for post_id in post_ids:
+            MAPPING_TASKS[feed](post_id)
+            record_chunk_done(feed, post_id, 0)
+        return f"Mapping completed for {FEEDS[feed].source.__name__} ids {post_ids}"
+
+    ranges = customer_ranges(feed, post_ids, settings.POST_FANOUT_CHUNK_SIZE)
+    mark_fan_out_running(feed, post_ids, len(ranges))
+    if ranges:
+        group(
+            fan_out_posts_chunk.s(feed, post_ids, customer_from, customer_to)
+            for customer_from, customer_to in ranges
+        ).apply_async()
+
+    return f"Fan-out of {FEEDS[feed].source.__name__} ids {post_ids} split into {len(ranges)} chunks"
+
+
+@shared_task
+def fan_out_posts_chunk(feed, post_ids, customer_from, customer_to):
+    report = fan_out_sql(feed, post_ids, (customer_from, customer_to))
+    for post_id in post_ids:
+        record_chunk_done(feed, post_id, report['rows_by_post'].get(post_id, 0))
+    return report
+
+
+@shared_task
+def sync_event_mapping_dates(event_ids):
+    """Move the mapping rows of the posts of the Events in ``event_ids`` to the partitions of their new dates."""
+    return sync_mapping_event_dates(Post.objects.filter(event_id__in=event_ids))
+
+
+@shared_task
+def sync_post_mapping_dates(post_ids):
+    """Move the mapping rows of the Posts in ``post_ids``, which changed Event, to the partitions of the new dates."""
+    return sync_mapping_event_dates(Post.objects.filter(id__in=post_ids))
+
+
+@shared_task
+def create_mapping_partitions():
+    """Create the upcoming monthly mapping partitions; scheduled with celery beat."""
+    return ensure_mapping_partitions()
+
+
+@shared_task
+def delete_past_events(day):
+    """
+    Delete the events dated before ``day`` (ISO format) with their posts and
+    mappings. Whole months of mappings go with their partitions, detached
+    without blocking the feed; the rest with one set-based delete.
+    """
+    day = date.fromisoformat(day)
+    events = Event.objects.filter(event_date__lt=day)
+    dropped = drop_mapping_partitions_before(day)
+    CustomerPostFrameMapping.objects.filter(post__event__in=events).delete()
+    Post.objects.filter(event__in=events).delete()
+    deleted = events.delete()[1].get(Event._meta.label, 0)
+    return f"Deleted {deleted} events before {day}, dropped {len(dropped)} mapping partitions."
+
+
+@shared_task
+def render_output_video(job_id, feed, post_id, customer_frame_id):
+    """Render a queued ``app_modules.post.rendering`` job and record the output video URL on it."""
+    try:
+        post = FEEDS[feed].source.objects.get(id=post_id)
+        customer_frame = CustomerFrame.objects.get(id=customer_frame_id)
+    except (FEEDS[feed].source.DoesNotExist, CustomerFrame.DoesNotExist) as exc:
+        mark_render_finished(job_id, error=str(exc))
+        return f"Render job {job_id}: {exc}"
+
+    mark_render_running(job_id)
+    try:
+        output_video_url = generate_video_with_frame(customer_frame, post)
+    except Exception as exc:
+        mark_render_finished(job_id, error=str(exc) or type(exc).__name__)
+        raise
+
+    mark_render_finished(job_id, output_video=output_video_url)
+    return f"Render job {job_id} done: {output_video_url}"
+
+
+@shared_task
+def prerender_post_videos(feed, post_ids):
+    return f"Pre-render of {FEEDS[feed].source.__name__} ids {post_ids}: {prerender(feed, post_ids)} renders submitted"
@@ -1,3 +1,194 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from lib.disk_cache import DISK_CACHES, DiskCache
+from lib.dispatch import CoalescingDispatcher
+from .rendering import DONE, PENDING, get_render_job, mark_render_finished, submit_render
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class CoalescingDispatcherTests(TestCase):
+
+    def setUp(self):
+        self.dispatcher = CoalescingDispatcher()
+        self.calls = []
+        self.dispatcher.register('posts', self.calls.append)
+
+    def test_ids_of_one_transaction_are_handled_in_one_call(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for post_id in (2, 1, 2):
+                self.dispatcher.add('posts', post_id)
+            self.assertEqual(self.calls, [])
+        self.assertEqual(self.calls, [[1, 2]])
+
+    def test_batch_of_a_rolled_back_transaction_is_dropped(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    self.dispatcher.add('posts', 1)
+                    raise ValueError
+            self.dispatcher.add('posts', 2)
+        self.assertEqual(self.calls, [[2]])
+
+    def test_keys_are_handled_separately(self):
+        frames = []
+        self.dispatcher.register('frames', frames.append)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dispatcher.add('posts', 1)
+            self.dispatcher.add('frames', 7)
+        self.assertEqual((self.calls, frames), ([[1]], [[7]]))
+
+    def test_failing_handler_does_not_block_the_others(self):
+        failing = mock.Mock(side_effect=RuntimeError)
+        self.dispatcher.register('frames', failing)
+        with self.assertLogs('lib.dispatch', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            self.dispatcher.add('frames', 7)
+            self.dispatcher.add('posts', 1)
+        failing.assert_called_once_with([7])
+        self.assertEqual(self.calls, [[1]])
+
+    def test_first_registration_wins(self):
+        self.dispatcher.register('posts', mock.Mock())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dispatcher.add('posts', 1)
+        self.assertEqual(self.calls, [[1]])
+
+    def test_unknown_key_is_rejected(self):
+        with self.assertRaises(KeyError):
+            self.dispatcher.add('videos', 1)
+
+
+class CoalescingDispatcherAutocommitTests(SimpleTestCase):
+    databases = {'default'}
+
+    def test_handler_runs_right_away_outside_a_transaction(self):
+        dispatcher, calls = CoalescingDispatcher(), []
+        dispatcher.register('posts', calls.append)
+        dispatcher.add('posts', 1)
+        self.assertEqual(calls, [[1]])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class DiskCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.addCleanup(DISK_CACHES.pop, 'test', None)
+        self.disk_cache = DiskCache('test', self.root, max_bytes=1000, suffix='.bin')
+
+    def store(self, digest, size, age):
+        path = self.disk_cache.store(digest, b'x' * size)
+        # Older entries were used less recently.
+        mtime = 1_000_000 + 100 - age
+        os.utime(self.disk_cache.full_path(digest), (mtime, mtime))
+        return path
+
+    def stored(self):
+        return sorted(os.path.basename(path)[:-len('.bin')] for mtime, size, path in self.disk_cache.entries())
+
+    def test_running_total_starts_from_what_is_on_disk(self):
+        os.makedirs(os.path.join(self.root, 'aa'))
+        with open(os.path.join(self.root, 'aa', 'aa01.bin'), 'wb') as entry:
+            entry.write(b'x' * 100)
+
+        self.disk_cache.store('bb01', b'x' * 50)
+
+        self.assertEqual(self.disk_cache.counters()['bytes'], 150)
+
+    def test_least_recently_used_entries_are_evicted_to_90_percent(self):
+        for age, digest in zip([4, 3, 2, 1], ['aa01', 'aa02', 'aa03', 'aa04']):
+            self.store(digest, 250, age)
+        self.assertEqual(self.disk_cache.counters()['evictions'], 0)
+
+        # 1250 bytes: the two oldest go to get under 900, not just under 1000.
+        self.store('aa05', 250, 0)
+
+        self.assertEqual(self.stored(), ['aa03', 'aa04', 'aa05'])
+        counters = self.disk_cache.counters()
+        self.assertEqual(counters['bytes'], 750)
+        self.assertEqual((counters['evictions'], counters['evicted_bytes']), (2, 500))
+
+    def test_hit_protects_an_entry_from_eviction(self):
+        self.store('aa01', 400, 3)
+        self.store('aa02', 400, 2)
+
+        self.assertEqual(self.disk_cache.lookup('aa01'), os.path.join('aa', 'aa01.bin'))
+        self.store('aa03', 400, 1)
+
+        self.assertEqual(self.stored(), ['aa01', 'aa03'])
+
+    def test_hits_and_misses_are_counted(self):
+        self.store('aa01', 10, 0)
+
+        self.disk_cache.lookup('aa01')
+        self.assertIsNone(self.disk_cache.lookup('aa02'))
+
+        counters = self.disk_cache.counters()
+        self.assertEqual((counters['hits'], counters['misses']), (1, 1))
+
+    def test_nothing_is_evicted_while_another_worker_evicts(self):
+        cache.add(self.disk_cache.lock_key, True)
+        for age, digest in zip([4, 3, 2, 1], ['aa01', 'aa02', 'aa03', 'aa04']):
+            self.store(digest, 300, age)
+        self.assertEqual(len(self.stored()), 4)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+@mock.patch('app_modules.post.tasks.render_output_video.apply_async')
+@mock.patch('app_modules.post.rendering.video_render_key', return_value=('f' * 64, None, None))
+class SubmitRenderTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.post = mock.Mock(id=1)
+        self.frame = mock.Mock(id=2)
+
+    def submit(self):
+        return submit_render('post', self.post, self.frame)
+
+    def test_one_job_per_render(self, render_key, apply_async):
+        first, second = self.submit(), self.submit()
+
+        self.assertEqual(first['id'], second['id'])
+        self.assertEqual(second['status'], PENDING)
+        apply_async.assert_called_once_with((first['id'], 'post', 1, 2), priority=0)
+
+    def test_failed_job_is_queued_again_once(self, render_key, apply_async):
+        job = self.submit()
+        mark_render_finished(job['id'], error="ffmpeg exited with 1")
+
+        retried = self.submit()
+        self.submit()
+
+        self.assertEqual((retried['status'], retried['attempt']), (PENDING, 2))
+        self.assertEqual(apply_async.call_count, 2)
+
+    def test_done_job_is_answered_from_the_cache(self, render_key, apply_async):
+        job = self.submit()
+        mark_render_finished(job['id'], output_video='rendered/ff.mp4')
+
+        with mock.patch('app_modules.post.rendering.os.path.exists', return_value=True):
+            done = self.submit()
+
+        self.assertEqual((done['status'], done['output_video']), (DONE, 'rendered/ff.mp4'))
+        apply_async.assert_called_once()
+
+    def test_evicted_output_is_rendered_again(self, render_key, apply_async):
+        job = self.submit()
+        mark_render_finished(job['id'], output_video='rendered/ff.mp4')
+
+        with mock.patch('app_modules.post.rendering.os.path.exists', return_value=False):
+            again = self.submit()
+
+        self.assertEqual((again['status'], again['attempt']), (PENDING, 2))
+        self.assertEqual(get_render_job(job['id'])['status'], PENDING)
+        self.assertEqual(apply_async.call_count, 2)
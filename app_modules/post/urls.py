@@ -22,5 +22,7 @@ urlpatterns = [
     path('event-list', views.EventListApiView.as_view(), name='event-list'),
     path('category-list', views.CategoryListApiView.as_view(), name='category-list'),
     path('generate_output_video', views.generate_output_video, name='generate_output_video'),
+    path('render-jobs/<str:job_id>', views.RenderJobView.as_view(), name='render-job'),
+    path('fanout-status/<str:feed>/<int:object_id>', views.FanOutStatusView.as_view(), name='fanout-status'),
     path('delete-past-events', views.DeletePastEventsView.as_view(), name='delete_past_events'),
 ]
@@ -1,7 +1,11 @@
 from datetime import date, timedelta
 
-from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.conf import settings
 from django.db.models import Q
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
@@ -16,7 +20,13 @@ from account.models import CustomerGroup, CustomerFrame
 from app_modules.post import serializers
 from app_modules.post.models import Category, Event, Post, OtherPost, CustomerPostFrameMapping, \
     CustomerOtherPostFrameMapping, BusinessPost, BusinessPostFrameMapping, BusinessCategory
-from lib.helpers import generate_video_with_frame
+from app_modules.post.fanout import FEEDS, FRAME_ONBOARDING, get_fan_out_progress
+from app_modules.post.feed import feed_is_virtual, feed_queryset, feed_pk_filter
+from app_modules.post.framing import framed_image
+from app_modules.post.rendering import submit_render, wait_for_render
+from app_modules.post.tasks import delete_past_events
+from lib.media import requested_width
+from lib.serving import PRIVATE_CACHE_CONTROL, accel_file_response, sign_media_url
 from lib.viewsets import BaseModelViewSet
 from .filters import EventFilter, BusinessPostFilter, BusinessCategoryFilter
 
@@ -142,10 +152,36 @@ class PostViewset(BaseModelViewSet):
             else:
                 modified_data["message"] = "The Post has been created successfully"
 
+            modified_data["fanout_job"] = {
+                "id": f"post:{response.data['id']}",
+                "progress": get_fan_out_progress('post', response.data['id']),
+                "status_url": reverse('fanout-status', kwargs={'feed': 'post', 'object_id': response.data['id']}),
+            }
+
             response.data = modified_data
 
         return response
 
+    @action(detail=False, methods=['post'])
+    def publish(self, request):
+        """Publish one file to several groups with a single upload and WebP conversion."""
+        serializer = serializers.PostPublishSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        posts = serializer.save()
+
+        return Response({
+            "message": f"The Post has been published to {len(posts)} groups successfully",
+            "posts": self.get_serializer(posts, many=True).data,
+            "fanout_jobs": [
+                {
+                    "id": f"post:{post.id}",
+                    "progress": get_fan_out_progress('post', post.id),
+                    "status_url": reverse('fanout-status', kwargs={'feed': 'post', 'object_id': post.id}),
+                }
+                for post in posts
+            ],
+        }, status=status.HTTP_201_CREATED)
+
 
 class OtherPostViewset(BaseModelViewSet):
     queryset = OtherPost.objects.select_related('category', 'group').all().order_by('-id')
@@ -190,7 +226,64 @@ class BusinessPostViewset(viewsets.ModelViewSet):
         return queryset
     
 
-class CustomerPostFrameMappingViewSet(BaseModelViewSet):
+class FeedViewSetMixin:
+    """
+    Serves a mapping viewset from the virtual feed views when
+    ``POST_FEED_MODE = "virtual"``; virtual feeds are always scoped to the
+    requesting customer.
+    """
+    feed = None
+
+    def get_feed_queryset(self):
+        if feed_is_virtual():
+            return feed_queryset(self.feed).filter(customer=self.request.user)
+        return self.queryset
+
+    def get_object(self):
+        if not feed_is_virtual():
+            return super().get_object()
+
+        try:
+            lookup = feed_pk_filter(self.feed, self.kwargs[self.lookup_field])
+        except (TypeError, ValueError):
+            raise Http404
+
+        obj = get_object_or_404(self.filter_queryset(self.get_queryset()), **lookup)
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+
+class FramedImageMixin:
+    """
+    ``GET <mapping>/<pk>/framed?size=`` returns the post image of a feed row
+    with the customer's frame composited on it, as WebP. Composites are
+    cached on disk and handed to nginx with ``X-Accel-Redirect``.
+    """
+
+    @action(detail=True, methods=['get'])
+    def framed(self, request, pk=None):
+        mapping = self.get_object()
+        if mapping.customer_id != request.user.id and not request.user.is_staff:
+            raise Http404
+
+        post = getattr(mapping, FEEDS[self.feed].post_field)
+        if post.file_type != 'image' or not post.file or not mapping.customer_frame.frame_img:
+            return Response({"message": "Only image posts with a frame can be framed."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            path = framed_image(post.file, mapping.customer_frame.frame_img, requested_width(request))
+        except FileNotFoundError:
+            raise Http404
+
+        return accel_file_response(
+            settings.FRAMED_IMAGE_CACHE_ROOT, settings.FRAMED_IMAGE_CACHE_URL, path,
+            settings.FRAMED_IMAGE_ACCEL_REDIRECT, PRIVATE_CACHE_CONTROL, content_type='image/webp',
+        )
+
+
+class CustomerPostFrameMappingViewSet(FramedImageMixin, FeedViewSetMixin, BaseModelViewSet):
+    feed = 'post'
     queryset = CustomerPostFrameMapping.objects
     serializer_class = serializers.CustomerPostFrameMappingSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter]
@@ -207,14 +300,15 @@ class CustomerPostFrameMappingViewSet(BaseModelViewSet):
         customer = self.request.user
         event_id = self.request.query_params.get('event_id')
 
-        queryset = self.queryset.prefetch_related('customer', 'post', 'customer_frame')
+        queryset = self.get_feed_queryset().prefetch_related('customer', 'post', 'customer_frame')
         if event_id:
             queryset = queryset.filter(customer=customer, post__event=event_id)
 
         return queryset
 
 
-class CustomerOtherPostFrameMappingViewSet(BaseModelViewSet):
+class CustomerOtherPostFrameMappingViewSet(FramedImageMixin, FeedViewSetMixin, BaseModelViewSet):
+    feed = 'other_post'
     queryset = CustomerOtherPostFrameMapping.objects
     serializer_class = serializers.CustomerOtherPostFrameMappingSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter]
@@ -231,14 +325,15 @@ class CustomerOtherPostFrameMappingViewSet(BaseModelViewSet):
         customer = self.request.user
         categoery_id = self.request.query_params.get('categoery_id')
 
-        queryset = self.queryset.prefetch_related('customer', 'other_post', 'customer_frame')
+        queryset = self.get_feed_queryset().prefetch_related('customer', 'other_post', 'customer_frame')
         if categoery_id:
             queryset = queryset.filter(customer=customer, other_post__category=categoery_id)
 
         return queryset
 
 
-class BusinessPostFrameMappingViewSet(BaseModelViewSet):
+class BusinessPostFrameMappingViewSet(FramedImageMixin, FeedViewSetMixin, BaseModelViewSet):
+    feed = 'business_post'
     queryset = BusinessPostFrameMapping.objects
     serializer_class = serializers.BusinessPostFrameMappingSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter]
@@ -254,7 +349,7 @@ class BusinessPostFrameMappingViewSet(BaseModelViewSet):
         customer = self.request.user
         business_post_id = self.request.query_params.get('business_post_id')
 
-        queryset = self.queryset.prefetch_related('customer', 'post', 'customer_frame')
+        queryset = self.get_feed_queryset().prefetch_related('customer', 'post', 'customer_frame')
         if business_post_id:
             queryset = queryset.filter(customer=customer, post__business_category=business_post_id)
 
@@ -287,76 +382,111 @@ class CategoryListApiView(ListAPIView):
     queryset = Category.objects.select_related('sub_category').all().order_by('-id')
 
 
+def render_job_response(request, job):
+    body = {**job, 'status_url': request.build_absolute_uri(reverse('render-job', args=[job['id']]))}
+    if job['output_video']:
+        # Rendered videos are private media; the token lets players without the JWT open it.
+        body['output_video'] = sign_media_url(job['output_video'])
+    if job['status'] == 'done':
+        return Response({"message": "Video processing completed.", **body}, status=status.HTTP_200_OK)
+    if job['status'] == 'failed':
+        return Response({"message": "Video processing failed.", **body}, status=status.HTTP_200_OK)
+    response = Response({"message": "Video processing started.", **body}, status=status.HTTP_202_ACCEPTED)
+    response['Retry-After'] = settings.RENDER_JOB_RETRY_AFTER
+    return response
+
+
+def requested_wait(request):
+    try:
+        return float(request.query_params.get('wait', 0))
+    except ValueError:
+        raise ValidationError({'wait': "Seconds to wait for the render, e.g. ?wait=10."})
+
+
 @api_view(['POST'])
 def generate_output_video(request):
+    """
+    Queue the render of the post video with the customer's frame and return
+    the render job; ``?wait=<seconds>`` waits up to ``RENDER_JOB_MAX_WAIT``
+    for it to finish first.
+    """
     # Get the customer_post_id from the request data
     customer = request.user
     customer_post_id = request.data.get("customer_post_id")
     event_id = request.data.get("event_id")
     customer_other_post_id = request.data.get("customer_other_post_id")
     categoery_id = request.query_params.get('categoery_id')
+    data, feed = None, 'post'
 
     if customer_post_id:
         try:
-            data = CustomerPostFrameMapping.objects.get(id=customer_post_id)
-        except CustomerPostFrameMapping.DoesNotExist:
+            data = feed_queryset('post').get(**feed_pk_filter('post', customer_post_id))
+        except (ObjectDoesNotExist, ValueError):
             return Response({"message": "Invalid customer post mapping ID."}, status=400)
 
     if customer_other_post_id:
         try:
-            data = CustomerOtherPostFrameMapping.objects.get(id=customer_other_post_id)
-        except CustomerOtherPostFrameMapping.DoesNotExist:
+            data = feed_queryset('other_post').get(**feed_pk_filter('other_post', customer_other_post_id))
+            feed = 'other_post'
+        except (ObjectDoesNotExist, ValueError):
             return Response({"message": "Invalid customer other-post mapping ID."}, status=400)
 
     if event_id:
         try:
-            data = CustomerPostFrameMapping.objects.get(customer=customer, post__event=event_id)
-        except CustomerPostFrameMapping.DoesNotExist:
+            data = feed_queryset('post').get(customer=customer, post__event=event_id)
+            feed = 'post'
+        except ObjectDoesNotExist:
             return Response({"message": "Invalid event ID."}, status=400)
 
     if categoery_id:
         try:
             data = CustomerPostFrameMapping.objects.get(customer=customer, other_post__category=categoery_id)
+            feed = 'post'
         except CustomerPostFrameMapping.DoesNotExist:
             return Response({"message": "Invalid category ID."}, status=400, request=request)
 
-    # Extract the related CustomerFrame and Post objects from the mapping object
-    customer_frame = data.customer_frame
-    post = data.post
-
-    # Check if the output video URL is already cached for this user and request data
-    cache_key = f"user_{customer.id}_post_{customer_post_id}_event_{event_id}_category_{categoery_id}"
-    output_video_url = cache.get(cache_key)
+    if data is None:
+        return Response(
+            {"message": "customer_post_id, customer_other_post_id, event_id or categoery_id is required."},
+            status=400
+        )
 
-    if not output_video_url:
-        # If the output video URL is not cached, generate the video with the frame
-        output_video_url = generate_video_with_frame(customer_frame, post)
+    # Identical renders share one job, whoever asked for them first.
+    job = submit_render(feed, getattr(data, FEEDS[feed].post_field), data.customer_frame)
+    wait = requested_wait(request)
+    if wait:
+        job = wait_for_render(job['id'], wait) or job
+    return render_job_response(request, job)
 
-        # Cache the output video URL for a certain duration (e.g., 1 day)
-        cache.set(cache_key, output_video_url, timeout=86400)
 
-    # Generate the video with the frame overlay using the separate function
-    output_video_url = generate_video_with_frame(customer_frame, post)
+class RenderJobView(APIView):
+    """Status of a render job; poll it after ``Retry-After``, or long-poll with ``?wait=<seconds>``."""
 
-    return Response({"message": "Video processing completed.", "output_video": output_video_url}, status=200)
+    def get(self, request, job_id):
+        job = wait_for_render(job_id, requested_wait(request))
+        if job is None:
+            return Response({"message": "No render job found."}, status=status.HTTP_404_NOT_FOUND)
+        return render_job_response(request, job)
 
 
-class DeletePastEventsView(APIView):
-    def delete(self, request):
-        today = date.today()
-        events_to_delete = Event.objects.filter(event_date__lt=today)
+class FanOutStatusView(APIView):
+    def get(self, request, feed, object_id):
+        if feed not in FEEDS and feed != FRAME_ONBOARDING:
+            return Response({"message": "Invalid feed."}, status=status.HTTP_400_BAD_REQUEST)
 
-        for event in events_to_delete:
-            posts_to_delete = Post.objects.filter(event=event)
+        progress = get_fan_out_progress(feed, object_id)
+        if progress is None:
+            return Response({"message": "No fan-out job found."}, status=status.HTTP_404_NOT_FOUND)
 
-            for post in posts_to_delete:
-                mappings_to_delete = CustomerPostFrameMapping.objects.filter(post=post)
-                mappings_to_delete.delete()
+        return Response(progress)
 
-            posts_to_delete.delete()
 
-        events_to_delete.delete()
+class DeletePastEventsView(APIView):
+    def delete(self, request):
+        # Dropping mapping partitions is DDL on the feed table; it runs on the
+        # maintenance queue, never in the request.
+        delete_past_events.delay(date.today().isoformat())
 
         return Response(
-            {'message': 'Successfully deleted past events.'},
+            {'message': 'Deletion of past events started.'}, status=status.HTTP_202_ACCEPTED
         )
@@ -0,0 +1,296 @@
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from app_modules.master.models import MediaFile
+from app_modules.master.tasks import delete_stored_file
+from lib.imaging import convert
+from lib.media import (
+    METADATA_FIELDS, encoding_profile, is_image, local_path, needs_webp, probe_media, registered_media_fields,
+    store_converted,
+)
+from lib.uploads import content_hash
+
+APPS = ('account', 'post', 'master')
+
+
+def limit_memory(limit):
+    if limit:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def process_file(job):
+    """
+    Pool worker: fingerprint, convert, resize and probe one stored file.
+    Touches storage only, never the database; the parent applies the result.
+    """
+    name, profile, to_webp, widths, overlays, fingerprint = job
+    result = {
+        'name': name, 'new_name': name, 'variants': {}, 'overlays': {}, 'content_hash': None,
+        'bytes_before': 0, 'bytes_after': 0, 'metadata': {}, 'error': None,
+    }
+    try:
+        result['bytes_before'] = result['bytes_after'] = default_storage.size(name)
+        if fingerprint:
+            with default_storage.open(name) as source:
+                result['content_hash'] = content_hash(source)
+        if to_webp or widths or overlays:
+            with local_path(default_storage, name) as path, \
+                    tempfile.TemporaryDirectory(prefix='backfill_') as output_dir:
+                converted = convert(
+                    path, output_dir, widths, to_webp, settings.MEDIA_MAX_DIMENSION, settings.MEDIA_MAX_PIXELS,
+                    profile, overlays,
+                )
+                if not to_webp:
+                    converted['webp'] = None
+                result['new_name'], result['variants'], result['overlays'] = store_converted(
+                    default_storage, name, converted
+                )
+                if converted['webp'] is not None:
+                    result['bytes_after'] = os.path.getsize(converted['webp'])
+        result['metadata'] = probe_media(default_storage, result['new_name'])
+    except Exception as exc:
+        result['error'] = str(exc) or type(exc).__name__
+    return result
+
+
+class Command(BaseCommand):
+    help = (
+        "Bring every media field (MediaFieldsMixin.media_fields) of the account, post and master apps up to "
+        "date with the media pipeline: convert images to WebP, store their size variants and frame overlays, fingerprint files by "
+        "content hash, pointing rows that hold duplicate bytes at one stored copy, and record the dimensions, "
+        "duration and codec of files stored without them. Also retries failed and stuck MediaFiles. "
+        "Files are processed by a pool of memory-capped worker processes, the database is updated in "
+        "batches, and finished files are recorded in a checkpoint file so an interrupted run resumes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+        parser.add_argument('--batch-size', type=int, default=200, help="Files applied to the database per transaction")
+        parser.add_argument('--checkpoint', default=os.path.join(settings.BASE_DIR, 'logs', 'backfill_media.json'),
+                            help="File recording the names already processed")
+        parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and start over")
+        parser.add_argument('--stuck-after', type=int, default=60,
+                            help="Minutes after which a MediaFile still 'processing' counts as stuck")
+        parser.add_argument('--no-convert', dest='convert', action='store_false', help="Do not convert to WebP")
+        parser.add_argument('--no-variants', dest='variants', action='store_false', help="Do not store size variants")
+        parser.add_argument('--no-fingerprint', dest='fingerprint', action='store_false',
+                            help="Do not hash files or merge duplicates")
+
+    def handle(self, *args, **options):
+        self.options = options
+        # Only fields of MediaFieldsMixin models: rows_holding() and the
+        # delayed delete of originals know no other rows, so a file a plain
+        # FileField also holds must never be converted or merged away.
+        self.fields = [
+            (model, field_name) for model, field_name in registered_media_fields() if model._meta.app_label in APPS
+        ]
+        self.done = set() if options['restart'] else self.read_checkpoint()
+        jobs = self.jobs()
+        self.stdout.write(
+            f"{len(jobs)} files to process with {options['workers']} workers ({len(self.done)} done before)"
+        )
+        if not jobs:
+            return
+
+        self.hashes = dict(MediaFile.objects.exclude(content_hash=None).values_list('content_hash', 'name'))
+        # Forked workers must not share the parent's database connections.
+        connections.close_all()
+        self.stats = Counter()
+        self.started = time.monotonic()
+        pool = multiprocessing.get_context('fork').Pool(
+            options['workers'], initializer=limit_memory, initargs=(settings.MEDIA_DECODE_MEMORY_LIMIT,)
+        )
+        batch = []
+        with pool:
+            for result in pool.imap_unordered(process_file, jobs, chunksize=4):
+                batch.append(result)
+                if len(batch) >= options['batch_size']:
+                    self.apply(batch)
+                    batch = []
+                    self.progress(len(jobs))
+        self.apply(batch)
+        self.progress(len(jobs))
+
+    def jobs(self):
+        """One ``process_file`` job per distinct stored name that still needs work."""
+        options = self.options
+        stuck_before = timezone.now() - timedelta(minutes=options['stuck_after'])
+        media_files = {media_file.name: media_file for media_file in MediaFile.objects.all()}
+        self.references = Counter()
+        profiles, overlay_names = {}, set()
+        for model, field_name in self.fields:
+            profile = model.media_profiles.get(field_name)
+            overlay_field = field_name in model.overlay_fields
+            names = model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+            for name in names.values_list(field_name, flat=True).iterator():
+                self.references[name] += 1
+                profiles.setdefault(name, profile)
+                if overlay_field:
+                    overlay_names.add(name)
+
+        jobs, retried = [], []
+        for name in sorted(self.references):
+            if name in self.done:
+                continue
+            media_file = media_files.get(name)
+            image = is_image(name)
+            to_webp = options['convert'] and image and needs_webp(name)
+            widths = settings.MEDIA_VARIANT_WIDTHS if options['variants'] and image else []
+            overlays = settings.VIDEO_CANONICAL_RESOLUTIONS if image and name in overlay_names else []
+            fingerprint = options['fingerprint']
+
+            if media_file is not None:
+                if media_file.status == MediaFile.PENDING:
+                    # Queued for the media worker already.
+                    continue
+                if media_file.status == MediaFile.PROCESSING and media_file.modified >= stuck_before:
+                    continue
+                if media_file.status == MediaFile.DONE:
+                    widths = [] if media_file.variants else widths
+                    overlays = [] if media_file.overlays else overlays
+                    fingerprint = fingerprint and not media_file.content_hash
+                    if not (to_webp or widths or overlays or fingerprint or media_file.size is None):
+                        continue
+                else:
+                    retried.append(name)
+            # Every file without a MediaFile still needs its metadata recorded.
+            jobs.append((name, encoding_profile(profiles[name]), to_webp, widths, overlays, fingerprint))
+
+        # Keep the media worker off the failed and stuck files handed to the pool.
+        MediaFile.objects.filter(name__in=retried).update(status=MediaFile.PROCESSING, modified=timezone.now())
+        return jobs
+
+    def apply(self, results):
+        """Point the rows at the converted or canonical files and record them as MediaFiles, in one transaction."""
+        failed = [result for result in results if result['error']]
+        results = [result for result in results if not result['error']]
+        existing = {
+            media_file.name: media_file
+            for media_file in MediaFile.objects.filter(name__in=[result['name'] for result in results])
+        }
+        now = timezone.now()
+        renames, created, updated, removed, merged, stale, originals = {}, [], [], [], Counter(), [], {}
+        for result in results:
+            name, new_name, content_hash = result['name'], result['new_name'], result['content_hash']
+            media_file = existing.get(name)
+            canonical = self.hashes.get(content_hash) if content_hash else None
+            if canonical is not None and canonical != name:
+                # The same bytes are already stored under another name.
+                renames[name] = canonical
+                merged[canonical] += self.references[name]
+                if new_name != name:
+                    stale.append(new_name)
+                stale.extend(result['variants'].values())
+                stale.extend(result['overlays'].values())
+                originals[name] = canonical
+                if media_file is not None:
+                    removed.append(media_file.pk)
+                self.stats['bytes_saved'] += result['bytes_before']
+                self.stats['merged'] += 1
+                continue
+
+            if new_name != name:
+                renames[name] = new_name
+                originals[name] = new_name
+                self.stats['bytes_saved'] += result['bytes_before'] - result['bytes_after']
+                self.stats['converted'] += 1
+            if content_hash:
+                self.hashes[content_hash] = new_name
+
+            if media_file is None:
+                created.append(MediaFile(
+                    name=new_name, status=MediaFile.DONE, variants=result['variants'], overlays=result['overlays'],
+                    content_hash=content_hash,
+                    references=self.references[name] if content_hash else 0, **result['metadata'],
+                ))
+                continue
+            if result['variants']:
+                stale.extend(media_file.variants.values())
+                media_file.variants = result['variants']
+            if result['overlays']:
+                stale.extend(media_file.overlays.values())
+                media_file.overlays = result['overlays']
+            media_file.name, media_file.status, media_file.error, media_file.modified = (
+                new_name, MediaFile.DONE, None, now
+            )
+            for field_name, value in result['metadata'].items():
+                setattr(media_file, field_name, value)
+            if content_hash and not media_file.content_hash:
+                media_file.content_hash = content_hash
+                media_file.references = self.references[name]
+            updated.append(media_file)
+
+        with transaction.atomic():
+            for result in failed:
+                self.stderr.write(f"{result['name']}: {result['error']}")
+                MediaFile.objects.filter(name=result['name']).update(status=MediaFile.FAILED, error=result['error'])
+            if renames:
+                for model, field_name in self.fields:
+                    model.objects.filter(**{f'{field_name}__in': list(renames)}).update(**{field_name: Case(
+                        *[When(**{field_name: old}, then=Value(new)) for old, new in renames.items()],
+                        default=F(field_name),
+                    )})
+            MediaFile.objects.filter(pk__in=removed).delete()
+            MediaFile.objects.bulk_update(
+                updated,
+                [
+                    'name', 'status', 'error', 'variants', 'overlays', 'content_hash', 'references', 'modified',
+                    *METADATA_FIELDS,
+                ],
+            )
+            MediaFile.objects.bulk_create(created)
+            for canonical, count in merged.items():
+                MediaFile.objects.filter(name=canonical, content_hash__isnull=False).update(
+                    references=F('references') + count
+                )
+            transaction.on_commit(lambda: self.clean_up(stale, originals))
+
+        self.stats['processed'] += len(results)
+        self.stats['failed'] += len(failed)
+        # Failed files are left out so the next run retries them.
+        self.done.update(result['name'] for result in results)
+        self.write_checkpoint()
+
+    def clean_up(self, stale, originals):
+        for name in stale:
+            default_storage.delete(name)
+        # Clients may still hold the original URLs for a moment after the swap.
+        for name, replacement in originals.items():
+            delete_stored_file.apply_async((name, replacement), countdown=settings.MEDIA_ORIGINAL_RETENTION_SECONDS)
+
+    def read_checkpoint(self):
+        try:
+            with open(self.options['checkpoint']) as checkpoint:
+                return set(json.load(checkpoint)['done'])
+        except FileNotFoundError:
+            return set()
+
+    def write_checkpoint(self):
+        path = self.options['checkpoint']
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(f"{path}.tmp", 'w') as checkpoint:
+            json.dump({'updated': timezone.now().isoformat(), 'done': sorted(self.done)}, checkpoint)
+        os.replace(f"{path}.tmp", path)
+
+    def progress(self, total):
+        elapsed = time.monotonic() - self.started
+        handled = self.stats['processed'] + self.stats['failed']
+        self.stdout.write(
+            f"{handled}/{total} files ({self.stats['failed']} failed, {self.stats['converted']} converted, "
+            f"{self.stats['merged']} duplicates merged) in {elapsed:.0f}s, "
+            f"{handled / elapsed if elapsed else 0:.1f} files/s, "
+            f"{self.stats['bytes_saved'] / 1024 ** 2:.1f}MB saved"
+        )
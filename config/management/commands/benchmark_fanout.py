@@ -0,0 +1,177 @@
+import json
+import platform
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from account.models import CustomerFrame
+from account.tasks import (
+    mapping_customer_frame_with_post, mapping_customer_frame_with_other_posts,
+    map_customer_frame_with_business_posts, onboard_customer_frame, remap_customer_frame_feeds,
+)
+from app_modules.post.benchmarks import PeakRss, build_synthetic_dataset
+from app_modules.post.fanout import FEEDS
+from app_modules.post.tasks import (
+    map_post_with_customer_frames, map_other_post_with_customer_frames, map_business_post_with_customer_frames,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Build a synthetic dataset and time every fan-out, onboarding and remapping task for each "
+        "fan-out strategy. Nothing is kept unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=1000)
+        parser.add_argument('--frames-per-customer', type=int, default=1)
+        parser.add_argument('--groups', type=int, default=2)
+        parser.add_argument('--events', type=int, default=5)
+        parser.add_argument('--posts', type=int, default=5, help="Posts of each kind per group")
+        parser.add_argument('--sample-frames', type=int, default=50,
+                            help="Frames onboarded and remapped in the frame-side tasks")
+        parser.add_argument('--strategies', nargs='+', default=['orm', 'sql'], choices=['orm', 'sql'])
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument('--baseline', help="Compare against the results of an earlier --output file")
+        parser.add_argument('--keep', action='store_true', help="Keep the synthetic dataset")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            started = time.monotonic()
+            dataset = build_synthetic_dataset(
+                customers=options['customers'],
+                frames_per_customer=options['frames_per_customer'],
+                groups=options['groups'],
+                events=options['events'],
+                posts=options['posts'],
+            )
+            self.stdout.write(
+                f"Built {len(dataset.frames)} frames in {len(dataset.groups)} groups "
+                f"in {time.monotonic() - started:.1f}s"
+            )
+
+            results = []
+            for strategy in options['strategies']:
+                with override_settings(POST_FANOUT_STRATEGY=strategy, POST_FEED_MODE='materialized'):
+                    for task, setup, timed in self.tasks(dataset, options['sample_frames']):
+                        results.append({'strategy': strategy, 'task': task, **self.measure(setup, timed)})
+                        self.report(results[-1])
+
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+        report = {
+            'created': timezone.now().isoformat(),
+            'host': platform.node(),
+            'params': {
+                key: options[key] for key in
+                ('customers', 'frames_per_customer', 'groups', 'events', 'posts', 'sample_frames')
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        if options['baseline']:
+            self.compare(results, options['baseline'])
+
+    def tasks(self, dataset, sample_frames):
+        """Yield ``(name, setup, timed)``; ``setup`` runs untimed inside the same savepoint."""
+        frames = dataset.frames[:sample_frames]
+        group_ids = [group.id for group in dataset.groups]
+
+        def fan_out(task, posts):
+            def run():
+                for post in posts:
+                    task(post.id)
+            return run
+
+        def onboard():
+            for frame in frames:
+                self.onboard(frame.id)
+
+        def move_frames():
+            onboard()
+            for frame in frames:
+                next_group_id = group_ids[(group_ids.index(frame.group_id) + 1) % len(group_ids)]
+                CustomerFrame.objects.filter(id=frame.id).update(group_id=next_group_id)
+
+        def remap():
+            rows = 0
+            for frame in frames:
+                report = remap_customer_frame_feeds(frame.id, frame.group_id)
+                rows += sum(
+                    counts['updated'] + counts['deleted'] + counts['created'] for counts in report.values()
+                )
+            return rows
+
+        yield 'post_fanout', None, fan_out(map_post_with_customer_frames, dataset.posts)
+        yield 'other_post_fanout', None, fan_out(map_other_post_with_customer_frames, dataset.other_posts)
+        yield 'business_post_fanout', None, fan_out(map_business_post_with_customer_frames, dataset.business_posts)
+        yield 'frame_onboarding', None, onboard
+        if len(group_ids) > 1:
+            yield 'frame_remap', move_frames, remap
+
+    def onboard(self, frame_id):
+        if settings.POST_FANOUT_STRATEGY == 'sql':
+            onboard_customer_frame(frame_id)
+        else:
+            mapping_customer_frame_with_post(frame_id)
+            mapping_customer_frame_with_other_posts(frame_id)
+            map_customer_frame_with_business_posts(frame_id)
+
+    def measure(self, setup, timed):
+        savepoint = transaction.savepoint()
+        if setup:
+            setup()
+        rows_before = self.count_rows()
+
+        with CaptureQueriesContext(connection) as queries, PeakRss() as rss:
+            started = time.monotonic()
+            rows = timed()
+            seconds = time.monotonic() - started
+
+        if rows is None:
+            rows = self.count_rows() - rows_before
+        transaction.savepoint_rollback(savepoint)
+        return {
+            'rows': rows,
+            'seconds': round(seconds, 4),
+            'rows_per_sec': round(rows / seconds, 1) if seconds else None,
+            'queries': len(queries),
+            'peak_rss_mb': round(rss.peak / 1024 / 1024, 1),
+        }
+
+    def count_rows(self):
+        return sum(spec.mapping.objects.count() for spec in FEEDS.values())
+
+    def report(self, result):
+        self.stdout.write(
+            f"{result['strategy']:>4} {result['task']:<22} rows={result['rows']:<9} "
+            f"{result['seconds']:>8.3f}s {result['rows_per_sec'] or 0:>11.1f} rows/s "
+            f"queries={result['queries']:<7} peak_rss={result['peak_rss_mb']}MB"
+        )
+
+    def compare(self, results, baseline_path):
+        with open(baseline_path) as baseline_file:
+            baseline = {
+                (result['strategy'], result['task']): result
+                for result in json.load(baseline_file)['results']
+            }
+
+        self.stdout.write(f"\nCompared with {baseline_path}:")
+        for result in results:
+            previous = baseline.get((result['strategy'], result['task']))
+            if not previous or not previous['seconds']:
+                continue
+            change = (result['seconds'] - previous['seconds']) / previous['seconds'] * 100
+            style = self.style.ERROR if change > 10 else self.style.SUCCESS
+            self.stdout.write(style(
+                f"{result['strategy']:>4} {result['task']:<22} {previous['seconds']:.3f}s -> "
+                f"{result['seconds']:.3f}s ({change:+.1f}%), queries {previous['queries']} -> {result['queries']}"
+            ))
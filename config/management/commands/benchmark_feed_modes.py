@@ -0,0 +1,67 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app_modules.post.benchmarks import build_synthetic_dataset
+from app_modules.post.fanout import fan_out_sql
+from app_modules.post.feed import create_feed_views
+from app_modules.post.models import CustomerPostFrameMapping, CustomerPostFeed
+
+
+class Command(BaseCommand):
+    help = "Compare publish and read cost of the materialized and virtual customer feeds"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frames', type=int, nargs='+', default=[10000, 100000],
+                            help="Group sizes (customer frames) to benchmark")
+        parser.add_argument('--posts', type=int, default=20, help="Posts published to the group")
+        parser.add_argument('--samples', type=int, default=50, help="Customers whose feed is read")
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'frames':>8} {'mode':>13} {'publish ms/post':>16} {'read ms':>9} {'stored rows':>12}"
+        )
+        for frames in options['frames']:
+            with transaction.atomic():
+                for row in self.run(frames, options['posts'], options['samples']):
+                    self.stdout.write(
+                        f"{frames:>8} {row['mode']:>13} {row['publish_ms']:>16.2f} "
+                        f"{row['read_ms']:>9.2f} {row['stored_rows']:>12}"
+                    )
+                # Nothing the benchmark creates is kept.
+                transaction.set_rollback(True)
+
+    def run(self, frames, posts, samples):
+        create_feed_views()
+
+        dataset = build_synthetic_dataset(customers=frames, posts=posts)
+        event = dataset.events[0]
+        post_ids = [post.id for post in dataset.posts]
+        sample_ids = [customer.id for customer in dataset.customers[::max(1, frames // samples)][:samples]]
+
+        # Virtual first, while the mapping table holds no rows for the group.
+        yield {
+            'mode': 'virtual',
+            'publish_ms': 0.0,
+            'read_ms': self.read_feed(CustomerPostFeed.objects, sample_ids, event),
+            'stored_rows': CustomerPostFrameMapping.objects.filter(post_id__in=post_ids).count(),
+        }
+
+        started = time.monotonic()
+        for post_id in post_ids:
+            fan_out_sql('post', [post_id])
+        publish_ms = (time.monotonic() - started) * 1000 / posts
+
+        yield {
+            'mode': 'materialized',
+            'publish_ms': publish_ms,
+            'read_ms': self.read_feed(CustomerPostFrameMapping.objects, sample_ids, event),
+            'stored_rows': CustomerPostFrameMapping.objects.filter(post_id__in=post_ids).count(),
+        }
+
+    def read_feed(self, manager, customer_ids, event):
+        started = time.monotonic()
+        for customer_id in customer_ids:
+            list(manager.filter(customer_id=customer_id, post__event=event).select_related('post', 'customer_frame'))
+        return (time.monotonic() - started) * 1000 / len(customer_ids)
@@ -0,0 +1,102 @@
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+
+import ffmpeg
+from PIL import Image
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from lib.helpers import frame_overlay_filter
+from lib.imaging import encode_overlay, fit_size
+
+
+class Command(BaseCommand):
+    help = (
+        "Render a video with a frame image drawn over it, once scaling the frame inside the ffmpeg filter graph "
+        "(as before frames were stored pre-scaled) and once overlaying the pre-scaled overlay asset, and report "
+        "the per-render time of both."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('video', help="Sample video, e.g. a copy of a file under media/post")
+        parser.add_argument('frame', help="Sample frame image, e.g. a copy of a file under media/customer_frame")
+        parser.add_argument('--runs', type=int, default=5, help="Renders per mode")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        for path in (options['video'], options['frame']):
+            if not os.path.isfile(path):
+                raise CommandError(f"No such file: {path}")
+
+        # Probing is fine here: this is measuring renders, not serving them.
+        stream = next(
+            stream for stream in ffmpeg.probe(options['video'])['streams'] if stream.get('codec_type') == 'video'
+        )
+        video_size = (int(stream['width']), int(stream['height']))
+        with Image.open(options['frame']) as frame:
+            frame.load()
+
+        with tempfile.TemporaryDirectory() as directory:
+            started = time.perf_counter()
+            overlay_path = os.path.join(directory, 'overlay.png')
+            with open(overlay_path, 'wb') as overlay:
+                overlay.write(encode_overlay(frame, video_size))
+            overlay_ms = (time.perf_counter() - started) * 1000
+
+            modes = {
+                'scaled_per_render': (options['frame'], frame.size, False),
+                'prescaled': (overlay_path, fit_size(frame.size, video_size), True),
+            }
+            results = [
+                self.measure(mode, options['video'], video_size, *arguments, options['runs'], directory)
+                for mode, arguments in modes.items()
+            ]
+
+        self.stdout.write(
+            f"{options['video']} ({video_size[0]}x{video_size[1]}) with {options['frame']} "
+            f"({frame.size[0]}x{frame.size[1]}), {options['runs']} renders per mode; "
+            f"building the overlay took {overlay_ms:.1f}ms once"
+        )
+        for result in results:
+            self.stdout.write(
+                f"{result['mode']:<18} mean={result['mean_ms']:>9.1f}ms p95={result['p95_ms']:>9.1f}ms "
+                f"min={result['min_ms']:>9.1f}ms"
+            )
+        before, after = results
+        self.stdout.write(f"Pre-scaled renders take {after['mean_ms'] / before['mean_ms']:.2%} of the time")
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({
+                    'created': timezone.now().isoformat(),
+                    'host': platform.node(),
+                    'video': options['video'],
+                    'video_size': video_size,
+                    'frame': options['frame'],
+                    'frame_size': frame.size,
+                    'runs': options['runs'],
+                    'overlay_ms': round(overlay_ms, 1),
+                    'results': results,
+                }, output, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def measure(self, mode, video_path, video_size, frame_path, frame_size, prescaled, runs, directory):
+        output_path = os.path.join(directory, f'{mode}.mp4')
+        seconds = []
+        for run in range(runs):
+            started = time.perf_counter()
+            ffmpeg.input(video_path).output(
+                output_path, vf=frame_overlay_filter(frame_path, video_size, frame_size, prescaled),
+                **{'c:a': 'copy'}
+            ).overwrite_output().run(quiet=True)
+            seconds.append(time.perf_counter() - started)
+        return {
+            'mode': mode,
+            'mean_ms': round(statistics.mean(seconds) * 1000, 1),
+            'p95_ms': round(sorted(seconds)[int(len(seconds) * 0.95)] * 1000, 1),
+            'min_ms': round(min(seconds) * 1000, 1),
+        }
@@ -0,0 +1,116 @@
+import json
+import math
+import os
+import platform
+import statistics
+import time
+from io import BytesIO
+
+from PIL import Image, ImageChops, ImageStat
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from lib.imaging import encode_webp, open_bounded
+from lib.media import IMAGE_EXTENSIONS
+
+
+def psnr(original, encoded):
+    """Peak signal-to-noise ratio in dB over all bands; ``inf`` for identical images."""
+    difference = ImageChops.difference(original, encoded)
+    mse = statistics.mean(rms ** 2 for rms in ImageStat.Stat(difference).rms)
+    return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+class Command(BaseCommand):
+    help = (
+        "Encode every image of a sample directory with each MEDIA_ENCODING_PROFILES profile and report "
+        "encode time, output bytes and PSNR against the decoded source, to choose profiles from measurements."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="Directory of sample images, e.g. a copy of media/customer_frame")
+        parser.add_argument('--profiles', nargs='+', help="Profiles to compare (default: all)")
+        parser.add_argument('--width', type=int, help="Also scale to this width first, like a size variant")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        profiles = options['profiles'] or list(settings.MEDIA_ENCODING_PROFILES)
+        unknown = set(profiles) - set(settings.MEDIA_ENCODING_PROFILES)
+        if unknown:
+            raise CommandError(f"Unknown profiles: {', '.join(sorted(unknown))}")
+
+        paths = sorted(
+            os.path.join(root, name)
+            for root, dirs, names in os.walk(options['source'])
+            for name in names if name.rsplit('.', 1)[-1].lower() in IMAGE_EXTENSIONS
+        )
+        if not paths:
+            raise CommandError(f"No images under {options['source']}")
+
+        measurements = {profile: [] for profile in profiles}
+        for path in paths:
+            with open(path, 'rb') as source:
+                image, size = open_bounded(source, (settings.MEDIA_MAX_DIMENSION,) * 2, settings.MEDIA_MAX_PIXELS)
+                image.load()
+            if options['width'] and options['width'] < image.width:
+                image = image.resize(
+                    (options['width'], max(1, round(image.height * options['width'] / image.width))), Image.LANCZOS
+                )
+            # Compare in the mode the encoder writes: RGBA when there is alpha, RGB otherwise.
+            image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+            for profile in profiles:
+                started = time.perf_counter()
+                data = encode_webp(image, settings.MEDIA_ENCODING_PROFILES[profile])
+                seconds = time.perf_counter() - started
+                encoded = Image.open(BytesIO(data)).convert(image.mode)
+                measurements[profile].append({
+                    'source_bytes': os.path.getsize(path),
+                    'bytes': len(data),
+                    'seconds': seconds,
+                    'psnr': psnr(image, encoded),
+                })
+
+        results = [self.summarize(profile, rows) for profile, rows in measurements.items()]
+        self.stdout.write(f"{len(paths)} images from {options['source']}")
+        for result in results:
+            self.report(result)
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({
+                    'created': timezone.now().isoformat(),
+                    'host': platform.node(),
+                    'source': options['source'],
+                    'images': len(paths),
+                    'width': options['width'],
+                    'profiles': {profile: settings.MEDIA_ENCODING_PROFILES[profile] for profile in profiles},
+                    'results': results,
+                }, output, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def summarize(self, profile, rows):
+        finite = [row['psnr'] for row in rows if math.isfinite(row['psnr'])]
+        source_bytes = sum(row['source_bytes'] for row in rows)
+        output_bytes = sum(row['bytes'] for row in rows)
+        return {
+            'profile': profile,
+            'source_bytes': source_bytes,
+            'bytes': output_bytes,
+            'ratio': round(output_bytes / source_bytes, 3) if source_bytes else None,
+            'mean_ms': round(statistics.mean(row['seconds'] for row in rows) * 1000, 1),
+            'p95_ms': round(sorted(row['seconds'] for row in rows)[int(len(rows) * 0.95)] * 1000, 1),
+            # Lossless encodes are identical to the source; their PSNR is infinite and left out.
+            'lossless_images': len(rows) - len(finite),
+            'mean_psnr': round(statistics.mean(finite), 2) if finite else None,
+            'min_psnr': round(min(finite), 2) if finite else None,
+        }
+
+    def report(self, result):
+        mean_psnr = f"{result['mean_psnr']:.2f}dB" if result['mean_psnr'] is not None else "lossless"
+        self.stdout.write(
+            f"{result['profile']:<14} bytes={result['bytes']:<11} ratio={result['ratio']:<6} "
+            f"mean={result['mean_ms']:>8.1f}ms p95={result['p95_ms']:>8.1f}ms "
+            f"psnr={mean_psnr} (min {result['min_psnr']}, {result['lossless_images']} exact)"
+        )
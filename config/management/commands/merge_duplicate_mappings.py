@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from app_modules.post.fanout import FEEDS
+
+KEEP_DOWNLOADED_SQL = """
+    UPDATE {mapping} m
+    SET is_downloaded = true
+    FROM (
+        SELECT min(id) AS keep_id
+        FROM {mapping}
+        WHERE customer_frame_id BETWEEN %(first)s AND %(last)s
+        GROUP BY customer_frame_id, {post_column}
+        HAVING count(*) > 1 AND bool_or(is_downloaded)
+    ) duplicates
+    WHERE m.id = duplicates.keep_id AND NOT m.is_downloaded
+"""
+
+DELETE_DUPLICATES_SQL = """
+    DELETE FROM {mapping} m
+    USING {mapping} keep
+    WHERE m.customer_frame_id BETWEEN %(first)s AND %(last)s
+      AND keep.customer_frame_id = m.customer_frame_id
+      AND keep.{post_column} = m.{post_column}
+      AND keep.id < m.id
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Merge duplicate (customer_frame, post) rows of the mapping tables in batches. "
+        "Run it before migrating the unique constraints onto existing data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help="Customer frame ids handled per transaction")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        for feed, spec in FEEDS.items():
+            table = spec.mapping._meta.db_table
+            bounds = spec.mapping.objects.order_by().values_list('customer_frame_id', flat=True)
+            first_id = bounds.filter(customer_frame_id__isnull=False).order_by('customer_frame_id').first()
+            last_id = bounds.filter(customer_frame_id__isnull=False).order_by('-customer_frame_id').first()
+            if first_id is None:
+                self.stdout.write(f"{table}: empty")
+                continue
+
+            merged = 0
+            for batch_first in range(first_id, last_id + 1, batch_size):
+                params = {'first': batch_first, 'last': batch_first + batch_size - 1}
+                with transaction.atomic(), connection.cursor() as cursor:
+                    cursor.execute(KEEP_DOWNLOADED_SQL.format(mapping=table, post_column=spec.post_column), params)
+                    cursor.execute(DELETE_DUPLICATES_SQL.format(mapping=table, post_column=spec.post_column), params)
+                    merged += cursor.rowcount
+
+            self.stdout.write(self.style.SUCCESS(f"{table}: merged {merged} duplicate rows"))
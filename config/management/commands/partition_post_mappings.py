@@ -0,0 +1,252 @@
+import re
+import time
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max, Min
+
+from app_modules.post.feed import create_feed_views
+from app_modules.post.models import CustomerPostFrameMapping, Event, Post, UNDATED_EVENT_DATE
+from app_modules.post.partitions import (
+    DEFAULT_PARTITION, MAPPING_TABLE, UNDATED_PARTITION, add_months, create_partitions, ensure_undated_partition,
+    is_partitioned, monthly_partitions, partition_name, undated_partition_name,
+)
+
+NEW_TABLE = f"{MAPPING_TABLE}_partitioned"
+LEGACY_TABLE = f"{MAPPING_TABLE}_legacy"
+CHANGES_TABLE = f"{MAPPING_TABLE}_changes"
+NEW_SEQUENCE = f"{NEW_TABLE}_id_seq"
+
+CONSTRAINTS_SQL = """
+    SELECT conname, contype, pg_get_constraintdef(oid)
+    FROM pg_constraint
+    WHERE conrelid = to_regclass(%s) AND contype IN ('p', 'u', 'f')
+    ORDER BY conname
+"""
+
+INDEXES_SQL = """
+    SELECT c.relname, pg_get_indexdef(i.indexrelid)
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE i.indrelid = to_regclass(%s)
+      AND NOT EXISTS (SELECT 1 FROM pg_constraint k WHERE k.conindid = i.indexrelid)
+    ORDER BY c.relname
+"""
+
+CREATE_CHANGES_SQL = f"""
+    CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} (id bigint PRIMARY KEY);
+
+    CREATE OR REPLACE FUNCTION {CHANGES_TABLE}_log() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO {CHANGES_TABLE} VALUES (OLD.id) ON CONFLICT DO NOTHING;
+        ELSE
+            INSERT INTO {CHANGES_TABLE} VALUES (NEW.id) ON CONFLICT DO NOTHING;
+        END IF;
+        RETURN NULL;
+    END
+    $$;
+
+    DROP TRIGGER IF EXISTS {CHANGES_TABLE}_log ON {MAPPING_TABLE};
+    CREATE TRIGGER {CHANGES_TABLE}_log AFTER INSERT OR UPDATE OR DELETE ON {MAPPING_TABLE}
+        FOR EACH ROW EXECUTE FUNCTION {CHANGES_TABLE}_log();
+"""
+
+DROP_CHANGES_SQL = f"""
+    DROP TRIGGER IF EXISTS {CHANGES_TABLE}_log ON {MAPPING_TABLE};
+    DROP FUNCTION IF EXISTS {CHANGES_TABLE}_log();
+    DROP TABLE IF EXISTS {CHANGES_TABLE};
+"""
+
+COPY_SQL = """
+    INSERT INTO {new} ({columns}, event_date)
+    SELECT {source_columns}, COALESCE(e.event_date, %s)
+    FROM {table} m
+    JOIN {post} p ON p.id = m.post_id
+    JOIN {event} e ON e.id = p.event_id
+    WHERE {where}
+    ON CONFLICT DO NOTHING
+"""
+
+TAKE_CHANGES_SQL = f"""
+    DELETE FROM {CHANGES_TABLE}
+    WHERE id IN (SELECT id FROM {CHANGES_TABLE} ORDER BY id LIMIT %s)
+    RETURNING id
+"""
+
+INDEX_DEFINITION = re.compile(r'^CREATE (UNIQUE )?INDEX \S+ ON (?:ONLY )?\S+ ')
+
+
+def _renamed(name, suffix):
+    # PostgreSQL truncates identifiers to 63 bytes.
+    return f"{name[:62 - len(suffix)]}_{suffix}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert the post mapping table into monthly range partitions by event date without a long lock. "
+        "Rows are copied in batches while a trigger records concurrent changes, which are replayed until "
+        "only a few remain; the final replay and the table swap run under a short write lock. "
+        "Mapping rows without a post are not copied. Run it again to resume after an interruption."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50000, help="Mapping ids copied per transaction")
+        parser.add_argument('--swap-threshold', type=int, default=5000,
+                            help="Pending changes left before taking the write lock for the swap")
+        parser.add_argument('--drop-legacy', action='store_true',
+                            help=f"Drop {LEGACY_TABLE} after the swap instead of keeping it for rollback")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Partitioning needs PostgreSQL.")
+        if is_partitioned():
+            self.stdout.write(f"{MAPPING_TABLE} is already partitioned.")
+            return
+
+        self.columns = [
+            field.column for field in CustomerPostFrameMapping._meta.concrete_fields if field.column != 'event_date'
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(CONSTRAINTS_SQL, [MAPPING_TABLE])
+            self.constraints = cursor.fetchall()
+            cursor.execute(INDEXES_SQL, [MAPPING_TABLE])
+            self.indexes = cursor.fetchall()
+
+        for name, kind, definition in self.constraints:
+            if kind == 'u' and 'event_date' not in definition:
+                raise CommandError(
+                    f"Constraint {name} does not include event_date; apply the post migrations first."
+                )
+
+        with transaction.atomic():
+            self.prepare()
+        self.copy(options['batch_size'])
+        self.replay_until(options['swap_threshold'], options['batch_size'])
+        with transaction.atomic():
+            self.swap(options['batch_size'])
+
+        if options['drop_legacy']:
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE {LEGACY_TABLE}")
+            self.stdout.write(f"Dropped {LEGACY_TABLE}")
+        else:
+            self.stdout.write(f"{LEGACY_TABLE} kept; drop it once the partitioned table is verified.")
+
+    def prepare(self):
+        """Create the partitioned table, its partitions and the change log; safe to repeat."""
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [NEW_TABLE])
+            exists = cursor.fetchone()[0]
+            if not exists:
+                cursor.execute(
+                    f"CREATE TABLE {NEW_TABLE} (LIKE {MAPPING_TABLE} INCLUDING DEFAULTS) "
+                    f"PARTITION BY RANGE (event_date)"
+                )
+                cursor.execute(f"CREATE SEQUENCE {NEW_SEQUENCE} OWNED BY {NEW_TABLE}.id")
+                cursor.execute(f"ALTER TABLE {NEW_TABLE} ALTER COLUMN id SET DEFAULT nextval('{NEW_SEQUENCE}')")
+
+                for name, kind, definition in self.constraints:
+                    if kind == 'p':
+                        # The partition key has to be part of the primary key.
+                        definition = 'PRIMARY KEY (id, event_date)'
+                    cursor.execute(f"ALTER TABLE {NEW_TABLE} ADD CONSTRAINT {_renamed(name, 'part')} {definition}")
+                for name, definition in self.indexes:
+                    cursor.execute(INDEX_DEFINITION.sub(
+                        lambda match: f"CREATE {match.group(1) or ''}INDEX {_renamed(name, 'part')} ON {NEW_TABLE} ",
+                        definition
+                    ))
+                cursor.execute(f"CREATE TABLE {_renamed(DEFAULT_PARTITION, 'part')} PARTITION OF {NEW_TABLE} DEFAULT")
+                self.stdout.write(f"Created {NEW_TABLE}")
+
+            cursor.execute(CREATE_CHANGES_SQL)
+
+        dates = Event.objects.exclude(event_date=None).aggregate(first=Min('event_date'), last=Max('event_date'))
+        last_month = add_months(max(dates['last'] or date.today(), date.today()),
+                                settings.POST_MAPPING_PARTITION_MONTHS_AHEAD)
+        ensure_undated_partition(NEW_TABLE)
+        created = create_partitions(dates['first'] or date.today(), last_month, table=NEW_TABLE)
+        self.stdout.write(f"Created {len(created)} monthly partitions")
+
+    def copy_rows(self, cursor, where, params):
+        cursor.execute(COPY_SQL.format(
+            new=NEW_TABLE,
+            table=MAPPING_TABLE,
+            post=Post._meta.db_table,
+            event=Event._meta.db_table,
+            columns=', '.join(self.columns),
+            source_columns=', '.join(f'm.{column}' for column in self.columns),
+            where=where,
+        ), [UNDATED_EVENT_DATE, *params])
+        return cursor.rowcount
+
+    def copy(self, batch_size):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COALESCE(max(id), 0) FROM {NEW_TABLE}")
+            copied_up_to = cursor.fetchone()[0]
+            cursor.execute(f"SELECT COALESCE(max(id), 0) FROM {MAPPING_TABLE}")
+            last_id = cursor.fetchone()[0]
+
+        copied = 0
+        started = time.monotonic()
+        for first_id in range(copied_up_to + 1, last_id + 1, batch_size):
+            with transaction.atomic(), connection.cursor() as cursor:
+                copied += self.copy_rows(cursor, 'm.id BETWEEN %s AND %s', [first_id, first_id + batch_size - 1])
+            self.stdout.write(
+                f"Copied ids up to {min(first_id + batch_size - 1, last_id)} of {last_id} "
+                f"({copied} rows, {time.monotonic() - started:.0f}s)"
+            )
+
+    def replay(self, cursor, batch_size):
+        """Re-copy one batch of rows changed since the copy started; returns the batch size."""
+        cursor.execute(TAKE_CHANGES_SQL, [batch_size])
+        ids = [row[0] for row in cursor.fetchall()]
+        if ids:
+            cursor.execute(f"DELETE FROM {NEW_TABLE} WHERE id = ANY(%s)", [ids])
+            self.copy_rows(cursor, 'm.id = ANY(%s)', [ids])
+        return len(ids)
+
+    def replay_until(self, threshold, batch_size):
+        while True:
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT count(*) FROM {CHANGES_TABLE}")
+                pending = cursor.fetchone()[0]
+            self.stdout.write(f"{pending} changed rows to replay")
+            if pending <= threshold:
+                return
+            with transaction.atomic(), connection.cursor() as cursor:
+                self.replay(cursor, batch_size)
+
+    def swap(self, batch_size):
+        with connection.cursor() as cursor:
+            # Readers keep going; writers wait for the few statements below.
+            cursor.execute(f"LOCK TABLE {MAPPING_TABLE} IN EXCLUSIVE MODE")
+            while self.replay(cursor, batch_size):
+                pass
+            cursor.execute(DROP_CHANGES_SQL)
+
+            cursor.execute(
+                f"SELECT setval('{NEW_SEQUENCE}', nextval(pg_get_serial_sequence(%s, 'id')))", [MAPPING_TABLE]
+            )
+
+            cursor.execute(f"ALTER TABLE {MAPPING_TABLE} RENAME TO {LEGACY_TABLE}")
+            for name, kind, definition in self.constraints:
+                cursor.execute(f"ALTER TABLE {LEGACY_TABLE} RENAME CONSTRAINT {name} TO {_renamed(name, 'legacy')}")
+            for name, definition in self.indexes:
+                cursor.execute(f"ALTER INDEX {name} RENAME TO {_renamed(name, 'legacy')}")
+
+            cursor.execute(f"ALTER TABLE {NEW_TABLE} RENAME TO {MAPPING_TABLE}")
+            for name, kind, definition in self.constraints:
+                cursor.execute(f"ALTER TABLE {MAPPING_TABLE} RENAME CONSTRAINT {_renamed(name, 'part')} TO {name}")
+            for name, definition in self.indexes:
+                cursor.execute(f"ALTER INDEX {_renamed(name, 'part')} RENAME TO {name}")
+            cursor.execute(f"ALTER TABLE {_renamed(DEFAULT_PARTITION, 'part')} RENAME TO {DEFAULT_PARTITION}")
+            cursor.execute(f"ALTER TABLE {undated_partition_name(NEW_TABLE)} RENAME TO {UNDATED_PARTITION}")
+            for month, name in monthly_partitions(MAPPING_TABLE).items():
+                cursor.execute(f"ALTER TABLE {name} RENAME TO {partition_name(month)}")
+
+        # Views are bound to the table they were created on, not its name.
+        create_feed_views()
+        self.stdout.write(self.style.SUCCESS(f"{MAPPING_TABLE} is now partitioned by event date"))
@@ -2,6 +2,7 @@ import logging
 import json
 from datetime import datetime
 import pytz
+from django.utils.cache import patch_vary_headers
 
 logger = logging.getLogger('django.request')
 error_logger = logging.getLogger('api_errors')
@@ -102,4 +103,21 @@ class APILoggingMiddleware:
     def _get_ist_time():
         """Get the current time in IST."""
         ist = pytz.timezone('Asia/Kolkata')
-        return datetime.now(ist).strftime('%Y-%m-%d %H:%M:%S')
\ No newline at end of file
+        return datetime.now(ist).strftime('%Y-%m-%d %H:%M:%S')
+
+class ClientHintsMiddleware:
+    """
+    Asks browsers to send the width hints ``lib.media.requested_width`` reads,
+    and marks responses as varying on them so caches keep one copy per width.
+    """
+    HINTS = ('Sec-CH-Width', 'Sec-CH-Viewport-Width', 'Sec-CH-DPR')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.path.startswith('/api/'):
+            response['Accept-CH'] = ', '.join(self.HINTS)
+            patch_vary_headers(response, self.HINTS)
+        return response
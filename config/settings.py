@@ -71,6 +71,7 @@ INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 
 MIDDLEWARE = [
     "config.middleware.APILoggingMiddleware",  # Enhanced logging for debugging
+    "config.middleware.ClientHintsMiddleware",  # Asks browsers for the width hints of image variants
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -173,6 +174,15 @@ STATICFILES_DIRS = (os.path.join(BASE_DIR, "staticfiles"),)
 
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+# Media is sent by nginx: public files from its /media/ location, private
+# ones (rendered videos) through X-Accel-Redirect to the internal
+# MEDIA_INTERNAL_URL location once lib.serving.MediaFileView has checked the
+# user or the signed ?token= (valid MEDIA_SIGNED_URL_MAX_AGE seconds). Turn
+# MEDIA_ACCEL_REDIRECT off where there is no nginx in front.
+MEDIA_INTERNAL_URL = "/internal/media/"
+MEDIA_ACCEL_REDIRECT = env.bool("MEDIA_ACCEL_REDIRECT", default=not DEBUG)
+MEDIA_PRIVATE_PREFIXES = ["video-with-frame/"]
+MEDIA_SIGNED_URL_MAX_AGE = env.int("MEDIA_SIGNED_URL_MAX_AGE", default=60 * 60 * 24)
 
 # EMAIL
 # ------------------------------------------------------------------------------
@@ -219,6 +229,133 @@ CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = "Asia/Kolkata"
 
+# ---------------------------- Feed Fan-out Configuration ------------------------
+# "sql" maps a new post with one INSERT ... SELECT inside PostgreSQL,
+# "orm" keeps the original bulk_create path.
+POST_FANOUT_STRATEGY = env.str("POST_FANOUT_STRATEGY", default="sql")
+# Customers per fan-out chunk; chunks run in parallel on the "fanout" queue
+# (celery -A config worker -Q fanout).
+POST_FANOUT_CHUNK_SIZE = env.int("POST_FANOUT_CHUNK_SIZE", default=2000)
+
+# "materialized" stores one mapping row per post x customer frame, "virtual"
+# computes the feed at read time and only stores per-customer facts.
+POST_FEED_MODE = env.str("POST_FEED_MODE", default="materialized")
+
+# Monthly partitions of the post mapping table kept ahead of today once it is
+# partitioned (manage.py partition_post_mappings). Schedule
+# app_modules.post.tasks.create_mapping_partitions daily with celery beat.
+POST_MAPPING_PARTITION_MONTHS_AHEAD = env.int("POST_MAPPING_PARTITION_MONTHS_AHEAD", default=3)
+# Past months are dropped by app_modules.post.tasks.delete_past_events on the
+# "maintenance" queue (celery -A config worker -Q maintenance). A plain detach,
+# used while the table has a default partition, waits this many milliseconds
+# at most for its lock.
+POST_MAPPING_PARTITION_LOCK_TIMEOUT = env.int("POST_MAPPING_PARTITION_LOCK_TIMEOUT", default=5000)
+
+CELERY_TASK_ROUTES = {
+    "app_modules.post.tasks.fan_out_posts": {"queue": "fanout"},
+    "app_modules.post.tasks.fan_out_posts_chunk": {"queue": "fanout"},
+    "account.tasks.onboard_customer_frames": {"queue": "fanout"},
+    "account.tasks.remap_customer_frames": {"queue": "fanout"},
+    "app_modules.master.tasks.process_media_file": {"queue": "media"},
+    "app_modules.post.tasks.render_output_video": {"queue": "render"},
+    "app_modules.post.tasks.prerender_post_videos": {"queue": "render"},
+    "app_modules.post.task.process_video": {"queue": "render"},
+    "app_modules.post.tasks.delete_past_events": {"queue": "maintenance"},
+}
+# Priorities 0 (highest) to 9 on the Redis broker; render jobs use them to run
+# the renders customers wait for first.
+CELERY_BROKER_TRANSPORT_OPTIONS = {"priority_steps": list(range(10)), "queue_order_strategy": "priority"}
+
+# ---------------------------- Media Pipeline Configuration ------------------------
+# Uploads are stored as is and converted to WebP on the "media" queue
+# (celery -A config worker -Q media); the original is deleted this long
+# after the swap.
+MEDIA_ORIGINAL_RETENTION_SECONDS = env.int("MEDIA_ORIGINAL_RETENTION_SECONDS", default=3600)
+# Widths in pixels of the WebP copies stored next to every image; serializers
+# pick one from ?size= or the client hints (manage.py backfill_media
+# fills them in for existing media).
+MEDIA_VARIANT_WIDTHS = env.list("MEDIA_VARIANT_WIDTHS", cast=int, default=[160, 480, 1080])
+# Images are decoded straight to at most MEDIA_MAX_DIMENSION pixels per side
+# (Pillow draft/reduce), refused above MEDIA_MAX_PIXELS, and processed in a
+# child process capped at MEDIA_DECODE_MEMORY_LIMIT bytes of address space.
+MEDIA_MAX_DIMENSION = env.int("MEDIA_MAX_DIMENSION", default=4096)
+MEDIA_MAX_PIXELS = env.int("MEDIA_MAX_PIXELS", default=40_000_000)
+MEDIA_DECODE_MEMORY_LIMIT = env.int("MEDIA_DECODE_MEMORY_LIMIT", default=1024 * 1024 ** 2)
+MEDIA_DECODE_TIMEOUT = env.int("MEDIA_DECODE_TIMEOUT", default=120)
+# Named Pillow WebP options; models pick one per field with ``media_profiles``.
+# Frames are drawn over posts and keep their edges and transparency exactly;
+# photos are lossy. Compare profiles on real uploads with
+# manage.py benchmark_media_profiles before changing them.
+MEDIA_ENCODING_PROFILES = {
+    "photo": {"quality": 82, "method": 4, "alpha_quality": 90},
+    "frame": {"lossless": True, "quality": 80, "method": 4, "exact": True},
+    "max_quality": {"quality": 100, "method": 4},
+}
+MEDIA_DEFAULT_ENCODING_PROFILE = env.str("MEDIA_DEFAULT_ENCODING_PROFILE", default="photo")
+# Hash uploads while they stream in so they can be stored under their
+# content hash (see lib.media.store_upload) without reading them twice.
+FILE_UPLOAD_HANDLERS = [
+    "lib.uploads.HashingMemoryFileUploadHandler",
+    "lib.uploads.HashingTemporaryFileUploadHandler",
+]
+# Post images composited with the customer's frame (app_modules.post.framing).
+# The cache is served by nginx from an internal location mapped to
+# FRAMED_IMAGE_CACHE_URL; turn FRAMED_IMAGE_ACCEL_REDIRECT off where there is
+# no nginx in front and Django sends the files itself.
+FRAMED_IMAGE_CACHE_ROOT = env.str("FRAMED_IMAGE_CACHE_ROOT", default=os.path.join(BASE_DIR, "cache", "framed"))
+FRAMED_IMAGE_CACHE_URL = "/internal/framed/"
+FRAMED_IMAGE_CACHE_MAX_BYTES = env.int("FRAMED_IMAGE_CACHE_MAX_BYTES", default=2 * 1024 ** 3)
+FRAMED_IMAGE_ACCEL_REDIRECT = env.bool("FRAMED_IMAGE_ACCEL_REDIRECT", default=not DEBUG)
+FRAMED_IMAGE_ENCODING_PROFILE = "photo"
+
+# ---------------------------- Video Render Configuration ------------------------
+# Framed videos are rendered on the "render" queue; its worker is the bounded
+# pool of ffmpeg processes (celery -A config worker -Q render --concurrency=2
+# --prefetch-multiplier=1, so queued renders keep their priority order; with
+# PROCESS_VIDEO_FFMPEG_THREADS at 1, up to one process per core).
+# See app_modules.post.rendering. Jobs and their results are kept
+# RENDER_JOB_TIMEOUT seconds. Pending jobs are answered with 202 and a
+# Retry-After of RENDER_JOB_RETRY_AFTER seconds, and clients poll. A ?wait=
+# holds a web worker for at most RENDER_JOB_MAX_WAIT seconds: 2 on sync
+# gunicorn workers, where every waiting client blocks a whole process, and up
+# to RENDER_JOB_MAX_WAIT only behind an async worker class
+# (GUNICORN_WORKER_CLASS=gevent or eventlet, see gunicorn_config.py).
+RENDER_JOB_TIMEOUT = env.int("RENDER_JOB_TIMEOUT", default=60 * 60 * 24)
+RENDER_JOB_LONG_POLL = env("GUNICORN_WORKER_CLASS", default="sync") in ("gevent", "eventlet")
+RENDER_JOB_MAX_WAIT = (
+    env.int("RENDER_JOB_MAX_WAIT", default=20) if RENDER_JOB_LONG_POLL
+    else min(env.int("RENDER_JOB_MAX_WAIT", default=2), 2)
+)
+RENDER_JOB_RETRY_AFTER = env.int("RENDER_JOB_RETRY_AFTER", default=2)
+RENDER_JOB_POLL_INTERVAL = 0.5
+# Rendered videos are stored under MEDIA_ROOT/video-with-frame by a hash of
+# the video, the frame and the render parameters and shared by every customer;
+# the least recently used are evicted above this many bytes.
+RENDERED_VIDEO_CACHE_MAX_BYTES = env.int("RENDERED_VIDEO_CACHE_MAX_BYTES", default=20 * 1024 ** 3)
+# Render new video posts with every distinct frame of their group when they
+# are published, events dated soonest first, at most
+# VIDEO_PRERENDER_MAX_FRAMES frames per post.
+VIDEO_PRERENDER_ON_PUBLISH = env.bool("VIDEO_PRERENDER_ON_PUBLISH", default=False)
+VIDEO_PRERENDER_MAX_FRAMES = env.int("VIDEO_PRERENDER_MAX_FRAMES", default=500)
+# Video sizes (width x height) hosted; every customer frame is stored
+# pre-scaled to fit each of them so renders overlay it without scaling
+# (manage.py benchmark_frame_overlay compares the two).
+VIDEO_CANONICAL_RESOLUTIONS = [
+    tuple(int(side) for side in resolution.split("x"))
+    for resolution in env.list(
+        "VIDEO_CANONICAL_RESOLUTIONS", default=["1080x1920", "1080x1080", "1920x1080", "720x1280"]
+    )
+]
+# app_modules.post.task.process_video: downloads are streamed to a per-job
+# temporary directory and refused above these sizes. Each ffmpeg run, there
+# and in the renders of lib.helpers.render_video_with_frame, uses
+# PROCESS_VIDEO_FFMPEG_THREADS threads, so the render worker can run one job
+# per core.
+PROCESS_VIDEO_MAX_VIDEO_BYTES = env.int("PROCESS_VIDEO_MAX_VIDEO_BYTES", default=200 * 1024 ** 2)
+PROCESS_VIDEO_MAX_FRAME_BYTES = env.int("PROCESS_VIDEO_MAX_FRAME_BYTES", default=20 * 1024 ** 2)
+PROCESS_VIDEO_DOWNLOAD_TIMEOUT = env.int("PROCESS_VIDEO_DOWNLOAD_TIMEOUT", default=30)
+PROCESS_VIDEO_FFMPEG_THREADS = env.int("PROCESS_VIDEO_FFMPEG_THREADS", default=1)
+
 CORS_ORIGIN_ALLOW_ALL = False
 CORS_ORIGIN_WHITELIST = ["https://dashboard.alphawala.xyz", "http://localhost:3000"]
 CORS_ALLOW_HEADERS = [
@@ -1,6 +1,6 @@
 
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework_simplejwt.views import (
@@ -12,6 +12,8 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from lib.serving import MediaFileView
+
 schema_view = get_schema_view(
    openapi.Info(
       title="Alpha Design Spot API",
@@ -40,7 +42,9 @@ urlpatterns = [
     path("api/master/", include("master.urls"), name="master"),
     path("api/post/", include("post.urls"), name="master"),
     path("api/website/", include("website.urls"), name="website"),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    # Authorized here, sent by nginx (lib.serving)
+    re_path(rf"^{settings.MEDIA_URL.lstrip('/')}(?P<path>.+)$", MediaFileView.as_view(), name="media"),
+]
 
 if settings.DEBUG:  
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
@@ -1,5 +1,6 @@
 # Gunicorn configuration for production
 import multiprocessing
+import os
 
 # Server socket
 bind = "0.0.0.0:8000"
@@ -7,7 +8,8 @@ backlog = 2048
 
 # Worker processes
 workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"
+# Long-polling render jobs (RENDER_JOB_MAX_WAIT) needs gevent or eventlet here.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "sync")
 worker_connections = 1000
 timeout = 60  # Worker timeout - prevents hanging requests
 keepalive = 30  # Keep-alive connections
@@ -0,0 +1,150 @@
+"""
+Size-capped, content-addressed file caches on local disk.
+
+Callers name an entry by a digest of everything that went into it, so an
+entry never goes stale and is shared by every request with the same inputs.
+Entries live in ``<root>/<digest[:2]>/<digest><suffix>``; every hit touches
+the file's mtime, and once the running total kept in the cache goes over
+``max_bytes`` the least recently used entries are evicted until it is back
+under 90% of it. Hits, misses and evictions are counted per cache (see
+``disk_cache_counters``).
+"""
+import logging
+import os
+import tempfile
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+EVICTION_LOCK_TIMEOUT = 300
+COUNTERS = ('hits', 'misses', 'evictions', 'evicted_bytes')
+
+# name -> DiskCache, for disk_cache_counters()
+DISK_CACHES = {}
+
+
+class DiskCache:
+    def __init__(self, name, root, max_bytes, suffix):
+        self.name = name
+        self.root = root
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.size_key = f"{name}_cache_bytes"
+        self.lock_key = f"{name}_cache_evicting"
+        DISK_CACHES[name] = self
+
+    def relative_path(self, digest):
+        return os.path.join(digest[:2], f"{digest}{self.suffix}")
+
+    def full_path(self, digest):
+        return os.path.join(self.root, self.relative_path(digest))
+
+    def lookup(self, digest):
+        """Relative path of the entry ``digest``, or ``None`` on a miss."""
+        try:
+            # Touch on hit: the mtime is the recency eviction goes by.
+            os.utime(self.full_path(digest))
+        except FileNotFoundError:
+            self.count('misses')
+            return None
+        self.count('hits')
+        return self.relative_path(digest)
+
+    def temporary_path(self, digest):
+        """A new file next to where the entry ``digest`` goes, for writers that need a path; see ``store_file``."""
+        directory = os.path.dirname(self.full_path(digest))
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=directory, suffix=f'.tmp{self.suffix}', delete=False) as temporary:
+            return temporary.name
+
+    def store(self, digest, data):
+        """Store the bytes ``data`` as the entry ``digest``; returns its relative path."""
+        path = self.temporary_path(digest)
+        with open(path, 'wb') as temporary:
+            temporary.write(data)
+        return self.store_file(digest, path)
+
+    def store_file(self, digest, path):
+        """Move the finished file ``path`` (from ``temporary_path``) into place as the entry ``digest``."""
+        size = os.path.getsize(path)
+        os.replace(path, self.full_path(digest))
+        self.add_bytes(size)
+        return self.relative_path(digest)
+
+    def add_bytes(self, size):
+        if cache.add(self.size_key, 0, timeout=None):
+            # The running total was missing (first use, or the cache was
+            # flushed): start from what is on disk, this entry included.
+            # Counting a concurrent write twice only brings evict(), which
+            # recounts, forward.
+            total = cache.incr(self.size_key, sum(entry_size for mtime, entry_size, path in self.entries()))
+        else:
+            total = cache.incr(self.size_key, size)
+        if total > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        """``(mtime, size, path)`` of every entry, and of loose files with the suffix in the root."""
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for entry in os.scandir(self.root):
+            children = os.scandir(entry.path) if entry.is_dir() else [entry]
+            for child in children:
+                if child.is_file() and child.name.endswith(self.suffix) and '.tmp' not in child.name:
+                    stat = child.stat()
+                    entries.append((stat.st_mtime, stat.st_size, child.path))
+        return entries
+
+    def evict(self, target=None):
+        """
+        Delete the least recently used entries until the cache holds at most
+        ``target`` bytes (90% of the budget by default); returns the bytes freed.
+        """
+        if not cache.add(self.lock_key, True, timeout=EVICTION_LOCK_TIMEOUT):
+            return 0
+        try:
+            if target is None:
+                target = self.max_bytes * 9 // 10
+
+            entries = self.entries()
+            total = sum(size for mtime, size, path in entries)
+
+            freed = evicted = 0
+            for mtime, size, path in sorted(entries):
+                if total - freed <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                freed += size
+                evicted += 1
+
+            cache.set(self.size_key, total - freed, timeout=None)
+            self.count('evictions', evicted)
+            self.count('evicted_bytes', freed)
+            logger.info("%s cache evicted %s files, %s bytes, %s bytes left", self.name, evicted, freed, total - freed)
+            return freed
+        finally:
+            cache.delete(self.lock_key)
+
+    def count(self, counter, amount=1):
+        if amount:
+            key = f"{self.name}_cache:{counter}"
+            cache.add(key, 0, timeout=None)
+            cache.incr(key, amount)
+
+    def counters(self):
+        keys = [f"{self.name}_cache:{counter}" for counter in COUNTERS]
+        values = cache.get_many([*keys, self.size_key])
+        return {
+            **{counter: values.get(key, 0) for counter, key in zip(COUNTERS, keys)},
+            'bytes': values.get(self.size_key, 0),
+            'max_bytes': self.max_bytes,
+        }
+
+
+def disk_cache_counters():
+    return {name: disk_cache.counters() for name, disk_cache in DISK_CACHES.items()}
@@ -0,0 +1,76 @@
+"""
+Coalescing dispatch of work queued from model signals.
+
+Receivers call ``dispatcher.add(key, object_id)`` instead of registering their
+own ``transaction.on_commit`` callback. The ids are collected per key for the
+length of the surrounding transaction and handed to the handler registered
+for the key in one call once it commits, so saving 50 posts in one
+transaction queues one job instead of 50. Outside a transaction the handler
+runs right away with a single id. Ids added inside a savepoint that is
+later rolled back stay in the batch, so handlers must skip missing rows.
+"""
+import logging
+import threading
+from collections import defaultdict
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class _Batch:
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self.ids = defaultdict(set)
+
+    def flush(self):
+        ids, self.ids = self.ids, defaultdict(set)
+        self.dispatcher.dispatch(ids)
+
+
+class CoalescingDispatcher:
+
+    def __init__(self):
+        self._handlers = {}
+        self._local = threading.local()
+
+    def register(self, key, handler):
+        """
+        Register ``handler(ids)`` for ``key``. A key keeps the handler it was
+        first registered with, so importing a signals module twice is harmless.
+        """
+        self._handlers.setdefault(key, handler)
+
+    def add(self, key, object_id, using=None):
+        if key not in self._handlers:
+            raise KeyError(f"No handler registered for {key!r}")
+
+        using = using or DEFAULT_DB_ALIAS
+        connection = transaction.get_connection(using)
+        if not connection.in_atomic_block:
+            self.dispatch({key: {object_id}})
+            return
+
+        batches = self._local.__dict__.setdefault('batches', {})
+        batch = batches.get(using)
+        # A batch whose flush is no longer pending belongs to a transaction
+        # that was committed or rolled back; start a new one.
+        if batch is None or not any(hook[1] == batch.flush for hook in connection.run_on_commit):
+            batch = batches[using] = _Batch(self)
+            transaction.on_commit(batch.flush, using=using)
+        batch.ids[key].add(object_id)
+
+    def dispatch(self, ids_by_key):
+        for key, handler in self._handlers.items():
+            ids = ids_by_key.get(key)
+            if not ids:
+                continue
+            try:
+                handler(sorted(ids))
+            except Exception:
+                # The transaction is already committed; losing one key's job
+                # must not drop the jobs of the others.
+                logger.exception("Dispatching %s for ids %s failed", key, sorted(ids))
+
+
+dispatcher = CoalescingDispatcher()
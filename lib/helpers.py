@@ -1,16 +1,17 @@
+import hashlib
+import json
 import os
-import uuid
-from io import BytesIO
 from uuid import uuid4
 
 import ffmpeg
-from PIL import Image
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.core.files.base import ContentFile
 from django.core.validators import FileExtensionValidator
 from django.utils.deconstruct import deconstructible
 
+from lib.disk_cache import DiskCache
+from lib.imaging import fit_size
+
 
 @deconstructible
 class rename_file_name(object):
@@ -58,60 +59,89 @@ def file_extension(value):
         )
 
 
-def converter_to_webp(image_instance):
+# Bump when the ffmpeg command below changes, so earlier renders are not reused.
+VIDEO_RENDER_PARAMS = {'version': 2, 'overlay': 'fit-center', 'audio': 'copy'}
+
+RENDERED_VIDEO_CACHE = DiskCache(
+    'rendered_video', os.path.join(settings.MEDIA_ROOT, 'video-with-frame'),
+    settings.RENDERED_VIDEO_CACHE_MAX_BYTES, '.mp4'
+)
+
+
+def video_render_key(video_file, frame_file):
     """
-    Convert any image object to WebP for faster image load time.
+    Digest of everything a framed video is rendered from: the content of both
+    files and the render parameters. Returned with the ``MediaFile`` of each
+    file, ``None`` for files stored without one.
     """
-    if image_instance:
-        image_file_format = ["png", "jpeg", "jpg", "jpe", "rgba", "rgb", "bmp", "webp"]
-        ext = image_instance.name.split(".")[-1].lower()
+    # Imported here: app_modules.master.models imports this module.
+    from app_modules.master.models import MediaFile
+    from lib.media import file_key
 
-        if ext in image_file_format:
-            image = Image.open(image_instance)
-            image_io = BytesIO()
-            image.save(image_io, format="WEBP", quality=100)
-            image_instance.save(image_instance.name.split(".")[0] + ".webp", ContentFile(image_io.getvalue()),
-                                save=False)
+    media_files = {
+        media_file.name: media_file
+        for media_file in MediaFile.objects.filter(name__in=[video_file.name, frame_file.name])
+    }
+    video, frame = media_files.get(video_file.name), media_files.get(frame_file.name)
+    params = json.dumps(VIDEO_RENDER_PARAMS, sort_keys=True)
+    key = f"{file_key(video, video_file.name)}:{file_key(frame, frame_file.name)}:{params}"
+    return hashlib.sha256(key.encode()).hexdigest(), video, frame
 
 
 def generate_video_with_frame(customer_frame, post):
-    # Get the paths of the frame image and video from the CustomerFrame and Post objects
-    frame_image_path = customer_frame.frame_img.path
-    video_path = post.file.path
-
-    # Create the 'video-with-frame' directory inside MEDIA_ROOT if it doesn't exist
-    media_directory = os.path.join(settings.MEDIA_ROOT, 'video-with-frame')
-    os.makedirs(media_directory, exist_ok=True)
-
-    # Output video file name
-    # Generate a unique ID using UUID
-    unique_id = str(uuid.uuid4())
-    output_video = f"output_{unique_id}.mp4"
-
-    # Get the video dimensions
-    video_info = ffmpeg.probe(video_path)
-    video_width = int(video_info['streams'][0]['width'])
-    video_height = int(video_info['streams'][0]['height'])
-
-    # Get the frame image dimensions
-    frame_info = ffmpeg.probe(frame_image_path)
-    frame_width = int(frame_info['streams'][0]['width'])
-    frame_height = int(frame_info['streams'][0]['height'])
-
-    # Calculate the scale factor based on the video dimensions
-    scale_factor = min(video_width / frame_width, video_height / frame_height)
-
-    # Calculate the frame position
-    frame_x = int((video_width - frame_width * scale_factor) / 2)
-    frame_y = int((video_height - frame_height * scale_factor) / 2)
-
-    # Add frame to the video using ffmpeg
-    ffmpeg.input(video_path).output(os.path.join(media_directory, output_video),
-                                    vf="movie={},scale={}*iw:{}*ih,format=rgba [watermark]; [in][watermark] overlay={}:{} [out]".format(
-                                        frame_image_path, scale_factor, scale_factor, frame_x, frame_y),
-                                    **{'c:a': 'copy'}).run()
+    """
+    URL of ``post``'s video with ``customer_frame`` drawn over it. Renders are
+    cached by ``video_render_key``, so the same video and frame are rendered
+    once for every customer that uses them.
+    """
+    from lib.media import media_dimensions, resolution_key
+
+    digest, video, frame = video_render_key(post.file, customer_frame.frame_img)
+    relative_path = RENDERED_VIDEO_CACHE.lookup(digest)
+    if relative_path is None:
+        # Recorded at upload; probed here only for files stored before that.
+        video_size = media_dimensions(video, post.file.name, post.file.storage)
+        frame_size = media_dimensions(frame, customer_frame.frame_img.name, customer_frame.frame_img.storage)
+        # Frames are stored pre-scaled for the canonical video sizes.
+        overlay = frame is not None and frame.overlays.get(resolution_key(video_size))
+        if overlay:
+            frame_image_path = customer_frame.frame_img.storage.path(overlay)
+            frame_size = fit_size(frame_size, video_size)
+        else:
+            frame_image_path = customer_frame.frame_img.path
+        relative_path = render_video_with_frame(
+            digest, post.file.path, video_size, frame_image_path, frame_size, prescaled=bool(overlay)
+        )
 
     # Get the full media URL for the output video
-    output_video_url = os.path.join(settings.MEDIA_URL, 'video-with-frame', output_video)
+    return os.path.join(settings.MEDIA_URL, 'video-with-frame', relative_path)
+
 
-    return output_video_url
+def frame_overlay_filter(frame_image_path, video_size, frame_size, prescaled=False):
+    """
+    ffmpeg filter graph drawing the frame image centred over a video of
+    ``video_size``, fitted inside it. A ``prescaled`` frame already has the
+    fitted size and is overlaid as it is; any other is scaled on every render.
+    """
+    width, height = frame_size if prescaled else fit_size(frame_size, video_size)
+    frame_x = (video_size[0] - width) // 2
+    frame_y = (video_size[1] - height) // 2
+    if prescaled:
+        watermark = f"movie={frame_image_path}"
+    else:
+        watermark = f"movie={frame_image_path},scale={width}:{height},format=rgba"
+    return f"{watermark} [watermark]; [in][watermark] overlay={frame_x}:{frame_y} [out]"
+
+
+def render_video_with_frame(digest, video_path, video_size, frame_image_path, frame_size, prescaled=False):
+    # Render next to the cache entry and move it into place once complete
+    output_path = RENDERED_VIDEO_CACHE.temporary_path(digest)
+    try:
+        ffmpeg.input(video_path).output(
+            output_path, vf=frame_overlay_filter(frame_image_path, video_size, frame_size, prescaled),
+            threads=settings.PROCESS_VIDEO_FFMPEG_THREADS, **{'c:a': 'copy'}
+        ).overwrite_output().run()
+    except BaseException:
+        os.remove(output_path)
+        raise
+    return RENDERED_VIDEO_CACHE.store_file(digest, output_path)
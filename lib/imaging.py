@@ -0,0 +1,144 @@
+"""
+Bounded-memory image decoding and encoding.
+
+Everything here is plain Pillow so it can run in a short-lived child process
+(``python -m lib.imaging``) that caps its own address space before decoding
+anything; see ``lib.media.run_isolated``. The child reads a JSON request
+(``operation``, ``args``, ``memory_limit``) from stdin and writes the JSON
+result to stdout, so a child compromised by a crafted image can hand the
+caller nothing but data. Images travel as file paths both ways: the child
+opens its input itself and writes what it encodes to files under the output
+directory it is given, so no image bytes go through the pipe or the
+caller's memory.
+
+Images are checked against a pixel budget from their header before any pixel
+is decoded, and decoded with Pillow's draft (JPEG DCT scaling) and reduce
+modes straight to at most ``max_dimension`` pixels on the long side.
+"""
+import json
+import os
+import resource
+import sys
+from io import BytesIO
+
+from PIL import Image
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def open_bounded(file, max_size, max_pixels):
+    """
+    Decode ``file`` to an image fitting in the ``(width, height)`` box
+    ``max_size``, keeping its aspect ratio; returns ``(image, original
+    size)``. Raises ``ImageTooLarge`` when the header announces more than
+    ``max_pixels`` pixels.
+    """
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    image = Image.open(file)
+    if image.width * image.height > max_pixels:
+        raise ImageTooLarge(f"{image.width}x{image.height} is over the budget of {max_pixels} pixels")
+
+    size = image.size
+    # thumbnail() applies draft() and reduce() before resampling, so a large
+    # JPEG is never decoded at full resolution.
+    image.thumbnail(max_size, Image.LANCZOS, reducing_gap=3.0)
+    return image, size
+
+
+def encode_webp(image, profile):
+    """Encode ``image`` with the Pillow WebP options of an encoding profile (``quality``, ``method``, ...)."""
+    image_io = BytesIO()
+    image.save(image_io, format="WEBP", **profile)
+    return image_io.getvalue()
+
+
+def save_webp(image, path, profile):
+    """Encode ``image`` to the file ``path`` like ``encode_webp``; returns ``path``."""
+    image.save(path, format="WEBP", **profile)
+    return path
+
+
+def scale_to_width(image, width):
+    return image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+
+
+def fit_size(size, box):
+    """``size`` scaled up or down, keeping its aspect ratio, to the largest that fits in ``box``."""
+    scale = min(box[0] / size[0], box[1] / size[1])
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def save_overlay(image, box, output):
+    """Write ``image`` as RGBA PNG scaled to fit ``box`` to ``output``, ready to be overlaid on a video of that size."""
+    overlay = image.convert('RGBA').resize(fit_size(image.size, box), Image.LANCZOS)
+    # Fast to decode at every render; the size on disk matters little.
+    overlay.save(output, format="PNG", compress_level=1)
+    return output
+
+
+def encode_overlay(image, box):
+    """PNG bytes of ``save_overlay``."""
+    image_io = BytesIO()
+    save_overlay(image, box, image_io)
+    return image_io.getvalue()
+
+
+def convert(path, output_dir, widths, webp, max_dimension, max_pixels, profile, overlays=()):
+    """
+    Decode the image file ``path`` and encode it as WebP when ``webp`` is
+    true or it had to be scaled down, plus a WebP copy at each of ``widths``
+    narrower than it and an overlay (``save_overlay``) for each ``(width,
+    height)`` video size in ``overlays``, all written to ``output_dir``.
+    Returns ``{'webp': path or None, 'variants': {"<width>": path},
+    'overlays': {"<width>x<height>": path}, 'size': [width, height]}``, keyed
+    the way ``MediaFile.variants`` and ``MediaFile.overlays`` are.
+    """
+    image, size = open_bounded(path, (max_dimension, max_dimension), max_pixels)
+    webp_path = None
+    if webp or image.size != size:
+        webp_path = save_webp(image, os.path.join(output_dir, 'image.webp'), profile)
+    return {
+        'webp': webp_path,
+        'variants': {
+            str(width): save_webp(scale_to_width(image, width), os.path.join(output_dir, f'w{width}.webp'), profile)
+            for width in widths if width < image.width
+        },
+        'overlays': {
+            f'{box[0]}x{box[1]}': save_overlay(image, box, os.path.join(output_dir, f'overlay_{box[0]}x{box[1]}.png'))
+            for box in overlays
+        },
+        'size': list(image.size),
+    }
+
+
+def compose(post_path, frame_path, output_path, width, max_dimension, max_pixels, profile):
+    """
+    Write the frame in ``frame_path`` stretched over the image in
+    ``post_path``, ``width`` wide at most, as WebP to ``output_path``;
+    returns ``output_path``.
+    """
+    max_width = min(max_dimension, width) if width else max_dimension
+    post_image, _ = open_bounded(post_path, (max_width, max_dimension), max_pixels)
+    post_image = post_image.convert('RGBA')
+    frame_image, _ = open_bounded(frame_path, post_image.size, max_pixels)
+    frame_image = frame_image.convert('RGBA')
+    if frame_image.size != post_image.size:
+        frame_image = frame_image.resize(post_image.size, Image.LANCZOS)
+    return save_webp(Image.alpha_composite(post_image, frame_image), output_path, profile)
+
+
+OPERATIONS = {'convert': convert, 'compose': compose}
+
+
+def main():
+    request = json.load(sys.stdin)
+    if request.get('memory_limit'):
+        limit = request['memory_limit']
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    json.dump(OPERATIONS[request['operation']](*request['args']), sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
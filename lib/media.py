@@ -0,0 +1,650 @@
+"""
+Content-addressed storage and background processing of uploaded media.
+
+Models list their file fields in ``media_fields``. Saving a model with a new
+upload stores it under the SHA-256 of its bytes (``post/<hash>.png``) with a
+reference-counted ``MediaFile``: uploading the same bytes again reuses the
+stored file and whatever processing it already got, and a file is deleted
+only when the last row holding it is deleted or moves to another file.
+
+New images are recorded as pending and a worker on the "media" queue
+decodes each once in a memory-capped child process (``lib.imaging``),
+encodes the WebP version and the narrower copies of ``MEDIA_VARIANT_WIDTHS``
+next to it, and then points every row still holding the original at the WebP
+with one conditional update, so a file replaced in the meantime is left
+alone.
+
+Serializers pick the variant for the width a client asks for with ``?size=``
+or the ``Sec-CH-Width`` / ``Sec-CH-Viewport-Width`` client hints.
+"""
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import shutil
+import subprocess
+import sys
+import tempfile
+from collections import Counter
+from contextlib import contextmanager
+
+import ffmpeg
+from PIL import Image
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.files.base import File
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.query import QuerySet
+from django.db.models.signals import post_delete
+from django.utils import timezone
+from rest_framework import serializers
+
+from app_modules.master.models import MediaFile
+from lib.uploads import content_hash
+
+logger = logging.getLogger(__name__)
+
+WEBP_SOURCE_EXTENSIONS = ["png", "jpeg", "jpg", "jpe", "rgba", "rgb", "bmp"]
+IMAGE_EXTENSIONS = WEBP_SOURCE_EXTENSIONS + ["webp"]
+
+
+class MediaProcessingError(Exception):
+    pass
+
+
+# media_counters() keys
+QUEUED, SKIPPED_UNCHANGED, SKIPPED_DUPLICATE = 'queued', 'skipped_unchanged', 'skipped_duplicate'
+MEDIA_COUNTERS = (QUEUED, SKIPPED_UNCHANGED, SKIPPED_DUPLICATE)
+
+# MediaFile fields filled by probe_media()
+METADATA_FIELDS = ('width', 'height', 'duration', 'codec', 'size')
+
+
+def is_new_upload(field_file):
+    """True when a file was assigned to the field and has not been stored yet."""
+    return bool(field_file) and not field_file._committed
+
+
+def extension(name):
+    return name.rsplit(".", 1)[-1].lower()
+
+
+def needs_webp(name):
+    return extension(name) in WEBP_SOURCE_EXTENSIONS
+
+
+def is_image(name):
+    return extension(name) in IMAGE_EXTENSIONS
+
+
+def variant_name(name, width):
+    return f"{os.path.splitext(name)[0]}_w{width}.webp"
+
+
+@contextmanager
+def local_path(storage, name):
+    """
+    Path of the stored file ``name`` on local disk: the file itself when the
+    storage is local, otherwise a temporary copy streamed from the storage
+    and deleted on exit.
+    """
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        path = None
+    if path is not None:
+        yield path
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(name)[1]) as copy:
+        with storage.open(name) as source:
+            shutil.copyfileobj(source, copy)
+        copy.flush()
+        yield copy.name
+
+
+def run_isolated(operation, *args):
+    """
+    Run ``lib.imaging.<operation>(*args)`` in a child process whose address
+    space is capped at ``MEDIA_DECODE_MEMORY_LIMIT`` bytes, so decoding a huge
+    image fails in the child instead of bloating the calling worker. Only
+    file paths and small values go through the pipe, as JSON both ways; the
+    child opens and writes the image files itself, and applies the memory cap
+    to itself (no ``preexec_fn``, which is unsafe in threaded workers).
+    """
+    request = {'operation': operation, 'args': args, 'memory_limit': settings.MEDIA_DECODE_MEMORY_LIMIT}
+    try:
+        completed = subprocess.run(
+            [sys.executable, '-m', 'lib.imaging'], input=json.dumps(request).encode(), capture_output=True,
+            cwd=settings.BASE_DIR, timeout=settings.MEDIA_DECODE_TIMEOUT,
+        )
+    except subprocess.TimeoutExpired:
+        raise MediaProcessingError(f"{operation} took longer than {settings.MEDIA_DECODE_TIMEOUT}s")
+    if completed.returncode:
+        lines = completed.stderr.decode(errors='replace').strip().splitlines()
+        raise MediaProcessingError(lines[-1] if lines else f"{operation} exited with {completed.returncode}")
+    try:
+        return json.loads(completed.stdout)
+    except ValueError:
+        raise MediaProcessingError(f"{operation} returned malformed output")
+
+
+def encoding_profile(name=None):
+    """Pillow WebP options of the ``MEDIA_ENCODING_PROFILES`` entry ``name`` (the default profile for ``None``)."""
+    return settings.MEDIA_ENCODING_PROFILES[name or settings.MEDIA_DEFAULT_ENCODING_PROFILE]
+
+
+def convert_image(path, output_dir, webp, profile=None, widths=None, overlays=()):
+    """
+    ``lib.imaging.convert`` of the image file ``path`` into ``output_dir``
+    with the configured limits, in a capped child.
+    """
+    return run_isolated(
+        'convert', path, output_dir, settings.MEDIA_VARIANT_WIDTHS if widths is None else widths, webp,
+        settings.MEDIA_MAX_DIMENSION, settings.MEDIA_MAX_PIXELS, encoding_profile(profile), overlays,
+    )
+
+
+def resolution_key(size):
+    """``MediaFile.overlays`` key of a ``(width, height)`` video size."""
+    return f"{size[0]}x{size[1]}"
+
+
+def store_converted(storage, name, converted):
+    """
+    Store the output of ``lib.imaging.convert`` for the stored image
+    ``name``: the WebP, if one was encoded, and the variants and overlays
+    next to it, streamed from the files ``convert`` wrote. Returns ``(webp
+    name, {width: variant name}, {resolution: overlay name})``, keyed the way
+    ``MediaFile.variants`` and ``MediaFile.overlays`` are.
+    """
+    def save(stored_name, path):
+        with open(path, 'rb') as converted_file:
+            saved.append(storage.save(stored_name, File(converted_file)))
+        return saved[-1]
+
+    saved = []
+    try:
+        webp_name = name
+        if converted['webp'] is not None:
+            webp_name = save(os.path.splitext(name)[0] + ".webp", converted['webp'])
+        variants = {}
+        for width, path in sorted(converted['variants'].items(), key=lambda item: int(item[0])):
+            variants[width] = save(variant_name(webp_name, width), path)
+        overlays = {}
+        for key, path in sorted(converted.get('overlays', {}).items()):
+            overlays[key] = save(f"{os.path.splitext(webp_name)[0]}_overlay_{key}.png", path)
+    except Exception:
+        for saved_name in saved:
+            storage.delete(saved_name)
+        raise
+    return webp_name, variants, overlays
+
+
+def delete_variants(storage, *variants):
+    """Delete the files of ``MediaFile.variants`` and ``MediaFile.overlays`` dicts."""
+    for names in variants:
+        for name in names.values():
+            storage.delete(name)
+
+
+def registered_media_fields():
+    """``(model, field name)`` of every field listed in a model's ``media_fields``."""
+    return [
+        (model, field_name)
+        for model in apps.get_models() if issubclass(model, MediaFieldsMixin)
+        for field_name in model.media_fields
+    ]
+
+
+def rows_holding(name):
+    """One queryset per media field, of the rows holding the stored file ``name``."""
+    return [
+        (model.objects.filter(**{field_name: name}), field_name) for model, field_name in registered_media_fields()
+    ]
+
+
+def add_references(name, count=1):
+    """Count ``count`` more rows holding ``name``; returns 0 when it has no ``MediaFile``."""
+    return MediaFile.objects.filter(name=name).update(references=F('references') + count)
+
+
+def release_references(names):
+    """
+    Drop one reference for every occurrence of a name in ``names``. Files
+    stored under their hash that are left without references are deleted
+    once the transaction commits, together with their variants and overlays.
+    """
+    counts = Counter(name for name in names if name)
+    for name, count in counts.items():
+        MediaFile.objects.filter(name=name, references__gt=0).update(references=Greatest(F('references') - count, 0))
+
+    orphaned = MediaFile.objects.filter(name__in=counts, references=0, content_hash__isnull=False)
+    for media_file in orphaned:
+        # Conditional: an upload of the same bytes may have taken a reference meanwhile.
+        if MediaFile.objects.filter(pk=media_file.pk, references=0).delete()[0]:
+            stored = [media_file.name, *media_file.variants.values(), *media_file.overlays.values()]
+            transaction.on_commit(lambda stored=stored: [default_storage.delete(name) for name in stored])
+
+
+def store_upload(instance, field_name, field_file, status):
+    """
+    Store the new upload in ``field_file`` under its content hash and take a
+    reference on it. Returns ``(name, created)``; ``created`` is false when a
+    file with the same bytes was already stored, in which case nothing is
+    written and ``status`` is ignored.
+    """
+    field = field_file.field
+    digest = content_hash(field_file.file)
+    while True:
+        existing = MediaFile.objects.filter(content_hash=digest).values_list('name', flat=True).first()
+        if existing is not None:
+            if add_references(existing):
+                return existing, False
+            # Released in between; store it again.
+            continue
+
+        upload_name = field.generate_filename(instance, field_file.name)
+        target = posixpath.join(
+            posixpath.dirname(upload_name), digest + os.path.splitext(upload_name)[1].lower()
+        )
+        name = field.storage.save(target, field_file.file, max_length=field.max_length)
+        _, created = MediaFile.objects.get_or_create(
+            content_hash=digest,
+            # Image headers are read right away; videos are probed by the media worker.
+            defaults={
+                'name': name, 'status': status, 'references': 1,
+                **(probe_media(field.storage, name) if is_image(name) else {}),
+            },
+        )
+        if created:
+            return name, True
+        # Another upload of the same bytes won the race.
+        field.storage.delete(name)
+
+
+def probe_media(storage, name):
+    """
+    ``MediaFile`` metadata (width, height, duration, codec, size) of the
+    stored file ``name``; images are read from their header, everything else
+    with ffprobe. Returns what could be read, which may be nothing.
+    """
+    try:
+        if is_image(name):
+            with storage.open(name) as source, Image.open(source) as image:
+                return {
+                    'width': image.width, 'height': image.height, 'codec': image.format.lower(),
+                    'size': storage.size(name),
+                }
+
+        probe = ffmpeg.probe(storage.path(name))
+        stream = next(
+            (stream for stream in probe['streams'] if stream.get('codec_type') == 'video'), probe['streams'][0]
+        )
+        return {
+            'width': stream.get('width'), 'height': stream.get('height'), 'codec': stream.get('codec_name'),
+            'duration': float(probe['format']['duration']) if 'duration' in probe['format'] else None,
+            'size': int(probe['format'].get('size') or storage.size(name)),
+        }
+    except Exception:
+        logger.warning("Could not read the metadata of %s", name, exc_info=True)
+        return {}
+
+
+def converted_metadata(converted):
+    """Metadata of an image after ``lib.imaging.convert``, which may have scaled and re-encoded it."""
+    width, height = converted['size']
+    metadata = {'width': width, 'height': height}
+    if converted['webp'] is not None:
+        metadata.update(codec='webp', size=os.path.getsize(converted['webp']))
+    return metadata
+
+
+def record_media_metadata(storage, name):
+    """Probe the stored file ``name`` and save the metadata on its ``MediaFile``; returns the metadata."""
+    metadata = probe_media(storage, name)
+    if metadata:
+        MediaFile.objects.filter(name=name).update(**metadata)
+    return metadata
+
+
+def media_dimensions(media_file, name, storage=default_storage):
+    """
+    ``(width, height)`` of the stored file ``name``, as recorded on its
+    ``MediaFile`` (``None`` for files stored without one) when it was
+    uploaded. Files whose dimensions were never recorded are probed instead;
+    raises ``MediaProcessingError`` when they cannot be read either.
+    """
+    if media_file is not None and media_file.width and media_file.height:
+        return media_file.width, media_file.height
+
+    metadata = probe_media(storage, name)
+    if not (metadata.get('width') and metadata.get('height')):
+        raise MediaProcessingError(f"Could not read the dimensions of {name}")
+    if media_file is not None:
+        MediaFile.objects.filter(pk=media_file.pk).update(**metadata)
+    return metadata['width'], metadata['height']
+
+
+def queue_media_processing(instance, field_name):
+    """Process the stored file of ``instance.field_name`` once the transaction commits."""
+    from app_modules.master.tasks import process_media_file
+
+    name = getattr(instance, field_name).name
+    model_label = instance._meta.label
+    transaction.on_commit(lambda: process_media_file.delay(model_label, field_name, name))
+
+
+def process_image(model, field_name, name):
+    """
+    Encode the stored image ``name`` of ``model.field_name`` as WebP unless it
+    already is one small enough, store its size variants (and video overlays
+    for ``overlay_fields``), and swap every row
+    of any media field still holding ``name`` over to the WebP. Returns the
+    name the rows now hold, or ``None`` when the file was claimed by another
+    worker, failed, or was replaced before the swap.
+    """
+    claimed = MediaFile.objects.filter(
+        name=name, status__in=[MediaFile.PENDING, MediaFile.FAILED]
+    ).update(status=MediaFile.PROCESSING, modified=timezone.now())
+    if not claimed:
+        return None
+
+    storage = model._meta.get_field(field_name).storage
+    try:
+        resolutions = settings.VIDEO_CANONICAL_RESOLUTIONS if field_name in model.overlay_fields else ()
+        with local_path(storage, name) as path, tempfile.TemporaryDirectory(prefix='convert_') as output_dir:
+            converted = convert_image(
+                path, output_dir, needs_webp(name), model.media_profiles.get(field_name), overlays=resolutions
+            )
+            webp_name, variants, overlays = store_converted(storage, name, converted)
+            metadata = converted_metadata(converted)
+    except Exception as exc:
+        logger.exception("Processing of %s failed", name)
+        MediaFile.objects.filter(name=name).update(status=MediaFile.FAILED, error=str(exc))
+        return None
+
+    with transaction.atomic():
+        if webp_name != name:
+            swapped = sum(rows.update(**{field: webp_name}) for rows, field in rows_holding(name))
+        else:
+            swapped = any(rows.exists() for rows, field in rows_holding(name))
+        if swapped:
+            MediaFile.objects.filter(name=name).update(
+                name=webp_name, status=MediaFile.DONE, error=None, variants=variants, overlays=overlays,
+                **metadata,
+            )
+        else:
+            MediaFile.objects.filter(name=name, references=0).delete()
+            # Still referenced by a row that is not committed yet; leave it to a retry.
+            MediaFile.objects.filter(name=name).update(
+                status=MediaFile.FAILED, error="No row held the file at the swap."
+            )
+
+    if not swapped:
+        if webp_name != name:
+            storage.delete(webp_name)
+        delete_variants(storage, variants, overlays)
+        return None
+
+    logger.info("MEDIA %s -> %s (variants %s)", name, webp_name, ', '.join(variants) or 'none')
+    return webp_name
+
+
+def count_media(counter):
+    key = f"media_counter:{counter}"
+    cache.add(key, 0, timeout=None)
+    cache.incr(key)
+
+
+def media_counters():
+    """How many images were queued for processing and how many saves skipped it, and why."""
+    values = cache.get_many([f"media_counter:{counter}" for counter in MEDIA_COUNTERS])
+    return {counter: values.get(f"media_counter:{counter}", 0) for counter in MEDIA_COUNTERS}
+
+
+class MediaFieldsMixin:
+    """
+    Stores new uploads to ``media_fields`` under their content hash, keeps
+    the reference counts of the files the row holds, and queues the
+    background processing of new images; override ``converts_to_webp`` to
+    leave some rows unprocessed.
+
+    The names of the stored files are their content fingerprints and are
+    remembered when a row is loaded, so a save that leaves a field alone, or
+    uploads the bytes it already holds, never reads or encodes the image.
+    Both are counted (see ``media_counters``).
+    """
+    media_fields = ()
+    # Field name -> MEDIA_ENCODING_PROFILES name; other fields use the default profile.
+    media_profiles = {}
+    # Fields holding frames drawn over videos; they get an overlay per
+    # VIDEO_CANONICAL_RESOLUTIONS size when processed.
+    overlay_fields = ()
+
+    def converts_to_webp(self, field_name):
+        return True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        instance._stored_media = {
+            field_name: loaded[field_name] for field_name in cls.media_fields if field_name in loaded
+        }
+        return instance
+
+    def stored_media(self):
+        """``{field name: file name}`` as the row currently holds them in the database."""
+        stored = getattr(self, '_stored_media', {})
+        missing = [field_name for field_name in self.media_fields if field_name not in stored]
+        if missing and not self._state.adding:
+            stored.update(type(self).objects.filter(pk=self.pk).values(*missing).first() or {})
+        return stored
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        stored = self.stored_media()
+        added, released, processed = [], [], []
+        try:
+            for field_name in self.media_fields:
+                field_file = getattr(self, field_name)
+                processes = bool(field_file) and self.converts_to_webp(field_name) and is_image(field_file.name)
+                if update_fields is not None and field_name not in update_fields:
+                    if processes:
+                        count_media(SKIPPED_UNCHANGED)
+                    continue
+                if is_new_upload(field_file):
+                    name, created = store_upload(
+                        self, field_name, field_file, MediaFile.PENDING if processes else MediaFile.DONE
+                    )
+                    setattr(self, field_name, name)
+                    if created and not is_image(name):
+                        # Videos get their dimensions and duration probed off the request.
+                        processed.append(field_name)
+                    if processes:
+                        count_media(QUEUED if created else SKIPPED_DUPLICATE)
+                        if created:
+                            processed.append(field_name)
+                elif (field_file.name or None) != (stored.get(field_name) or None):
+                    if field_file.name:
+                        add_references(field_file.name)
+                else:
+                    if processes:
+                        count_media(SKIPPED_UNCHANGED)
+                    continue
+                added.append(getattr(self, field_name).name)
+                released.append(stored.get(field_name))
+
+            super().save(*args, **kwargs)
+        except Exception:
+            # Inside a transaction the rollback takes the references back.
+            if not transaction.get_connection().in_atomic_block:
+                release_references(added)
+            raise
+
+        release_references(released)
+        self._stored_media = {
+            **stored,
+            **{
+                field_name: getattr(self, field_name).name for field_name in self.media_fields
+                if update_fields is None or field_name in update_fields
+            },
+        }
+        for field_name in processed:
+            queue_media_processing(self, field_name)
+
+
+def release_deleted_media(sender, instance, **kwargs):
+    release_references(getattr(instance, field_name).name for field_name in sender.media_fields)
+
+
+def connect_media_signals():
+    for model in {model for model, field_name in registered_media_fields()}:
+        post_delete.connect(
+            release_deleted_media, sender=model, dispatch_uid=f'release_deleted_media_{model._meta.label}'
+        )
+
+
+def file_key(media_file, name):
+    """Content hash of a stored file; files stored before hashing fall back to a hash of the name."""
+    if media_file is not None and media_file.content_hash:
+        return media_file.content_hash
+    return hashlib.sha256(name.encode()).hexdigest()
+
+
+def requested_width(request):
+    """
+    Width in pixels the client wants images at: ``?size=`` first, then the
+    ``Sec-CH-Width`` hint, then ``Sec-CH-Viewport-Width`` times ``Sec-CH-DPR``.
+    ``None`` asks for the original.
+    """
+    if request is None:
+        return None
+
+    headers = request.headers
+    size = getattr(request, 'query_params', request.GET).get('size')
+    if size is None:
+        size = headers.get('Sec-CH-Width') or headers.get('Width')
+    try:
+        if size is None:
+            viewport = headers.get('Sec-CH-Viewport-Width') or headers.get('Viewport-Width')
+            dpr = headers.get('Sec-CH-DPR') or headers.get('DPR') or 1
+            return round(float(viewport) * float(dpr)) if viewport else None
+        return round(float(size)) or None
+    except ValueError:
+        return None
+
+
+def pick_variant(variants, width):
+    """Name of the narrowest variant at least ``width`` wide, or ``None`` to use the original."""
+    for variant_width in sorted(variants, key=int):
+        if int(variant_width) >= width:
+            return variants[variant_width]
+    return None
+
+
+class MediaFileLookupMixin:
+    """
+    Serializer field reading the ``MediaFile`` of its file. When the field
+    belongs to the child of a list serializer, the files of the whole list are
+    read with one query and kept in the serializer context.
+    """
+
+    def media_file(self, value):
+        media_files = self.context.setdefault('media_files', {})
+        if value.name not in media_files:
+            names = {value.name}
+            instances = getattr(self.root, 'instance', None)
+            if self.parent is getattr(self.root, 'child', None) and isinstance(instances, (list, QuerySet)):
+                for instance in instances:
+                    try:
+                        field_file = self.get_attribute(instance)
+                    except (AttributeError, KeyError, ObjectDoesNotExist):
+                        continue
+                    if field_file:
+                        names.add(field_file.name)
+            found = {
+                media_file.name: media_file
+                for media_file in MediaFile.objects.filter(name__in=names).only('name', 'status', 'variants', *METADATA_FIELDS)
+            }
+            media_files.update({name: found.get(name) for name in names})
+        return media_files[value.name]
+
+
+class MediaStatusField(MediaFileLookupMixin, serializers.ReadOnlyField):
+    """
+    Processing status ("pending", "processing", "done" or "failed") of the
+    file in ``source``, or ``None`` for files that needed no processing.
+    """
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        media_file = self.media_file(value)
+        return media_file.status if media_file else None
+
+
+class MediaMetadataField(MediaFileLookupMixin, serializers.ReadOnlyField):
+    """
+    ``{"width", "height", "duration", "codec", "bytes"}`` of the file in
+    ``source`` as recorded when it was stored, so clients can lay it out
+    before downloading it; ``None`` when nothing was recorded.
+    """
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        media_file = self.media_file(value)
+        if media_file is None or media_file.size is None:
+            return None
+        return {
+            'width': media_file.width,
+            'height': media_file.height,
+            'duration': media_file.duration,
+            'codec': media_file.codec,
+            'bytes': media_file.size,
+        }
+
+
+class ResponsiveFileMixin(MediaFileLookupMixin):
+    """File field returning the URL of the size variant matching ``requested_width``."""
+
+    def to_representation(self, value):
+        if not value:
+            return None
+
+        request = self.context.get('request', None)
+        width = requested_width(request)
+        media_file = self.media_file(value) if width and self.use_url else None
+        name = media_file and pick_variant(media_file.variants, width)
+        if not name:
+            return super().to_representation(value)
+
+        url = value.storage.url(name)
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
+class ResponsiveFileField(ResponsiveFileMixin, serializers.FileField):
+    pass
+
+
+class ResponsiveImageField(ResponsiveFileMixin, serializers.ImageField):
+    pass
+
+
+class ResponsiveMediaSerializerMixin:
+    """``ModelSerializer`` mixin serving the model's file and image fields through their size variants."""
+    serializer_field_mapping = {
+        **serializers.ModelSerializer.serializer_field_mapping,
+        models.FileField: ResponsiveFileField,
+        models.ImageField: ResponsiveImageField,
+    }
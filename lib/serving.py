@@ -0,0 +1,95 @@
+"""
+Files sent by nginx after Django has authorized the request.
+
+Django answers with an empty response carrying ``X-Accel-Redirect`` to an
+``internal`` nginx location and the headers it wants; nginx then sends the
+file itself, with ``Range``/``206``, ``ETag`` and ``Last-Modified`` handled
+by its static module, so no Python worker ever streams media bytes or is
+re-entered when a player seeks. Without nginx in front (``*_ACCEL_REDIRECT``
+off, e.g. in development) the file is sent by Django instead.
+
+Media under ``MEDIA_PRIVATE_PREFIXES`` needs an authenticated user or a
+``?token=`` from ``sign_media_url``, for players that cannot send the
+``Authorization`` header; the rest of ``MEDIA_ROOT`` is public and is served
+by nginx straight from its ``/media/`` location.
+"""
+import mimetypes
+import os
+import posixpath
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.signing import BadSignature, TimestampSigner
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from rest_framework.permissions import AllowAny
+from rest_framework.views import APIView
+
+MEDIA_SIGNING_SALT = 'lib.serving.media'
+
+# Stored names never change content: uploads are named by their content hash
+# or a random id, renders by the hash of their inputs.
+PUBLIC_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+PRIVATE_CACHE_CONTROL = 'private, max-age=86400'
+
+
+def accel_file_response(root, internal_url, path, accel_redirect, cache_control, content_type=None):
+    """Response sending the file ``path``, relative to ``root``, through the nginx location ``internal_url``."""
+    try:
+        full_path = safe_join(root, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    content_type = content_type or mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    if accel_redirect:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = internal_url + path
+    else:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    response['Cache-Control'] = cache_control
+    return response
+
+
+def is_private_media(path):
+    return any(path.startswith(prefix) for prefix in settings.MEDIA_PRIVATE_PREFIXES)
+
+
+def sign_media_url(url):
+    """``url`` of a file under ``MEDIA_URL`` with a ``token`` that opens it for ``MEDIA_SIGNED_URL_MAX_AGE``."""
+    path = url[len(settings.MEDIA_URL):]
+    token = TimestampSigner(salt=MEDIA_SIGNING_SALT).sign(path)[len(path) + 1:]
+    return f"{url}?token={token}"
+
+
+def has_valid_token(path, token):
+    try:
+        TimestampSigner(salt=MEDIA_SIGNING_SALT).unsign(
+            f"{path}:{token}", max_age=settings.MEDIA_SIGNED_URL_MAX_AGE
+        )
+    except BadSignature:
+        return False
+    return True
+
+
+class MediaFileView(APIView):
+    """``GET MEDIA_URL<path>``: authorize the request and hand the file to nginx."""
+    permission_classes = [AllowAny]
+
+    def perform_authentication(self, request):
+        # Public media must not fail on a stale token; authenticate on demand.
+        pass
+
+    def get(self, request, path):
+        path = posixpath.normpath(path).lstrip('/')
+        private = is_private_media(path)
+        if private:
+            token = request.query_params.get('token')
+            if not (token and has_valid_token(path, token)) and not request.user.is_authenticated:
+                self.permission_denied(request, message="Authentication or a valid token is required.")
+
+        return accel_file_response(
+            settings.MEDIA_ROOT, settings.MEDIA_INTERNAL_URL, path, settings.MEDIA_ACCEL_REDIRECT,
+            PRIVATE_CACHE_CONTROL if private else PUBLIC_CACHE_CONTROL,
+        )